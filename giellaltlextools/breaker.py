@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Circuit breaker for paradigm slots that fail for lemma after lemma.
+
+A wrong tag string in a paradigm file, or a slot broken for a whole
+inflection class, fails for every lemma. After a number of failures in a
+row, counted for each slot and for each slot within a continuation class,
+the slot is broken: it is only tested for a sample of the lemmas, and the
+rest are counted as failures without testing. A sampled test that passes
+mends the slot, and it is tested for all lemmas again.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from .lexc import ENTRY, lexclemma, readlexclines
+
+
+def lemmacontlexes(filenames: Iterable[str],
+                   cache: bool = True) -> dict[str, str]:
+    """Get the continuation lexicon of the first entry of each lemma."""
+    contlexes: dict[str, str] = {}
+    for filename in filenames:
+        for line in readlexclines(filename, cache):
+            if line.kind != ENTRY or not line.upper:
+                continue
+            lemma = lexclemma(line.upper)
+            if lemma and lemma not in contlexes:
+                contlexes[lemma] = line.contlex
+    return contlexes
+
+
+@dataclass
+class BrokenSlot:
+    """What happened to a slot after it broke."""
+
+    slot: str
+    contlex: Optional[str]
+    sampled: int = 0
+    failed: int = 0
+    skipped: int = 0
+    seen: int = 0
+    mended: bool = False
+
+    def describe(self, limit: int) -> str:
+        where = f" in continuation class {self.contlex}" \
+            if self.contlex is not None else ""
+        mended = ", works again" if self.mended else ""
+        return (f"{self.slot}{where}: failed {limit} times in a row, then "
+                f"{self.failed} of {self.sampled} sampled, "
+                f"{self.skipped} not tested{mended}")
+
+
+class SlotBreaker:
+    """Failure streaks of slots and the slots broken by them.
+
+    A slot breaks after limit failures in a row, either for all lemmas or
+    for the lemmas of one continuation class, and then only every sample-th
+    lemma is tested. A limit of 0 never breaks slots.
+    """
+
+    def __init__(self, limit: int, sample: int = 10):
+        self.limit = limit
+        self.sample = max(1, sample)
+        self.streaks: Counter = Counter()
+        self.broken: dict[tuple, BrokenSlot] = {}
+
+    def _keys(self, slot: str, contlex: Optional[str]) -> list[tuple]:
+        return [(slot, None), (slot, contlex)] if contlex is not None \
+            else [(slot, None)]
+
+    def should_test(self, slot: str, contlex: Optional[str]) -> bool:
+        """Check if the slot is to be tested for the next lemma."""
+        for key in self._keys(slot, contlex):
+            broken = self.broken.get(key)
+            if broken and not broken.mended:
+                broken.seen += 1
+                if broken.seen % self.sample:
+                    broken.skipped += 1
+                    return False
+                return True
+        return True
+
+    def record(self, slot: str, contlex: Optional[str], failed: bool):
+        """Note the result of testing the slot for a lemma."""
+        for key in self._keys(slot, contlex):
+            broken = self.broken.get(key)
+            if broken and not broken.mended:
+                broken.sampled += 1
+                broken.failed += failed
+            if not failed:
+                self.streaks[key] = 0
+                if broken:
+                    broken.mended = True
+                continue
+            self.streaks[key] += 1
+            if self.limit and self.streaks[key] >= self.limit:
+                if broken:
+                    broken.mended = False
+                else:
+                    self.broken[key] = BrokenSlot(*key)
+
+    def report(self) -> list[str]:
+        """Describe each broken slot once.
+
+        A slot broken for all lemmas is not described again for its
+        continuation classes.
+        """
+        return [broken.describe(self.limit)
+                for (slot, contlex), broken in self.broken.items()
+                if contlex is None or (slot, None) not in self.broken]
+
+
+if __name__ == "__main__":
+    pass
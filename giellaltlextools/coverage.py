@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Following coverage of a test to stop when its result is decided.
+
+Coverage is the percentage of tested lines without failures, as in the test
+tools: 100 × (1 - failures / lines). Every tested item, i.e. lemma, makes
+some lines and up to some number of failures. Exact bounds of the final
+coverage follow from assuming the rest of the items all pass or all fail as
+badly as they can. With random sampling, a confidence interval of the final
+coverage can decide the result much earlier. The interval is only looked at
+when the sample has doubled, and the confidence is split over the looks, so
+that looking many times does not make wrong decisions more likely.
+"""
+
+from math import ceil, floor, log2, sqrt
+from statistics import NormalDist
+from typing import Optional
+
+# sample size of the first look at the confidence interval
+MIN_SAMPLE = 32
+
+
+def wilson_interval(score: float, n: float, z: float) -> tuple[float, float]:
+    """Wilson score interval of a proportion of score out of n."""
+    if n <= 0:
+        return 0.0, 1.0
+    p = score / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half = z / denominator * sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+class CoverageMonitor:
+    """Coverage of total items under test against a threshold.
+
+    Each item has lines lines and up to max_failures failures. known items
+    passed without testing, e.g. unchanged since the previous run.
+    """
+
+    def __init__(self, total: int, threshold: float, *, lines: int = 1,
+                 max_failures: int = 1, known: int = 0,
+                 confidence: float = 0.95):
+        self.total = total
+        self.threshold = threshold
+        self.lines = lines
+        self.max_failures = max_failures
+        self.known = known
+        self.confidence = confidence
+        looks = 1
+        if total > MIN_SAMPLE:
+            looks += ceil(log2(total / MIN_SAMPLE))
+        self.z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * looks))
+        self.tested = 0
+        self.failures = 0
+
+    def add(self, failures: int):
+        """Count an item tested with failures."""
+        self.tested += 1
+        self.failures += failures
+
+    def coverage(self, failures: float) -> float:
+        """Get coverage of all items with so many failures in total."""
+        return (1.0 - failures /
+                ((self.total + self.known) * self.lines)) * 100.0
+
+    def bounds(self) -> tuple[float, float]:
+        """Get lowest and highest possible final coverage."""
+        remaining = self.total - self.tested
+        return (self.coverage(self.failures +
+                              remaining * self.max_failures),
+                self.coverage(self.failures))
+
+    def interval(self) -> tuple[float, float]:
+        """Get confidence interval of final coverage from random sample.
+
+        The failure rate of the tested items is estimated with a Wilson
+        interval, made narrower by finite population correction as the
+        sample grows to cover all items.
+        """
+        if self.tested >= self.total:
+            return self.bounds()
+        score = self.failures / self.max_failures
+        effective = self.tested * (self.total - 1) / \
+            (self.total - self.tested)
+        low, high = wilson_interval(score * effective / self.tested
+                                    if self.tested else 0.0,
+                                    effective, self.z)
+        return (self.coverage(high * self.total * self.max_failures),
+                self.coverage(low * self.total * self.max_failures))
+
+    def looking(self) -> bool:
+        """Check if the sample has grown enough to look at the interval."""
+        n = self.tested
+        return n >= MIN_SAMPLE and n & (n - 1) == 0
+
+    def decided(self, sampling: bool = False) -> Optional[bool]:
+        """Check if the result is decided, True for pass, False for fail.
+
+        Decided exactly by the bounds or, if sampling, by the confidence
+        interval. Gives None if the result is still open.
+        """
+        looks = [self.bounds()]
+        if sampling and self.looking():
+            looks.append(self.interval())
+        for low, high in looks:
+            if low >= self.threshold:
+                return True
+            if high < self.threshold:
+                return False
+        return None
+
+    def report(self, sampling: bool = False) -> str:
+        """Describe the range of final coverage and its confidence."""
+        low, high = self.bounds()
+        confidence = 100.0
+        if sampling and self.tested < self.total:
+            low, high = self.interval()
+            confidence = self.confidence * 100.0
+        # truncated so that e.g. 99.999 is not shown as 100
+        low = floor(low * 100) / 100
+        high = floor(high * 100) / 100
+        return (f"coverage between {low:.2f} % and {high:.2f} % with "
+                f"{confidence:g} % confidence after {self.tested} of "
+                f"{self.total} lemmas")
+
+
+if __name__ == "__main__":
+    pass
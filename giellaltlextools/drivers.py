@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""Registry of the ways to run HFST automata.
+
+All drivers give out transducers with the same interface: `lookup(s)`
+returning a list of [output, weight] pairs, `lookup_many(strings)` yielding
+(input, analyses) pairs in input order, and `close()`. Lookups can be bounded
+with `max_results` and a `time_cutoff` in seconds, and `exists(s)` and
+`contains(s, output)` answer yes-or-no questions with as little searching as
+the driver can do.
+"""
+
+import multiprocessing
+import os
+import shutil
+from argparse import ArgumentTypeError
+from collections import defaultdict
+from itertools import chain, islice
+from threading import Lock, Thread
+from time import time
+from typing import Callable, Iterable, Iterator, Optional, Protocol
+
+from .hfst import load_hfst_forked, load_hfst_pyhfst
+from .hfstpope import load_hfst_pope, load_hfst_pope_pool
+
+# inputs looked up to time the drivers when choosing one automatically
+CALIBRATION_SAMPLE = ["a", "ja", "talo", "viessu", "giella", "dieđut",
+                      "sámegiella", "guolli+N+Sg+Nom", "boahtit+V+Inf",
+                      "xyzzy"] * 20
+# how many strings lookup_batch looks up between checks of its deadline
+DEADLINE_CHUNK = 1000
+# how many strings a SharedTransducer looks up in one turn
+SHARED_CHUNK = 256
+
+
+class LookupTransducer(Protocol):
+    """What all drivers give out."""
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0) -> list:
+        ...
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        ...
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        ...
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        ...
+
+    def close(self):
+        ...
+
+
+# name => (loader, whether the loader takes a worker count)
+DRIVERS: dict[str, tuple[Callable, bool]] = {}
+# loaded transducers by (file, driver) so each file is loaded only once
+_loaded: dict[tuple[str, str], LookupTransducer] = {}
+_loading: dict[tuple[str, str], Lock] = defaultdict(Lock)
+
+
+def register_driver(name: str, loader: Callable, pooled: bool = False):
+    """Make a driver available by name.
+
+    loader gets a file name, and for pooled drivers also a worker count
+    where 0 means a default size, and returns a LookupTransducer.
+    """
+    DRIVERS[name] = (loader, pooled)
+
+
+def available_drivers() -> list[str]:
+    """List drivers that can be used on this machine."""
+    names = []
+    for name in DRIVERS:
+        if name.startswith("subprocess") and not shutil.which("hfst-lookup"):
+            continue
+        if name == "pyhfst-fork" and \
+                "fork" not in multiprocessing.get_all_start_methods():
+            continue
+        names.append(name)
+    return names
+
+
+def parse_driver(driver: str) -> tuple[str, int]:
+    """Split driver name like `subprocess-pool:8` into name and workers.
+
+    Raises ValueError if there is no such driver.
+    """
+    name, _, workers = driver.partition(":")
+    if name == "auto" and not workers:
+        return name, 0
+    if name not in DRIVERS:
+        raise ValueError(f"unknown driver {name}")
+    if not workers:
+        return name, 0
+    if not DRIVERS[name][1] or not workers.isdigit():
+        raise ValueError(f"bad worker count in {driver}")
+    return name, int(workers)
+
+
+def forks_workers(driver: str) -> bool:
+    """Check if a driver forks worker processes when loading."""
+    return parse_driver(driver)[0] == "pyhfst-fork"
+
+
+def driver_spec(driver: str) -> str:
+    """Check a driver name given on command-line."""
+    try:
+        parse_driver(driver)
+    except ValueError as e:
+        choices = ", ".join(list(DRIVERS) + ["auto"])
+        raise ArgumentTypeError(f"{e} (choose from {choices}, "
+                                "with :N for worker count of pools)") from e
+    return driver
+
+
+def calibrate(filename: str, sample: Optional[list[str]] = None,
+              verbose: bool = False) -> tuple[str, LookupTransducer]:
+    """Load automaton with each available driver and keep the fastest.
+
+    The speed is measured as time to look up sample once the automaton is
+    loaded, so load time only breaks ties. Pools are not tried: the sample
+    is too short for their workers to pay off, and loading them would start
+    a full pool of workers for each.
+    """
+    if not sample:
+        sample = CALIBRATION_SAMPLE
+    best = None
+    for name in available_drivers():
+        loader, pooled = DRIVERS[name]
+        if pooled:
+            continue
+        start = time()
+        transducer = loader(filename)
+        loaded = time()
+        for _ in transducer.lookup_many(sample):
+            pass
+        used = (time() - loaded, loaded - start)
+        if verbose:
+            print(f"driver {name} loaded in {used[1]} and used {used[0]} "
+                  f"for {len(sample)} lookups")
+        if best is None or used < best[0]:
+            if best:
+                best[2].close()
+            best = (used, name, transducer)
+        else:
+            transducer.close()
+    if best is None:
+        raise ValueError("no usable drivers")
+    return best[1], best[2]
+
+
+def load_transducer(filename: str, driver: str = "subprocess",
+                    sample: Optional[list[str]] = None,
+                    verbose: bool = False) -> LookupTransducer:
+    """Load HFST automaton from a named file using named driver.
+
+    Driver `auto` tries the available drivers that are not pools and picks
+    the one with the fastest lookups, sample can give lookups that are
+    representative for the task to time them on.
+    Loading the same file with the same driver again gives the already
+    loaded transducer.
+    """
+    key = (os.path.abspath(filename), driver)
+    with _loading[key]:
+        if key in _loaded:
+            return _loaded[key]
+        name, workers = parse_driver(driver)
+        if name == "auto":
+            name, transducer = calibrate(filename, sample, verbose)
+            if verbose:
+                print(f"selected driver {name} for {filename}")
+        else:
+            loader, pooled = DRIVERS[name]
+            if pooled:
+                transducer = loader(filename, workers)
+            else:
+                transducer = loader(filename)
+        _loaded[key] = transducer
+    return transducer
+
+
+class LazyTransducer:
+    """Transducer that is only loaded when it is first used.
+
+    Loading can also be started in the background with start_loading, so
+    that several automata load at the same time or while other work is
+    done. load_time tells how long the loading took and wait_time how long
+    lookups were held up waiting for it.
+
+    Drivers that fork worker processes are loaded at once in the creating
+    thread instead, since forking while other threads run, or from one of
+    them, can leave the workers deadlocked on locks held at the fork.
+    """
+
+    def __init__(self, filename: str, driver: str = "subprocess",
+                 sample: Optional[list[str]] = None, verbose: bool = False):
+        self.filename = filename
+        self.driver = driver
+        self.sample = sample
+        self.verbose = verbose
+        self.transducer = None
+        self.load_time = 0.0
+        self.wait_time = 0.0
+        self.wait_start = None
+        self.lock = Lock()
+        if forks_workers(driver):
+            self._load()
+
+    @property
+    def loaded(self) -> bool:
+        return self.transducer is not None
+
+    def _load(self) -> LookupTransducer:
+        with self.lock:
+            if self.transducer is None:
+                start = time()
+                self.transducer = load_transducer(self.filename, self.driver,
+                                                  self.sample, self.verbose)
+                self.load_time = time() - start
+        return self.transducer
+
+    def _load_quietly(self):
+        try:
+            self._load()
+        except Exception:  # raised again at first lookup
+            pass
+
+    def start_loading(self):
+        """Load the automaton in a background thread."""
+        if self.transducer is None:
+            Thread(target=self._load_quietly, daemon=True).start()
+
+    def load(self) -> LookupTransducer:
+        """Get the loaded automaton, waiting for it if needed."""
+        if self.transducer is not None:
+            return self.transducer
+        start = time()
+        if self.wait_start is None:
+            self.wait_start = start
+        transducer = self._load()
+        # threads waiting together are held up only once
+        self.wait_time = max(self.wait_time, time() - self.wait_start)
+        return transducer
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0) -> list:
+        return self.load().lookup(s, max_results, time_cutoff)
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        return self.load().exists(s, time_cutoff)
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        return self.load().contains(s, output, time_cutoff)
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        """Look up many strings, loading the automaton only if there are."""
+        strings = iter(strings)
+        for first in strings:
+            yield from self.load().lookup_many(chain([first], strings))
+
+    def close(self):
+        if self.transducer is not None:
+            self.transducer.close()
+
+
+def lookup_batch(transducer: LookupTransducer, strings: list[str],
+                 time_cutoff: float = 0.0,
+                 expired: Optional[Callable[[], bool]] = None
+                 ) -> dict[str, list]:
+    """Look up strings in bulk, or one by one if time-limited.
+
+    With expired, the strings are looked up DEADLINE_CHUNK at a time until
+    expired() is true, and the strings left are not in the results.
+    """
+    if expired:
+        results = {}
+        for i in range(0, len(strings), DEADLINE_CHUNK):
+            if expired():
+                break
+            results.update(lookup_batch(transducer,
+                                        strings[i:i + DEADLINE_CHUNK],
+                                        time_cutoff))
+        return results
+    if time_cutoff:
+        return {s: transducer.lookup(s, time_cutoff=time_cutoff)
+                for s in strings}
+    return dict(transducer.lookup_many(strings))
+
+
+def exists_batch(transducer, strings: list[str], time_cutoff: float = 0.0,
+                 expired: Optional[Callable[[], bool]] = None
+                 ) -> dict[str, bool]:
+    """Check which strings have any results, one by one.
+
+    With expired, checking stops once expired() is true, and the strings
+    left are not in the results.
+    """
+    results = {}
+    for s in strings:
+        if expired and expired():
+            break
+        results[s] = transducer.exists(s, time_cutoff)
+    return results
+
+
+class SharedTransducer:
+    """Transducer that several threads can use at the same time.
+
+    The calls are taken in turns under a lock, so anything with the driver
+    interface, including caches in front of it, can be shared. Bulk lookups
+    take the lock for SHARED_CHUNK strings at a time, so that the threads
+    get turns in between.
+    """
+
+    def __init__(self, transducer):
+        self.transducer = transducer
+        self.lock = Lock()
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0) -> list:
+        with self.lock:
+            return self.transducer.lookup(s, max_results, time_cutoff)
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        with self.lock:
+            return self.transducer.exists(s, time_cutoff)
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        with self.lock:
+            return self.transducer.contains(s, output, time_cutoff)
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        strings = iter(strings)
+        while chunk := list(islice(strings, SHARED_CHUNK)):
+            with self.lock:
+                results = list(self.transducer.lookup_many(chunk))
+            yield from results
+
+    def close(self):
+        with self.lock:
+            self.transducer.close()
+
+    def cache_info(self):
+        """Get cache statistics of the shared transducer if it has them."""
+        with self.lock:
+            return self.transducer.cache_info()
+
+
+def close_transducers():
+    """Close all transducers loaded through load_transducer."""
+    for transducer in _loaded.values():
+        transducer.close()
+    _loaded.clear()
+
+
+register_driver("subprocess", load_hfst_pope)
+register_driver("subprocess-pool", load_hfst_pope_pool, pooled=True)
+register_driver("pyhfst", load_hfst_pyhfst)
+register_driver("pyhfst-fork", load_hfst_forked, pooled=True)
+
+
+if __name__ == "__main__":
+    pass
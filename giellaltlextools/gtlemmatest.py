@@ -4,29 +4,92 @@
 import json
 import sys
 import tempfile
-from argparse import ArgumentParser, FileType, Namespace
+import traceback
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+from io import StringIO
+from itertools import islice
 from os.path import basename
+from pathlib import Path
 from subprocess import Popen
 from time import time
-from typing import TextIO
+from typing import Callable, NamedTuple, Optional, TextIO
 
 from termcolor import colored, cprint
 
-from . import __version__
-from .hfst import load_hfst
-from .hfstpope import load_hfst_pope
-from .lexc import scrapelemmas
+from . import __version__, hfst
+from .coverage import CoverageMonitor
+from .drivers import (
+    LazyTransducer,
+    SharedTransducer,
+    driver_spec,
+    lookup_batch,
+)
+from .lexc import readlemmas
+from .lookupcache import MAX_BYTES, MAX_ENTRIES, CachingTransducer, LookupStore
+from .schedule import plan
+from .teststate import RunState, lemmadigests
+
+# what the exit statuses of sections mean
+SKIP_STATUS = 77
+SECTION_RESULTS = {0: "SUCCESS", 1: "FAIL", SKIP_STATUS: "SKIP", 99: "ERROR"}
+# how many lemmas are generated, and their failures analysed, in one go
+BATCH_LEMMAS = 5000
+# how many lemmas are in the first batch, the next ones grow to BATCH_LEMMAS
+FIRST_BATCH = 100
 
 
 def prettyprint_json(config):
-    """Pretty print JSON."""
-    for pos in ["verbs", "nouns", "adjectives", "propernouns"]:
+    """Pretty print JSON without changing config."""
+    config = deepcopy(config)
+    for pos in config_sections(config):
         config[pos]["lexcfile"] = ".../" + basename(config[pos]["lexcfile"])
     config["generator"] = ".../" + basename(config["generator"])
     config["analyser"] = ".../" + basename(config["analyser"])
     return json.dumps(config, indent=4, sort_keys=True)
 
 
+def generate_batch(generator, lemmas: list[str], tagstrings: list[str],
+                   exhaustive: bool = False, time_cutoff: float = 0.0,
+                   expired: Optional[Callable[[], bool]] = None
+                   ) -> dict[str, Optional[list]]:
+    """Generate the lemma and tag string combinations of a batch.
+
+    Gives (tagstring, generations) pairs for each lemma in tag string order.
+    With time_cutoff the lookups are made one by one anyway, so unless
+    exhaustive, the lemmas are first only checked for generating themselves
+    with contains(), stopping at the first tag string that does, and the
+    lemmas that do get None, as nothing is logged for them. Without it, the
+    bulk lookups sharing work between strings are cheaper. The remaining
+    lemmas are generated with all tag strings. With expired, generating
+    stops once expired() is true, and the lemmas not tested to the end by
+    then are left out.
+    """
+    generated: dict[str, Optional[list]] = {}
+    failed = lemmas
+    if time_cutoff and not exhaustive:
+        failed = []
+        for lemma in lemmas:
+            if expired and expired():
+                return generated
+            if any(generator.contains(lemma + tagstring, lemma, time_cutoff)
+                   for tagstring in tagstrings):
+                generated[lemma] = None
+            else:
+                failed.append(lemma)
+    queries = [lemma + tagstring for lemma in failed
+               for tagstring in tagstrings]
+    results = lookup_batch(generator, queries, time_cutoff, expired)
+    for lemma in failed:
+        if any(lemma + tagstring not in results for tagstring in tagstrings):
+            break
+        generated[lemma] = [(tagstring, results[lemma + tagstring])
+                            for tagstring in tagstrings]
+    return generated
+
+
 def main():
     """CLI for GiellaLT lemma generation tests."""
     argp = ArgumentParser()
@@ -36,6 +99,14 @@ def main():
     argp.add_argument("-T", "--threshold", type=int,
                       help="required percentage of succesful generations",
                       default=100)
+    argp.add_argument("--early-stop", action="store_true", default=False,
+                      help="stop as soon as the result of -T is decided")
+    argp.add_argument("--sample", action="store_true", default=False,
+                      help="test random lemmas until coverage is above or "
+                      "below -T with --confidence")
+    argp.add_argument("--confidence", type=float, default=0.95,
+                      metavar="LEVEL",
+                      help="confidence level of --sample (default 0.95)")
     argp.add_argument("-d", "--debug", action="store_true", default=False,
                       help="prints debugging outputs")
     argp.add_argument("-v", "--verbose", action="store_true", default=False,
@@ -43,190 +114,470 @@ def main():
     argp.add_argument("-Q", "--oov-limit", type=int, default=10_000,
                       help="stop trying after so many oovs")
     argp.add_argument("-B", "--time-out", type=int, default=60,
-                      help="max time to use with lemmas")
+                      help="max time to use with lemmas, testing earlier "
+                      "failures and changed lemmas first")
     argp.add_argument("-E", "--editor", type=str, metavar="EDITOR",
                       help="open failures in EDITOR afterwards")
-    argp.add_argument("-D", "--driver", choices=["subprocess", "pyhfst"],
+    argp.add_argument("-D", "--driver", type=driver_spec, metavar="DRIVER",
                       default="subprocess",
-                      help="use subprocess instead of pyhfst for hfst lookups")
+                      help="use subprocess, subprocess-pool[:N], pyhfst, "
+                      "pyhfst-fork[:N] or auto for hfst lookups")
+    argp.add_argument("--lookup-time-out", type=float, default=0.0,
+                      metavar="SECONDS",
+                      help="give up single lookups after SECONDS (0 for no "
+                      "limit)")
+    argp.add_argument("--cache-entries", type=int, default=MAX_ENTRIES,
+                      metavar="N",
+                      help="cache at most N lookup results (0 for no limit)")
+    argp.add_argument("--cache-bytes", type=int, default=MAX_BYTES,
+                      metavar="BYTES",
+                      help="cache at most BYTES of lookup results "
+                      "(0 for no limit)")
+    argp.add_argument("--persistent-cache", action="store_true",
+                      default=False,
+                      help="keep lookup results on disk between runs")
+    argp.add_argument("--cache-dir", type=Path, metavar="DIR",
+                      help="keep persistent cache in DIR instead of "
+                      "$XDG_CACHE_HOME/giellaltlextools")
+    argp.add_argument("--no-lexc-cache", action="store_false",
+                      dest="lexc_cache", default=True,
+                      help="parse lexc files again instead of using parsed "
+                      "results from earlier runs")
+    argp.add_argument("--map-cache", action="store_true", default=False,
+                      help="keep automata parsed by the pyhfst drivers in a "
+                      "memory-mappable cache (pure Python pyhfst 1.4 only)")
+    argp.add_argument("--state", type=str, metavar="STATEFILE",
+                      help="keep results in STATEFILE and only test new, "
+                      "changed and failed lemmas while the generator and "
+                      "tags stay the same")
     argp.add_argument("-c", "--config", type=open, metavar="CONFIG",
                       help="read json options from CONFIG", required=True)
     argp.add_argument("-P", "--pos", type=str, metavar="POS",
-                      help="read configs from POS section", required=True)
-    argp.add_argument("-L", "--log-file", type=FileType("w"),
+                      action="append", required=True,
+                      help="read configs from POS section; give several "
+                      "separated by commas or `all` to test them at the same "
+                      "time in one run")
+    argp.add_argument("-L", "--log-file", type=str,
                       dest="logfile", metavar="LOGFILE",
-                      help="save permanent markdown log in LOGFILE")
+                      help="save permanent markdown log in LOGFILE; with "
+                      "several sections `{pos}` in LOGFILE is replaced by "
+                      "the section or it is added before the suffix")
     options = argp.parse_args()
-    if options.logfile:
-        dostuff(options, options.logfile)
-    else:
-        with tempfile.NamedTemporaryFile(prefix="gtlemmatest", suffix=".md",
-                                         delete=False, encoding="UTF-8",
-                                         mode="w+") as logfile:
-            dostuff(options, logfile)
+    hfst.MAPCACHE = options.map_cache
+    configuration = json.load(options.config)
+    try:
+        sections = select_sections(options.pos, configuration)
+    except ValueError as e:
+        argp.error(str(e))
+    if len(sections) > 1:
+        sys.exit(checksections(options, configuration, sections))
+    transducers = load_transducers(configuration, options)
+    with open_log(options.logfile, sections[0], False) as logfile:
+        checksection(options, configuration, sections[0], transducers,
+                     logfile)
     print(colored("SUCCESS", "green"))
 
 
-def dostuff(options: Namespace, logfile: TextIO):
-    """Run lemma generation tests."""
-    configuration = json.load(options.config)
-    lexcfilename = configuration[options.pos]["lexcfile"]
-    print(f"# Lemma-tests for *{options.pos}* in ...`{basename(lexcfilename)}`",
-          file=logfile)
-    print(file=logfile)
+def config_sections(configuration: dict) -> list[str]:
+    """List the POS sections of a configuration in their order."""
+    return [key for key, value in configuration.items()
+            if isinstance(value, dict) and "lexcfile" in value]
+
+
+def select_sections(posargs: list[str], configuration: dict) -> list[str]:
+    """Get the sections named by -P options, in order and without repeats.
+
+    `all` stands for all sections of the configuration. Raises ValueError
+    for sections missing from the configuration.
+    """
+    known = config_sections(configuration)
+    sections = []
+    for posarg in posargs:
+        for name in posarg.split(","):
+            pos = name.strip()
+            if pos == "all":
+                sections.extend(known)
+            elif pos not in known:
+                raise ValueError(f"no section {pos} in config "
+                                 f"(has {', '.join(known)})")
+            else:
+                sections.append(pos)
+    return list(dict.fromkeys(sections))
+
+
+def section_logname(template: str, pos: str) -> str:
+    """Make log file name for section pos from the -L LOGFILE."""
+    if "{pos}" in template:
+        return template.replace("{pos}", pos)
+    path = Path(template)
+    return str(path.with_name(f"{path.stem}-{pos}{path.suffix}"))
+
+
+def open_log(template: Optional[str], pos: str, several: bool) -> TextIO:
+    """Open markdown log for section pos, a temporary one if not named."""
+    if template is None:
+        prefix = f"gtlemmatest-{pos}-" if several else "gtlemmatest"
+        return tempfile.NamedTemporaryFile(prefix=prefix, suffix=".md",
+                                           delete=False, encoding="UTF-8",
+                                           mode="w+")
+    if several:
+        template = section_logname(template, pos)
+    return open(template, "w", encoding="UTF-8")
+
+
+class Transducers(NamedTuple):
+    """Generator and analyser of a configuration."""
+
+    lazygenerator: LazyTransducer
+    lazyanalyser: LazyTransducer
+    generator: CachingTransducer
+    analyser: CachingTransducer
+
+
+def load_transducers(configuration: dict, options: Namespace,
+                     shared: bool = False) -> Transducers:
+    """Set up generator and analyser of configuration for lookups.
+
+    The generator starts loading in the background, but the analyser is
+    only needed to explain failures. If shared, the transducers can be used
+    from several threads at the same time.
+    """
+    lazygenerator = LazyTransducer(configuration["generator"], options.driver,
+                                   verbose=options.verbose)
+    lazyanalyser = LazyTransducer(configuration["analyser"], options.driver,
+                                  verbose=options.verbose)
+    lazygenerator.start_loading()
+    generatorstore = None
+    analyserstore = None
+    if options.persistent_cache:
+        generatorstore = LookupStore(configuration["generator"],
+                                     options.cache_dir)
+        analyserstore = LookupStore(configuration["analyser"],
+                                    options.cache_dir)
+    generator = CachingTransducer(lazygenerator, options.cache_entries,
+                                  options.cache_bytes, generatorstore)
+    analyser = CachingTransducer(lazyanalyser, options.cache_entries,
+                                 options.cache_bytes, analyserstore)
+    if shared:
+        generator = SharedTransducer(generator)
+        analyser = SharedTransducer(analyser)
+    return Transducers(lazygenerator, lazyanalyser, generator, analyser)
+
+
+def runsection(options: Namespace, configuration: dict,
+               transducers: Transducers, pos: str) -> tuple[int, str, str]:
+    """Test one of several sections, keeping its output for later.
+
+    Gives the exit status, log file name and the output of the section.
+    """
+    out = StringIO()
+    with open_log(options.logfile, pos, True) as logfile:
+        try:
+            checksection(options, configuration, pos, transducers, logfile,
+                         out)
+            print(colored("SUCCESS", "green"), file=out)
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:  # other sections can still be tested
+            traceback.print_exc(file=out)
+            status = 99
+    return status, logfile.name, out.getvalue()
+
+
+def checksections(options: Namespace, configuration: dict,
+                  sections: list[str]) -> int:
+    """Test several sections at the same time with shared transducers.
+
+    The output of each section is printed in order once it is done, and
+    then a summary of their exit statuses. Gives the combined exit status:
+    failure if any section fails, skip if all were skipped.
+    """
+    transducers = load_transducers(configuration, options, shared=True)
+    statuses = []
+    with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+        for pos, (status, logname, output) in zip(
+                sections, executor.map(partial(runsection, options,
+                                               configuration, transducers),
+                                       sections)):
+            print(f"### {pos}")
+            print(output, end="")
+            statuses.append((pos, status, logname))
+    for pos, status, logname in statuses:
+        print(f"{pos}: {SECTION_RESULTS.get(status, 'ERROR')} "
+              f"(exit {status}), log in {logname}")
+    codes = [status for _, status, _ in statuses]
+    if all(code == SKIP_STATUS for code in codes):
+        return SKIP_STATUS
+    return max((code for code in codes if code != SKIP_STATUS), default=0)
+
+
+def readsection(options: Namespace, configuration: dict, pos: str,
+                out: Optional[TextIO] = None) -> tuple[set, list[str]]:
+    """Read the lemmas of section pos.
+
+    Gives all lemmas and those of them to test, i.e. without the acceptable
+    lemmas of the section.
+    """
     skiplemmas = None
-    if "acceptable_lemmas_file" in configuration[options.pos]:
-        with open(configuration[options.pos]["acceptable_lemmas_file"],
+    if "acceptable_lemmas_file" in configuration[pos]:
+        with open(configuration[pos]["acceptable_lemmas_file"],
                   encoding="UTF-8") as lemmafile:
             skiplemmas = [l.strip() for l in lemmafile.readlines()]
     start = time()
-    if options.driver == "subprocess":
-        generator = load_hfst_pope(configuration["generator"])
-        analyser = load_hfst_pope(configuration["analyser"])
-    elif options.driver == "pyhfst":
-        generator = load_hfst(configuration["generator"])
-        analyser = load_hfst(configuration["analyser"])
-    else:
-        print(f"bad driver {options.driver}")
-        sys.exit(2)
-    end = time()
-    if options.verbose:
-        print(f"used {end-start} times for FSA / subprocess startup")
-    start = time()
-    if "exclusions" in configuration[options.pos]:
-        exclusions = configuration[options.pos]["exclusions"]
+    if "exclusions" in configuration[pos]:
+        exclusions = configuration[pos]["exclusions"]
     else:
         exclusions = None
-    with open(lexcfilename, encoding="UTF-8") as lexcfile:
-        lemmas = scrapelemmas(lexcfile, exclusions, options.debug)
+    lemmas = readlemmas(configuration[pos]["lexcfile"], exclusions,
+                        options.debug, options.lexc_cache)
     end = time()
     if options.verbose:
-        print(f"used {end-start} times for lemma scraping")
-    lines = 0
-    oovs = 0
-    misses = 0
-    start = time()
-    timedout = False
-    for lemma in lemmas:
-        if lemma in {"", "#", "#;"}:
-            continue
-        if skiplemmas and lemma in skiplemmas:
-            continue
-        empty = True
-        matched = False
-        mismatches = set()
-        ungenerated = set()
-        for tagstring in configuration[options.pos]["lemmatags"]:
-            if options.verbose:
-                print(f"trying {lemma}{tagstring}...")
-            generations = generator.lookup(lemma + tagstring)
-            if options.verbose:
-                print(f"got {len(generations)}")
-            if len(generations) == 0:
-                ungenerated.add(f"* `{lemma}{tagstring}` does not generate!")
-            else:
-                empty = False
-                for generation in generations:
-                    if generation[0] == lemma:
-                        matched = True
-                    else:
-                        mismatches.add(f"* `{lemma}{tagstring}` "
-                                       f"=> `{generation[0]}`")
-        lines += 1
-        if empty or not matched:
-            print(f"\n**{lemma}** failures:\n", file=logfile)
-        if empty:
-            oovs += 1
-            for degenerate in ungenerated:
-                print(degenerate, file=logfile)
-        if not matched:
-            misses += 1
-            for mismatch in mismatches:
-                print(mismatch, file=logfile)
-        if empty or not matched:
-            analyses = analyser.lookup(lemma)
-            if len(analyses) > 0:
-                print(f"* `{lemma}` has following analyses:", file=logfile)
-                uniques = set()
-                for analysis in analyses:
-                    uniques.add(analysis[0])
-                for analysis in uniques:
-                    print(f"  * `{analysis}`", file=logfile)
-                    if options.verbose:
-                        print(f"\t{analysis}")
-            else:
-                print(f"* `{lemma}` has no analyses either", file=logfile)
-        if oovs >= options.oov_limit:
-            print("too many fails, bailing to save time...")
-            print("**FINISHED PREMATURELY HERE DUE TO too many errors**:",
-                  oovs, file=logfile)
-            break
-        now = time()
-        if now - start > options.time_out:
-            print(f"bailing after timeout: {now - start}")
-            print("**FINISHED PREMATURELY HERE DUE TO TIMEOUT**:",
-                  options.time_out, file=logfile)
-            timedout = True
-            break
-    end = time()
-    if lines == 0:
-        print(colored("SKIP:", "cyan"),
-              f"could not find lemmas in {lexcfilename}")
-        sys.exit(77)
-    failures = oovs + misses
-    coverage = (1.0 - (float(failures) / float(lines))) * 100.0
-    if options.verbose:
-        print(f"used {end-start} times for generating")
-        print("Lemma statistics:")
-        print(f"\t{len(lemmas)} lemmas")
-        print(f"\t{coverage} % success")
-    print("\n## Lemma statistics", file=logfile)
-    print(f"* {len(lemmas)} lemmas", file=logfile)
-    print(f"* {coverage} % success", file=logfile)
-    prettyconfig = prettyprint_json(configuration)
-    print(f"\n## Settings used\n\n```json\n{prettyconfig}\n```", file=logfile)
+        print(f"used {end-start} times for lemma scraping", file=out)
+    testable = [lemma for lemma in lemmas if lemma not in {"", "#", "#;"}
+                and not (skiplemmas and lemma in skiplemmas)]
+    return lemmas, testable
+
+
+def loglemma(lemma: str, generated: Optional[list[tuple[str, list]]],
+             analysed: dict[str, list], logfile: TextIO,
+             out: Optional[TextIO], verbose: bool) -> tuple[bool, bool, set]:
+    """Log the failures of a lemma from its tag strings' generations.
+
+    Gives whether nothing was generated, whether the lemma was and the
+    wrong generations. generated is None for a lemma known to generate
+    itself, see generate_batch.
+    """
+    if generated is None:
+        return False, True, set()
+    empty = True
+    matched = False
+    mismatches = set()
+    ungenerated = set()
+    for tagstring, generations in generated:
+        if verbose:
+            print(f"trying {lemma}{tagstring}...", file=out)
+            print(f"got {len(generations)}", file=out)
+        if len(generations) == 0:
+            ungenerated.add(f"* `{lemma}{tagstring}` does not generate!")
+        else:
+            empty = False
+            for generation in generations:
+                if generation[0] == lemma:
+                    matched = True
+                else:
+                    mismatches.add(f"* `{lemma}{tagstring}` "
+                                   f"=> `{generation[0]}`")
+    if empty or not matched:
+        print(f"\n**{lemma}** failures:\n", file=logfile)
+    if empty:
+        for degenerate in ungenerated:
+            print(degenerate, file=logfile)
+    if not matched:
+        for mismatch in mismatches:
+            print(mismatch, file=logfile)
+    if empty or not matched:
+        analyses = analysed[lemma]
+        if len(analyses) > 0:
+            print(f"* `{lemma}` has following analyses:", file=logfile)
+            uniques = set()
+            for analysis in analyses:
+                uniques.add(analysis[0])
+            for analysis in uniques:
+                print(f"  * `{analysis}`", file=logfile)
+                if verbose:
+                    print(f"\t{analysis}", file=out)
+        else:
+            print(f"* `{lemma}` has no analyses either", file=logfile)
+    return empty, matched, mismatches
 
+
+def verdict(options: Namespace, lexcfilename: str, logfile: TextIO,
+            out: Optional[TextIO], oovs: int, misses: int, mismatches: set,
+            coverage: float, timedout: bool):
+    """Tell how the test of a section went and exit unless it passed."""
+    failures = oovs + misses
     if coverage < options.threshold:
         print(colored("FAIL:", "red"),
               f"{oovs} ungenerated strings, {misses} wrong lemmas",
-              f"({coverage} < {options.threshold})")
-        print("open", colored(lexcfilename, "cyan"), "to fix")
-        print("see", colored(logfile.name, "magenta"), "for details")
+              f"({coverage} < {options.threshold})", file=out)
+        print("open", colored(lexcfilename, "cyan"), "to fix", file=out)
+        print("see", colored(logfile.name, "magenta"), "for details",
+              file=out)
         if options.editor:
-            print(f"Running: {options.editor} {logfile.name}")
+            print(f"Running: {options.editor} {logfile.name}", file=out)
             Popen([options.editor, logfile.name])
         sys.exit(1)
     else:
         if timedout and failures > 0:
-            print(colored("FAIL:", "red"), "timed out with ungenerated lemmas")
-            print(f"{oovs} ungenerated strings, {mismatches} wrong lemmas")
-            print(f"see {logfile.name} for details")
+            print(colored("FAIL:", "red"), "timed out with ungenerated lemmas",
+                  file=out)
+            print(f"{oovs} ungenerated strings, {mismatches} wrong lemmas",
+                  file=out)
+            print(f"see {logfile.name} for details", file=out)
             if options.editor:
-                print(f"Running: {options.editor} {logfile.name}")
+                print(f"Running: {options.editor} {logfile.name}", file=out)
                 Popen([options.editor, logfile.name])
             sys.exit(1)
         elif timedout:
             print(colored("SKIP:", "cyan"),
-                  "timed out but didn't find  problems..")
+                  "timed out but didn't find  problems..", file=out)
             sys.exit(77)
         elif failures > 0:
             print(colored("SUCCESS:", "green"),
                   f"{oovs} ungenerated strings, {mismatches} wrong lemmas",
-                  f"(accepted by -T: {coverage} >= {options.threshold})")
+                  f"(accepted by -T: {coverage} >= {options.threshold})",
+                  file=out)
             if options.editor:
-                print(f"Running: {options.editor} {logfile.name}")
+                print(f"Running: {options.editor} {logfile.name}", file=out)
                 Popen([options.editor, logfile.name])
                 sys.exit(0)
     if failures > 0:
         print(colored("SUCCESS:", "green"),
               f"{oovs} ungenerated strings, {mismatches} wrong lemmas",
               f"{coverage} >= {options.threshold})"
-              f"(accepted by -T: {coverage} >= {options.threshold})")
+              f"(accepted by -T: {coverage} >= {options.threshold})",
+              file=out)
         if options.editor:
-            print(f"Running: {options.editor} {logfile.name}")
+            print(f"Running: {options.editor} {logfile.name}", file=out)
             Popen([options.editor, logfile.name])
             sys.exit(0)
 
 
+def checksection(options: Namespace, configuration: dict, pos: str,
+                 transducers: Transducers, logfile: TextIO,
+                 out: Optional[TextIO] = None):
+    """Run lemma generation tests of section pos.
+
+    Messages go to out, by default stdout. Exits with the status of the test
+    unless it passes.
+    """
+    lazygenerator, lazyanalyser, generator, analyser = transducers
+    lexcfilename = configuration[pos]["lexcfile"]
+    print(f"# Lemma-tests for *{pos}* in ...`{basename(lexcfilename)}`",
+          file=logfile)
+    print(file=logfile)
+    lemmas, testable = readsection(options, configuration, pos, out)
+    lines = 0
+    oovs = 0
+    misses = 0
+    start = time()
+    timedout = False
+    tagstrings = configuration[pos]["lemmatags"]
+    state = None
+    if options.state:
+        state = RunState(options.state, f"gtlemmatest {pos}",
+                         [configuration["generator"]],
+                         lemmadigests([lexcfilename], options.lexc_cache),
+                         {"lemmatags": tagstrings})
+    # the plan: lemmas to test in the order they will be logged, the most
+    # likely regressions first in case of time-out
+    planned = plan(testable, [lexcfilename], state, options.sample,
+                   options.lexc_cache)
+    monitor = None
+    if options.early_stop or options.sample:
+        # a lemma can both fail to generate and miss
+        monitor = CoverageMonitor(len(planned), options.threshold,
+                                  max_failures=2,
+                                  known=state.unchanged if state else 0,
+                                  confidence=options.confidence)
+
+    def elapsed() -> float:
+        # time spent waiting for automata to load does not count
+        return time() - lazygenerator.wait_time - lazyanalyser.wait_time - \
+            start
+
+    planned = iter(planned)
+    finished = False
+    # small batches first in case the testing stops early
+    batchsize = FIRST_BATCH
+    while not finished and (batch := list(islice(planned, batchsize))):
+        batchsize = min(2 * batchsize, BATCH_LEMMAS)
+        generated = generate_batch(generator, batch, tagstrings,
+                                   options.verbose, options.lookup_time_out,
+                                   lambda: elapsed() > options.time_out)
+        failed = [lemma for lemma in generated
+                  if generated[lemma] is not None and
+                  not any(generation[0] == lemma
+                          for _, generations in generated[lemma]
+                          for generation in generations)]
+        analysed = lookup_batch(analyser, failed, options.lookup_time_out)
+        for lemma in batch:
+            if lemma not in generated or elapsed() > options.time_out:
+                print(f"bailing after timeout: {elapsed()}", file=out)
+                print("**FINISHED PREMATURELY HERE DUE TO TIMEOUT**:",
+                      options.time_out, file=logfile)
+                timedout = True
+                finished = True
+                break
+            empty, matched, mismatches = loglemma(lemma, generated[lemma],
+                                                  analysed, logfile, out,
+                                                  options.verbose)
+            lines += 1
+            oovs += empty
+            misses += not matched
+            if state:
+                state.record(lemma, not empty and matched)
+            if monitor:
+                monitor.add(empty + (not matched))
+                if monitor.decided(options.sample) is not None:
+                    report = monitor.report(options.sample)
+                    print(f"result decided, stopping: {report}", file=out)
+                    print("**FINISHED EARLY AS RESULT WAS DECIDED**:",
+                          report, file=logfile)
+                    finished = True
+                    break
+            if oovs >= options.oov_limit:
+                print("too many fails, bailing to save time...", file=out)
+                print("**FINISHED PREMATURELY HERE DUE TO too many errors**:",
+                      oovs, file=logfile)
+                finished = True
+                break
+    end = time()
+    if state:
+        state.save()
+        # unchanged lemmas that passed before pass now too
+        lines += state.unchanged
+        if options.verbose:
+            print(f"{state.unchanged} unchanged lemmas passed before, "
+                  "not tested again", file=out)
+    if lines == 0:
+        print(colored("SKIP:", "cyan"),
+              f"could not find lemmas in {lexcfilename}", file=out)
+        sys.exit(77)
+    failures = oovs + misses
+    coverage = (1.0 - (float(failures) / float(lines))) * 100.0
+    if options.verbose:
+        print(f"used {lazygenerator.load_time} times for loading generator",
+              file=out)
+        if lazyanalyser.loaded:
+            print(f"used {lazyanalyser.load_time} times for loading analyser",
+                  file=out)
+        else:
+            print("analyser was not needed", file=out)
+        waited = lazygenerator.wait_time + lazyanalyser.wait_time
+        print(f"used {end-start-waited} times for generating", file=out)
+        print("Lemma statistics:", file=out)
+        print(f"\t{len(lemmas)} lemmas", file=out)
+        print(f"\t{coverage} % success", file=out)
+        print(f"\tgenerator cache: {generator.cache_info()}", file=out)
+        print(f"\tanalyser cache: {analyser.cache_info()}", file=out)
+    if monitor:
+        print(monitor.report(options.sample), file=out)
+    print("\n## Lemma statistics", file=logfile)
+    print(f"* {len(lemmas)} lemmas", file=logfile)
+    print(f"* {coverage} % success", file=logfile)
+    if state:
+        print(f"* {state.unchanged} lemmas passed in the previous run and "
+              "were not tested again", file=logfile)
+    if monitor:
+        print(f"* {monitor.report(options.sample)}", file=logfile)
+    prettyconfig = prettyprint_json(configuration)
+    print(f"\n## Settings used\n\n```json\n{prettyconfig}\n```", file=logfile)
+
+    verdict(options, lexcfilename, logfile, out, oovs, misses, mismatches,
+            coverage, timedout)
+
+
 if __name__ == "__main__":
     main()
@@ -18,16 +18,26 @@ Make suggestions for a whole corpus, save it to a file
 
 import logging
 import os
-import re
-import subprocess
 import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 from collections import defaultdict
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
 from typing import Iterable, Iterator, Optional
 
-from giellaltlextools.hfst import load_hfst  # type: ignore
+from giellaltlextools import hfst
+from giellaltlextools.drivers import driver_spec, load_transducer
+from giellaltlextools.lexc import (
+    ENTRY,
+    LexcLine,
+    parallelmap,
+    pausedgc,
+    readlexclines,
+    splitlexc,
+    tokenizelexc,
+    unescapelexc,
+)
 
 
 @dataclass
@@ -48,96 +58,6 @@ class LexcEntry:
         )
 
 
-LEXC_LINE_RE = re.compile(
-    r"""
-    (?P<contlex>\S+)            #  any nonspace
-    (?P<translation>\s+".*")?   #  optional translation, might be empty
-    \s*;\s*                     #  skip space and semicolon
-    (?P<comment>!.*)?           #  followed by an optional comment
-    $
-""",
-    re.VERBOSE | re.UNICODE,
-)
-
-LEXC_CONTENT_RE = re.compile(
-    r"""
-    (?P<exclam>^\s*!\s*)?          #  optional comment
-    (?P<content>(<.+>)|(.+))?      #  optional content
-""",
-    re.VERBOSE | re.UNICODE,
-)
-
-
-def parse_line(
-    old_match: dict[str, str], lexc_filename: str, lexicon_name: str
-) -> Optional[LexcEntry]:
-    """Parse a lexc line.
-
-    Arguments:
-        old_match:
-
-    Returns:
-        The entries inside the lexc line expressed as a dict
-    """
-    line = old_match.get("content")
-    if not line:
-        return None
-
-    try:
-        upper, lower = line.split(":")
-    except ValueError:
-        return None
-
-    uppers = upper.split("+")
-
-    return LexcEntry(
-        stem=uppers[0],
-        tags=uppers[1:],
-        lower=lower.strip(),
-        contlex=old_match.get("contlex", ""),
-        filename=lexc_filename,
-        parent_lexicon=lexicon_name,
-    )
-
-
-def make_lexc_entry(
-    line: str, lexc_filename: str, lexicon_name: str
-) -> Optional[dict[str, str]]:
-    """Turn line into a dict using regexes.
-
-    Args:
-        line: The line to parse.
-
-    Returns:
-        The line as a dict.
-    """
-    match = LEXC_LINE_RE.search(line)
-
-    if match:
-        content = match.groupdict()
-        match2 = LEXC_CONTENT_RE.match(LEXC_LINE_RE.sub("", line))
-        if match2:
-            content.update(match2.groupdict())
-            return content
-
-    return None
-
-
-def line_to_lexicon_name(line: str) -> str:
-    """Get the lexicon name from a line."""
-    l_name = line.split(" ")[1]
-    return l_name.strip()
-
-
-def get_lexc_lines(lexc_file: Path) -> Iterable[str]:
-    """Get lexc lines from a file."""
-    return (
-        line
-        for line in lexc_file.read_text().split("\n")
-        if not line.startswith("!") or line.strip()
-    )
-
-
 def get_lexc_files(lang_directory: Path) -> Iterable[Path]:
     """Get lexc files from a directory."""
     morphology_directory = Path(lang_directory) / "src" / "fst" / "morphology"
@@ -152,41 +72,80 @@ def handle_lexc_lines(
     lines: Iterable[str], lexc_filename: str
 ) -> Iterable[LexcEntry]:
     """Handle lexc lines from a file."""
-    lexicon_name = None
-    for line in lines:
-        if line.startswith("LEXICON"):
-            lexicon_name = line_to_lexicon_name(line.strip())
+    return lexc_lines_to_entries(
+        tokenizelexc(lines, lexc_filename), lexc_filename
+    )
+
+
+def lexc_lines_to_entries(
+    lexc_lines: Iterable[LexcLine], lexc_filename: str
+) -> Iterable[LexcEntry]:
+    """Make LexcEntries of the entry lines of a tokenized lexc file."""
+    for entry in lexc_lines:
+        if (
+            entry.kind != ENTRY
+            or entry.lexicon is None
+            or entry.lower is None
+            or entry.upper.startswith("<")
+        ):
             continue
-        if lexicon_name is not None:
-            try:
-                content = make_lexc_entry(line, lexc_filename, lexicon_name)
-                if content is None:
-                    continue
-            except TypeError:
-                print(f"Could not parse line {line}", file=sys.stderr)
-                continue
+        uppers = splitlexc(entry.upper, "+")
+        yield LexcEntry(
+            stem=unescapelexc(uppers[0]),
+            tags=uppers[1:],
+            lower=unescapelexc(entry.lower),
+            contlex=entry.contlex,
+            filename=lexc_filename,
+            parent_lexicon=entry.lexicon,
+        )
 
-            lexc_entry = parse_line(content, lexc_filename, lexicon_name)
-            if lexc_entry is not None:
-                yield lexc_entry
 
+def read_lexc_file(lexc_file: Path, cache: bool = True) -> list[tuple]:
+    """Read the lexc entries of one file.
 
-def read_lexc_files(lang_directory: Path) -> dict[str, list[LexcEntry]]:
+    The entries are given as tuples of their fields, which are much faster
+    to send between processes than the dataclasses.
+    """
+    with pausedgc():
+        return [
+            (
+                lexc_entry.stem,
+                lexc_entry.tags,
+                lexc_entry.lower,
+                lexc_entry.contlex,
+                lexc_entry.filename,
+                lexc_entry.parent_lexicon,
+            )
+            for lexc_entry in lexc_lines_to_entries(
+                readlexclines(str(lexc_file), cache), lexc_file.name
+            )
+        ]
+
+
+def read_lexc_files(
+    lang_directory: Path, cache: bool = True, workers: Optional[int] = None
+) -> dict[str, list[LexcEntry]]:
     """Read lexc entries from a language file.
 
+    The files are read in parallel processes, but merged in the same order
+    as they would be read one by one.
+
     Args:
         lang_directory: The directory to read from.
+        cache: Whether to use the parsed lexc cache.
+        workers: Number of processes to read with, default is one per CPU.
 
     Returns:
         A dictionary with the stems as keys and list of LexcEntries are values.
     """
 
     lexc_dict: dict[str, list[LexcEntry]] = defaultdict(list)
-    for lexc_file in get_lexc_files(lang_directory):
-        for lexc_entry in handle_lexc_lines(
-            lines=get_lexc_lines(lexc_file), lexc_filename=lexc_file.name
-        ):
-            lexc_dict[lexc_entry.stem].append(lexc_entry)
+    reader = partial(read_lexc_file, cache=cache)
+    results = parallelmap(reader, get_lexc_files(lang_directory), workers)
+    with pausedgc():
+        for lexc_entries in results:
+            for fields in lexc_entries:
+                lexc_dict[fields[0]].append(LexcEntry(*fields))
 
     return lexc_dict
 
@@ -249,28 +208,24 @@ def filter_derivations_and_compounds(
     }
 
 
-def analyse_expressions(fst: Path, lines: Iterable[str]) -> list[str]:
+def analyse_expressions(
+    fst: Path, lines: Iterable[str], driver: str = "pyhfst"
+) -> Iterator[tuple[str, set[str]]]:
     """Analyse a list of expressions using a HFST FST.
 
     Args:
         fst: The path to the HFST FST.
         lines: The expressions to analyse.
+        driver: The driver to run the FST with, see drivers.DRIVERS.
 
     Returns:
         The analyses of the expressions.
     """
-    command = ["hfst-lookup", fst.as_posix()]
-    result = subprocess.run(
-        command,
-        capture_output=True,
-        check=False,
-        input="\n".join(lines).encode("utf-8"),
-    )
-    return [
-        line.strip()
-        for line in result.stdout.decode("utf-8").split("\n")
-        if line.strip()
-    ]
+    analyser = load_transducer(fst.as_posix(), driver)
+    for line, analyses in analyser.lookup_many(
+        line.strip() for line in lines
+    ):
+        yield line, {analysis[0] for analysis in analyses}
 
 
 def pyhfst_analyse_expressions(
@@ -285,13 +240,7 @@ def pyhfst_analyse_expressions(
     Returns:
         The analyses of the expressions.
     """
-    analyser = load_hfst(fst.as_posix())  # type: ignore
-    for line in lines:
-        analyses = analyser.lookup(line.strip())  # type: ignore
-        if analyses:
-            yield line.strip(), {analysis[0] for analysis in analyses}  # type: ignore
-        else:
-            yield line.strip(), set()
+    return analyse_expressions(fst, lines, "pyhfst")
 
 
 def categorise_pyhfst_output(
@@ -615,11 +564,38 @@ def parse_args():
         default=None,
         type=Path,
     )
+    parser.add_argument(
+        "--driver",
+        type=driver_spec,
+        default="pyhfst",
+        help="The driver for running the FSTs: subprocess, "
+        "subprocess-pool[:N], pyhfst, pyhfst-fork[:N] or auto",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
         help="Print debug information",
     )
+    parser.add_argument(
+        "--no-lexc-cache",
+        action="store_false",
+        dest="lexc_cache",
+        help="Parse lexc files again instead of using parsed results from "
+        "earlier runs",
+    )
+    parser.add_argument(
+        "--map-cache",
+        action="store_true",
+        help="Keep automata parsed by the pyhfst drivers in a "
+        "memory-mappable cache (pure Python pyhfst 1.4 only)",
+    )
+    parser.add_argument(
+        "--lexc-jobs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Read lexc files in N processes (default: one per CPU)",
+    )
 
     return parser.parse_args()
 
@@ -666,6 +642,7 @@ def get_analysers(
 def main():
     # Setup
     args = parse_args()
+    hfst.MAPCACHE = args.map_cache
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
 
@@ -681,9 +658,10 @@ def main():
         sys.stdin if args.infile == sys.stdin else args.infile.open()
     )
     norm_analysed, norm_typos = categorise_pyhfst_output(
-        pyhfst_analyse_expressions(
+        analyse_expressions(
             fst=normative_analyser,
             lines={line for line in input_stream if line.strip()},
+            driver=args.driver,
         )
     )
 
@@ -691,7 +669,9 @@ def main():
     # Sending those words through the descriptive analyser gives us a list of
     # typos and really unknown words.
     descriptive_analysed, descriptive_typos = categorise_pyhfst_output(
-        pyhfst_analyse_expressions(fst=descriptive_analyser, lines=norm_typos)
+        analyse_expressions(
+            fst=descriptive_analyser, lines=norm_typos, driver=args.driver
+        )
     )
 
     if args.infile == sys.stdin:
@@ -723,7 +703,9 @@ def main():
         sys.exit(0)
 
     # Read lexc files
-    lexc_dict = read_lexc_files(lang_directory)
+    lexc_dict = read_lexc_files(
+        lang_directory, args.lexc_cache, args.lexc_jobs
+    )
 
     output_stream = (
         sys.stdout if args.outfile == sys.stdout else args.outfile.open("w")
@@ -5,9 +5,28 @@ import re
 import sys
 from argparse import ArgumentParser
 from time import time
+
 from termcolor import colored
 
 from . import __version__
+from .lexc import ENTRY, LEXICON, MULTICHARS, SYMBOLS, splitpair, tokenizelexc
+
+
+def shownline(text: str) -> str:
+    """Get a lexc line the way the messages show it.
+
+    Tabs are expanded and the comment and the glosses are left out."""
+    line = text.replace("\t", "    ")
+    if "!" in line:
+        line = line.replace("%!", "§EXCLAMATION§")
+        line = line.split("!")[0]
+        line = line.replace("§EXCLAMATION§", "%!")
+    if "\"" in line:
+        line = line.replace("%\"", "§QUOTATION§")
+        line = re.sub(" \"[^\"]*\"", "", line)
+        line = line.replace("§QUOTATION§", "%\"")
+    return line
+
 
 def main():
     """CLI for GiellaLT lemma generation tests."""
@@ -39,50 +58,36 @@ def main():
         print("testing", colored(options.lexcfile.name, "magenta"),
               "for potential missing +tags, tags+ and",
               "@X.FLAG.DIACRITICS@")
-    for line in options.lexcfile:
-        lines += 1
-        if not inmultichars and not inlexicons:
-            if line.startswith("Multichar_Symbols"):
-                inmultichars = True
-                rest = line[len("Multichar_Symbols") + 1:].strip()
-                if "!" in rest:
-                    rest = rest.split("!")[0].strip()
-                if rest != "":
-                    print(colored("FAIL: ", "red"),
-                          f"trailing rubbish after multichar syms: {rest}")
-                    failcount += 1
-            elif line.startswith("Alphabets"):
-                inmultichars = True
-                rest = line[len("Alphabets") + 1:].strip()
-                if "!" in rest:
-                    rest = rest.split("!")[0].strip()
-                if rest != "":
-                    print(colored("FAIL: ", "red"),
-                          f"trailing rubbish after alphabets: {rest}")
-                    failcount += 1
-            elif line.startswith("LEXICON"):
+    for entry in tokenizelexc(options.lexcfile):
+        lines = entry.lineno
+        line = shownline(entry.text)
+        if entry.kind == MULTICHARS and not inlexicons:
+            inmultichars = True
+            rest = " ".join(entry.fields[1:])
+            if rest != "":
+                what = "multichar syms" if entry.fields[0] == \
+                    "Multichar_Symbols" else "alphabets"
                 print(colored("FAIL: ", "red"),
-                      f"found lexicons before multichars: {line.strip()}")
+                      f"trailing rubbish after {what}: {rest}")
                 failcount += 1
-                inlexicons = True
-            else:
-                continue
-        elif inmultichars and not inlexicons:
-            if line.startswith("LEXICON "):
-                inmultichars = False
-                inlexicons = True
-                if options.verbose:
-                    print("Found following alphabets:\n",
-                          ", ".join(declaredmultichars))
-                    print("Reading lexicons now...")
-                continue
-            if "!" in line:
-                line = line.replace("%!", "§EXCLAMATION§")
-                line = line.split("!")[0]
-                line = line.replace("§EXCLAMATION§", "%!")
-            line = line.replace("% ", "§SPACE§")
-            for multichar in line.split():
-                multichar = multichar.replace("§SPACE§", "% ")
+        elif entry.kind == LEXICON:
+            if not inmultichars and not inlexicons:
+                print(colored("FAIL: ", "red"),
+                      "found lexicons before multichars: "
+                      f"{entry.text.strip()}")
+                failcount += 1
+            elif inmultichars and options.verbose:
+                print("Found following alphabets:\n",
+                      ", ".join(declaredmultichars))
+                print("Reading lexicons now...")
+            inmultichars = False
+            inlexicons = True
+            if entry.semicolons and len(entry.fields) >= 3:
+                print(colored("FAIL:", "red"),
+                      "entries on LEXICON line is not supported:\n",
+                      colored(line, "cyan"))
+        elif entry.kind == SYMBOLS and not inlexicons:
+            for multichar in entry.fields:
                 declaredmultichars.add(multichar)
                 if multichar.startswith("+"):
                     plussuffixtags = True
@@ -90,123 +95,80 @@ def main():
                     prefixplustags = True
                 if multichar.startswith("@") and multichar.endswith("@"):
                     atflagattags = True
-        elif not inmultichars and inlexicons:
-            if ";" in line:
-                # for some reason split is confused by tabs and spaces mixed
-                line = line.replace("\t", "    ")
-                if "!" in line:
-                    line = line.replace("%!", "§EXCLAMATION§")
-                    line = line.split("!")[0]
-                    line = line.replace("§EXCLAMATION§", "%!")
-                if "\"" in line:
-                    line = line.replace("%\"", "§QUOTATION§")
-                    line = re.sub(" \"[^\"]*\"", "", line)
-                    line = line.replace("§QUOTATION§", "\"")
-                if "<" in line:
-                    line = line.replace("%<", "§LESSTHAN§")
-                    line = line.replace("%>", "§MORETHAN§")
-                    line = re.sub("<[^>]*>", "§REGEX§", line)
-                    line = line.replace("§LESSTHAN§", "%<")
-                    line = line.replace("§MORETHAN§", "%>")
-                elif ">" in line:
-                    line = line.replace("%>", "§MORETHAN§")
-                    if ">" in line:
-                        line = re.sub("^[^>]*>", "§REGEXFAIL", line)
-                    line = line.replace("§MORETHAN§", "%>")
-                line = line.replace("%;", "§SEMICOLON§")
-                if line.count(";") > 1:
-                    print(colored("FAIL: ", "red"),
-                          f"too many semicolons on line {lines}:\n",
+        elif entry.kind == ENTRY and inlexicons:
+            if entry.semicolons > 1:
+                print(colored("FAIL: ", "red"),
+                      f"too many semicolons on line {lines}:\n",
+                      colored(line, "cyan"))
+                failcount += 1
+                continue
+            if len(entry.fields) >= 3:
+                print(colored("FAIL:", "red"),
+                      "too many spaces? parsing:\n",
+                      colored(line, "cyan"))
+                failcount += 1
+            if len(entry.fields) < 2 or entry.upper.startswith("<"):
+                # continuation class and ; or a regex
+                continue
+            # with too many spaces, the pair is the field before contlex
+            deep = splitpair(entry.fields[-2])[0]
+            sussufix = []
+            susprefix = []
+            for tag in re.findall(plussuffixtagre, deep):
+                if tag not in declaredmultichars:
+                    if not tag[-1].isalpha() and \
+                            tag[:-1] in declaredmultichars:
+                        continue
+                    sussufix.append([tag])
+            for tag in re.findall(prefixplustagre, deep):
+                if tag not in declaredmultichars:
+                    susprefix.append([tag])
+            if sussufix and plussuffixtags:
+                if not prefixplustags:
+                    print(colored("FAIL:", "red"),
+                          f"{sussufix} seem(s) like a multichar "
+                          "suffix tag but is missing from the "
+                          "Multichar_Symbols section "
+                          f"on line {lines}:\n",
+                          colored(line, "cyan"))
+                    failcount += 1
+                elif susprefix:
+                    print(colored("FAIL:", "red"),
+                          f"{sussufix} or {susprefix} seem like "
+                          "potential multichars (suffixes or prefixes?)"
+                          " but are missing from "
+                          "Multichar_Symbols section "
+                          f"on line {lines}:\n",
+                          colored(line, "cyan"))
+                    failcount += 1
+            elif susprefix and prefixplustags:
+                if not plussuffixtags:
+                    print(colored("FAIL:", "red"),
+                          f"{susprefix} seem(s) like a multichar "
+                          "prefix tag but is missing from the "
+                          "Multichar_Symbols section "
+                          f"on line {lines}:\n",
+                          colored(line, "cyan"))
+                    failcount += 1
+                elif sussufix:
+                    print(colored("FAIL:", "red"),
+                          f"{susprefix} seem(s) like a multichar "
+                          "prefix tag but is missing from the "
+                          "Multichar_Symbols section "
+                          f"on line {lines}:\n",
+                          colored(line, "cyan"))
+                    failcount += 1
+            for flag in re.findall(atflagatre, deep):
+                if flag not in declaredmultichars:
+                    print(colored("FAIL:", "red"),
+                          f"{flag} seems like a multichar "
+                          "flag diacritic but is missing from the "
+                          "Multichar_Symbols section "
+                          f"on line {lines}:\n",
                           colored(line, "cyan"))
                     failcount += 1
-                    continue
-                line = line.replace("§SEMICOLON§", "%;")
-                if "% " in line:
-                    line = line.replace("% ", "§SPACE§")
-                pairstring = None
-                fields = line.split()
-                for i, field in enumerate(fields):
-                    if field == ";":
-                        if i >= 1:
-                            cont = fields[i-1]
-                        if i >= 2:
-                            pairstring = fields[i-2]
-                        if i >= 3:
-                            if line.startswith("LEXICON "):
-                                print(colored("FAIL:", "red"),
-                                      "entries on LEXICON line is not "
-                                      "supported:\n",
-                                      colored({line}, "cyan"))
-                            else:
-                                print(colored("FAIL:", "red"),
-                                      "too many spaces? parsing:\n",
-                                      colored(line, "cyan"))
-                                failcount += 1
-                if pairstring:
-                    if ":" in pairstring:
-                        deep = pairstring.split(":")[0]
-                    else:
-                        deep = pairstring
-                    sussufix = []
-                    susprefix = []
-                    for tag in re.findall(plussuffixtagre, deep):
-                        if tag not in declaredmultichars:
-                            if not tag[-1].isalpha() and \
-                                    tag[:-1] in declaredmultichars:
-                                continue
-                            sussufix.append([tag])
-                    for tag in re.findall(prefixplustagre, deep):
-                        if tag not in declaredmultichars:
-                            susprefix.append([tag])
-                    if sussufix and plussuffixtags:
-                        if not prefixplustags:
-                            print(colored("FAIL:", "red"),
-                                  f"{sussufix} seem(s) like a multichar "
-                                  "suffix tag but is missing from the "
-                                  "Multichar_Symbols section "
-                                  f"on line {lines}:\n",
-                                  colored(line, "cyan"))
-                            failcount += 1
-                        elif susprefix:
-                            print(colored("FAIL:", "red"),
-                                  f"{sussufix} or {susprefix} seem like "
-                                  "potential multichars (suffixes or prefixes?)"
-                                  " but are missing from "
-                                  "Multichar_Symbols section "
-                                  f"on line {lines}:\n",
-                                  colored(line, "cyan"))
-                            failcount += 1
-                    elif susprefix and prefixplustags:
-                        if not plussuffixtags:
-                            print(colored("FAIL:", "red"),
-                                  f"{susprefix} seem(s) like a multichar "
-                                  "prefix tag but is missing from the "
-                                  "Multichar_Symbols section "
-                                  f"on line {lines}:\n",
-                                  colored(line, "cyan"))
-                            failcount += 1
-                        elif sussufix:
-                            print(colored("FAIL:", "red"),
-                                  f"{susprefix} seem(s) like a multichar "
-                                  "prefix tag but is missing from the "
-                                  "Multichar_Symbols section "
-                                  f"on line {lines}:\n",
-                                  colored(line, "cyan"))
-                            failcount += 1
-                    for flag in re.findall(atflagatre, deep):
-                        if flag not in declaredmultichars:
-                            print(colored("FAIL:", "red"),
-                                  f"{flag} seems like a multichar "
-                                  "flag diacritic but is missing from the "
-                                  "Multichar_Symbols section "
-                                  f"on line {lines}:\n",
-                                  colored(line, "cyan"))
-                            failcount += 1
-                        if not atflagattags:
-                            print("found no flag diacritics in alphabets!")
-                if len(fields) <= 2:
-                    # continuation class and ;
-                    continue
+                if not atflagattags:
+                    print("found no flag diacritics in alphabets!")
     end = time()
     if options.verbose:
         print(f"Used {end - start} times")
@@ -4,13 +4,138 @@
 import sys
 import tempfile
 from argparse import ArgumentParser
+from collections import Counter
+from itertools import islice
+from pathlib import Path
 from subprocess import Popen
 from time import time
 
-from . import __version__
-from .hfstpope import load_hfst_pope
-from .hfst import load_hfst
-from .lexc import scrapelemmas
+from . import __version__, hfst
+from .breaker import SlotBreaker, lemmacontlexes
+from .coverage import CoverageMonitor
+from .drivers import LazyTransducer, driver_spec, exists_batch, lookup_batch
+from .hfst import prefix_sharing_usable
+from .lexc import readlemmas
+from .lookupcache import MAX_BYTES, MAX_ENTRIES, CachingTransducer, LookupStore
+from .schedule import plan
+from .teststate import RunState, lemmadigests
+
+# how many lemma and paradigm queries are looked up in one go at most
+BATCH_QUERIES = 20_000
+# how many are in the first batch, the next ones grow to BATCH_QUERIES
+FIRST_QUERIES = 500
+# how many slots of each kind the --discover summary shows on screen
+SUMMARY_SLOTS = 20
+
+
+def failfast(options, logfile, oovs: int):
+    """Stop the test as failed after too many failures."""
+    print(f"FAILing fast after too many fails: {oovs}")
+    print("\nFINISHED PREMATURELY TOO MANY FAILS: ", oovs, file=logfile)
+    print(f"see {logfile.name} for details")
+    if options.editor:
+        Popen([options.editor, logfile.name])
+    sys.exit(1)
+
+
+def summariseslots(found: Counter, missing: Counter, unexpected: Counter,
+                   examples: dict, logfile):
+    """Write the slots found by discovery to log, the worst on screen."""
+    print("\nSLOTS FOUND (lemmas generating each):", file=logfile)
+    for slot, count in found.most_common():
+        print(f"{slot}\t{count}", file=logfile)
+    for title, counts in [("MISSING SLOTS (in paradigm, not generated)",
+                           missing),
+                          ("UNEXPECTED SLOTS (generated, not in paradigm)",
+                           unexpected)]:
+        print(f"\n{title}:", file=logfile)
+        for slot, count in counts.most_common():
+            example = f"\t{examples[slot]}" if slot in examples else ""
+            print(f"{slot}\t{count}{example}", file=logfile)
+        if counts:
+            print(f"{title}:")
+            for slot, count in counts.most_common(SUMMARY_SLOTS):
+                example = f", e.g. {examples[slot]}" \
+                    if slot in examples else ""
+                print(f"\t{slot} for {count} lemmas{example}")
+            if len(counts) > SUMMARY_SLOTS:
+                print(f"\t... {len(counts) - SUMMARY_SLOTS} more in "
+                      f"{logfile.name}")
+
+
+def discoverslots(options, generator: LazyTransducer, lemmas: list[str],
+                  paradigms: list[str], acceptable, logfile,
+                  monitor=None) -> tuple[int, int, int, bool]:
+    """Find the slots each lemma generates and compare them to paradigms.
+
+    Slots are looked for by walking the generator through the tags after
+    the lemma, see hfst.TagAnalyzer. A slot of the paradigm that is not
+    found is looked up directly before it counts as a failure, so the
+    failures and the log are as in the normal test. Slots found but not in
+    the paradigm are summarised at the end. acceptable tells if a lemma and
+    slot may fail. Gives the numbers of lines, forms and failures, and
+    whether the test timed out.
+    """
+    expected = set(paradigms)
+    found: Counter = Counter()
+    missing: Counter = Counter()
+    unexpected: Counter = Counter()
+    examples = {}
+    cutoff = options.lookup_time_out
+    lines = 0
+    forms = 0
+    oovs = 0
+    start = time()
+    timedout = False
+    for lemma in lemmas:
+        slots, cut = generator.load().discover(lemma, options.max_tags,
+                                               options.max_slots, cutoff)
+        if cut and options.verbose:
+            print(f"{lemma}: stopped looking after {len(slots)} slots")
+        found.update(slots.keys())
+        for slot in slots:
+            if slot not in expected:
+                unexpected[slot] += 1
+                examples.setdefault(slot, f"{lemma}{slot} → "
+                                    f"{slots[slot][0][0]}")
+        failures = 0
+        for paradigm in paradigms:
+            generations = slots.get(paradigm)
+            if generations is None:
+                generations = generator.lookup(lemma + paradigm,
+                                               time_cutoff=cutoff)
+            forms += len(generations)
+            if not generations:
+                missing[paradigm] += 1
+                if not acceptable(lemma, paradigm):
+                    if options.verbose:
+                        print(f"{lemma}{paradigm} does not generate!")
+                    print(f"{lemma}{paradigm}", file=logfile)
+                    oovs += 1
+                    failures += 1
+                    if oovs >= options.oov_limit:
+                        failfast(options, logfile, oovs)
+            lines += 1
+        if options.debug:
+            for slot, generations in slots.items():
+                print(f"{lemma}{slot}:")
+                for g in generations:
+                    print(f"\t{g}")
+        if monitor:
+            monitor.add(failures)
+            if monitor.decided(options.sample) is not None:
+                report = monitor.report(options.sample)
+                print(f"Result decided, stopping: {report}")
+                print("\nFINISHED EARLY AS RESULT WAS DECIDED: "
+                      f"{report}", file=logfile)
+                break
+        now = time() - generator.wait_time
+        if now - start > options.time_out:
+            print(f"Bailing after timeout {now - start}")
+            timedout = True
+            break
+    summariseslots(found, missing, unexpected, examples, logfile)
+    return lines, forms, oovs, timedout
 
 
 def main():
@@ -31,12 +156,21 @@ def main():
     argp.add_argument("-T", "--threshold", type=int,
                       help="required percentage of succesful generations",
                       default=99)
+    argp.add_argument("--early-stop", action="store_true", default=False,
+                      help="stop as soon as the result of -T is decided")
+    argp.add_argument("--sample", action="store_true", default=False,
+                      help="test random lemmas until coverage is above or "
+                      "below -T with --confidence")
+    argp.add_argument("--confidence", type=float, default=0.95,
+                      metavar="LEVEL",
+                      help="confidence level of --sample (default 0.95)")
     argp.add_argument("-d", "--debug", action="store_true", default=False,
                       help="prints debugging outputs")
     argp.add_argument("-v", "--verbose", action="store_true", default=False,
                       help="prints some outputs")
     argp.add_argument("-B", "--time-out", type=int, default=60,
-                      help="max time spend on lemmas")
+                      help="max time spend on lemmas, testing earlier "
+                      "failures and changed lemmas first")
     argp.add_argument("-Q", "--oov-limit", type=int, default=10_000,
                       help="stop trying after so many oovs")
     argp.add_argument("-X", "--acceptable-tags", action="append",
@@ -45,88 +179,259 @@ def main():
                       help="do not count oov if analysis contained in file")
     argp.add_argument("-E", "--editor", type=str,
                       help="open failures in EDITOR afterwards")
-    argp.add_argument("-D", "--driver", choices=["subprocess", "pyhfst"],
-                      default="subprocess",
-                      help="select method of running hfstol files")
+    argp.add_argument("-D", "--driver", type=driver_spec, metavar="DRIVER",
+                      help="select method of running hfstol files: "
+                      "subprocess (default), subprocess-pool[:N], pyhfst, "
+                      "pyhfst-fork[:N] or auto; --discover uses pyhfst")
+    argp.add_argument("--lookup-time-out", type=float, default=0.0,
+                      metavar="SECONDS",
+                      help="give up single lookups after SECONDS (0 for no "
+                      "limit)")
+    argp.add_argument("--cache-entries", type=int, default=MAX_ENTRIES,
+                      metavar="N",
+                      help="cache at most N lookup results (0 for no limit)")
+    argp.add_argument("--cache-bytes", type=int, default=MAX_BYTES,
+                      metavar="BYTES",
+                      help="cache at most BYTES of lookup results "
+                      "(0 for no limit)")
+    argp.add_argument("--persistent-cache", action="store_true",
+                      default=False,
+                      help="keep lookup results on disk between runs")
+    argp.add_argument("--cache-dir", type=Path, metavar="DIR",
+                      help="keep persistent cache in DIR instead of "
+                      "$XDG_CACHE_HOME/giellaltlextools")
+    argp.add_argument("--no-lexc-cache", action="store_false",
+                      dest="lexc_cache", default=True,
+                      help="parse lexc files again instead of using parsed "
+                      "results from earlier runs")
+    argp.add_argument("--map-cache", action="store_true", default=False,
+                      help="keep automata parsed by the pyhfst drivers in a "
+                      "memory-mappable cache (pure Python pyhfst 1.4 only)")
+    argp.add_argument("--state", type=str, metavar="STATEFILE",
+                      help="keep results in STATEFILE and only test new, "
+                      "changed and failed lemmas while the generator and "
+                      "paradigm stay the same")
+    argp.add_argument("--discover", action="store_true", default=False,
+                      help="find the tag sequences each lemma generates "
+                      "and report slots missing from or not in the "
+                      "paradigm (needs pure Python pyhfst)")
+    argp.add_argument("--max-tags", type=int, default=8, metavar="N",
+                      help="look for at most N tags after lemmas in "
+                      "--discover (default 8)")
+    argp.add_argument("--max-slots", type=int, default=1000, metavar="N",
+                      help="stop looking after N slots of a lemma in "
+                      "--discover (0 for no limit, default 1000)")
+    argp.add_argument("--break-after", type=int, default=0, metavar="N",
+                      help="test a slot only for a sample of lemmas after "
+                      "it fails N times in a row, for all lemmas or within "
+                      "a continuation class (default 0, always test)")
+    argp.add_argument("--break-sample", type=int, default=10, metavar="N",
+                      help="test broken slots for every Nth lemma "
+                      "(default 10)")
     options = argp.parse_args()
+    hfst.MAPCACHE = options.map_cache
+    if options.discover and not prefix_sharing_usable():
+        argp.error("--discover needs the pure Python pyhfst")
+    if options.discover and options.state:
+        argp.error("--state cannot be used with --discover")
+    if options.discover and options.driver not in (None, "pyhfst"):
+        argp.error("--discover only works with --driver pyhfst")
     logfile = tempfile.NamedTemporaryFile(prefix="gtparadigmtest", suffix=".txt",
                                           delete=False, encoding="UTF-8",
                                           mode="w+")
-    if options.driver == "subprocess":
-        generator = load_hfst_pope(options.generatorfilename)
-    elif options.driver == "pyhfst":
-        generator = load_hfst(options.generatorfilename)
-    else:
-        print(f"unusable driver {options.driver}")
-        sys.exit(2)
+    # load the generator while lemmas are read
+    lazygenerator = LazyTransducer(options.generatorfilename,
+                                   "pyhfst" if options.discover
+                                   else options.driver or "subprocess",
+                                   verbose=options.verbose)
+    lazygenerator.start_loading()
+    store = None
+    if options.persistent_cache:
+        store = LookupStore(options.generatorfilename, options.cache_dir)
+    generator = CachingTransducer(lazygenerator, options.cache_entries,
+                                  options.cache_bytes, store)
     paradigms = [l.strip() for l in options.paradigmfile.readlines() if
                  l.strip() != ""]
     skipforms = None
     if options.acceptable_forms:
         skipforms = [l.strip() for l in options.acceptable_forms.readlines()]
     skiptags = options.acceptable_tags
-    lemmas = scrapelemmas(options.lexcfile, None, options.debug)
+    lemmas = readlemmas(options.lexcfile.name, None, options.debug,
+                        options.lexc_cache)
+    state = None
+    if options.state:
+        stateinputs = [options.generatorfilename, options.paradigmfile.name]
+        if options.acceptable_forms:
+            stateinputs.append(options.acceptable_forms.name)
+        state = RunState(options.state,
+                         f"gtparadigmtest {options.paradigmfile.name}",
+                         stateinputs,
+                         lemmadigests([options.lexcfile.name],
+                                      options.lexc_cache),
+                         {"acceptable_tags": skiptags})
+    # the most likely regressions first in case of time-out
+    planned = plan(lemmas, [options.lexcfile.name], state, options.sample,
+                   options.lexc_cache)
+    monitor = None
+    if options.early_stop or options.sample:
+        monitor = CoverageMonitor(len(planned), options.threshold,
+                                  lines=len(paradigms),
+                                  max_failures=len(paradigms),
+                                  known=state.unchanged if state else 0,
+                                  confidence=options.confidence)
+    # skip lists as sets, and the slots whose tags are acceptable to miss,
+    # so failures need no searching
+    if skipforms:
+        skipforms = set(skipforms)
+    ignoredslots = {paradigm for paradigm in paradigms
+                    if skiptags and any(skip in paradigm.split("+")
+                                        for skip in skiptags)}
+    # slots failing for lemma after lemma are only sampled, see breaker
+    breaker = SlotBreaker(0 if options.discover else options.break_after,
+                          options.break_sample)
+    contlexes = {}
+    if breaker.limit:
+        contlexes = lemmacontlexes([options.lexcfile.name],
+                                   options.lexc_cache)
     lines = 0
     forms = 0
     oovs = 0
+    # failures of broken slots counted without testing
+    inferred = 0
     start = time()
     timedout = False
-    for lemma in lemmas:
-        for paradigm in paradigms:
-            generations = generator.lookup(lemma + paradigm)
-            if len(generations) == 0:
-                ignoring = False
-                if skiptags:
-                    for skip in skiptags:
-                        if skip in paradigm.split("+"):
-                            ignoring = True
-                            break
-                if skipforms:
-                    if lemma + paradigm in skipforms:
-                        ignoring = True
-                if not ignoring:
+    if options.discover:
+        lines, forms, oovs, timedout = discoverslots(
+            options, lazygenerator, planned, paradigms,
+            lambda lemma, paradigm: paradigm in ignoredslots or
+            bool(skipforms and lemma + paradigm in skipforms),
+            logfile, monitor)
+        planned = []
+
+    def elapsed() -> float:
+        # time spent waiting for the generator to load does not count
+        return time() - lazygenerator.wait_time - start
+
+    # the forms are only needed for verbose and debug output, otherwise
+    # checking that something generates is enough; that is cheaper than the
+    # bulk lookups only when the lookups are made one by one anyway
+    exhaustive = options.verbose or options.debug or \
+        not options.lookup_time_out
+    planned = iter(planned)
+    # small batches first in case the testing stops early
+    batchsize = max(1, FIRST_QUERIES // len(paradigms))
+    finished = False
+    while not finished and (batch := list(islice(planned, batchsize))):
+        batchsize = min(2 * batchsize,
+                        max(1, BATCH_QUERIES // len(paradigms)))
+        skipped = {(lemma, paradigm) for lemma in batch
+                   for paradigm in paradigms
+                   if not breaker.should_test(paradigm, contlexes.get(lemma))}
+        # the lemma × paradigm product of the batch in one bulk lookup, each
+        # query string only once
+        queries = list(dict.fromkeys(lemma + paradigm for lemma in batch
+                                     for paradigm in paradigms
+                                     if (lemma, paradigm) not in skipped))
+        check = lookup_batch if exhaustive else exists_batch
+        generated = check(generator, queries, options.lookup_time_out,
+                          lambda: elapsed() > options.time_out)
+        for lemma in batch:
+            if elapsed() > options.time_out or \
+                    any(lemma + paradigm not in generated
+                        for paradigm in paradigms
+                        if (lemma, paradigm) not in skipped):
+                print(f"Bailing after timeout {elapsed()}")
+                timedout = True
+                finished = True
+                break
+            failures = 0
+            for paradigm in paradigms:
+                acceptable = paradigm in ignoredslots or \
+                    bool(skipforms and lemma + paradigm in skipforms)
+                if (lemma, paradigm) in skipped:
+                    if not acceptable:
+                        inferred += 1
+                        failures += 1
+                    lines += 1
+                    continue
+                generations = generated[lemma + paradigm]
+                if exhaustive:
+                    forms += len(generations)
+                if not acceptable:
+                    breaker.record(paradigm, contlexes.get(lemma),
+                                   not generations)
+                if not generations and not acceptable:
                     if options.verbose:
                         print(f"{lemma}{paradigm} does not generate!")
                     print(f"{lemma}{paradigm}", file=logfile)
                     oovs += 1
+                    failures += 1
                     if oovs >= options.oov_limit:
-                        print(f"FAILing fast after too many fails: {oovs}")
-                        print("\nFINISHED PREMATURELY TOO MANY FAILS: ",
-                              oovs, file=logfile)
-                        print(f"see {logfile.name} for details")
-                        if options.editor:
-                            Popen([options.editor, logfile.name])
-                        sys.exit(1)
-            lines += 1
-            forms += len(generations)
-            if options.debug:
-                print(f"{lemma}{paradigm}:")
-                for g in generations:
-                    print(f"\t{g}")
-        now = time()
-        if now - start > options.time_out:
-            print(f"Bailing after timeout {now - start}")
-            timedout = True
-            break
+                        if state:
+                            state.save()
+                        failfast(options, logfile, oovs)
+                lines += 1
+                if options.debug:
+                    print(f"{lemma}{paradigm}:")
+                    for g in generations:
+                        print(f"\t{g}")
+            if state:
+                state.record(lemma, failures == 0)
+            if monitor:
+                monitor.add(failures)
+                if monitor.decided(options.sample) is not None:
+                    report = monitor.report(options.sample)
+                    print(f"Result decided, stopping: {report}")
+                    print("\nFINISHED EARLY AS RESULT WAS DECIDED: "
+                          f"{report}", file=logfile)
+                    finished = True
+                    break
+    brokenslots = breaker.report()
+    if brokenslots:
+        title = (f"BROKEN SLOTS (failed {breaker.limit} times in a row, then "
+                 f"tested for every {breaker.sample}th lemma)")
+        print(f"\n{title}:", file=logfile)
+        print(f"{title}:")
+        for broken in brokenslots:
+            print(broken, file=logfile)
+            print(f"\t{broken}")
+    if state:
+        state.save()
+        # unchanged lemmas that passed before pass now too
+        lines += state.unchanged * len(paradigms)
+        if options.verbose:
+            print(f"{state.unchanged} unchanged lemmas passed before, "
+                  "not tested again")
     if lines == 0:
         print(f"SKIP: could not find lemmas in {options.lexcfile.name}")
         sys.exit(77)
-    coverage = (1.0 - (float(oovs) / float(lines))) * 100.0
+    coverage = (1.0 - (float(oovs + inferred) / float(lines))) * 100.0
     if options.verbose:
+        print(f"used {lazygenerator.load_time} times for loading generator")
+        print("used", time() - start - lazygenerator.wait_time,
+              "times for generating")
         print("Generation statistics:")
         print(f"\t{len(lemmas)} lemmas × {len(paradigms)} paradigm slots")
         print(f"\t(should be minimum {len(lemmas)*len(paradigms)} forms then)")
         print(f"\t{forms} generated, {coverage} % success")
+        if inferred:
+            print(f"\t{inferred} failures of broken slots not tested")
+        print(f"\tgenerator cache: {generator.cache_info()}")
+    if monitor:
+        print(monitor.report(options.sample))
+    untested = f", {inferred} more in broken slots" if inferred else ""
     if coverage < options.threshold:
         print("FAIL: too many lemmas weren't generating!",
               f"{coverage} < {options.threshold}")
-        print(f"see {logfile.name} for details ({oovs} ungenerated strings)")
+        print(f"see {logfile.name} for details ({oovs} ungenerated strings"
+              f"{untested})")
         if options.editor:
             Popen([options.editor, logfile.name])
         sys.exit(1)
-    elif timedout and oovs:
+    elif timedout and (oovs or inferred):
         print("FAIL: timed out and failures...")
-        print(f"see {logfile.name} for details ({oovs} ungenerated strings)")
+        print(f"see {logfile.name} for details ({oovs} ungenerated strings"
+              f"{untested})")
         if options.editor:
             Popen([options.editor, logfile.name])
         sys.exit(1)
@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 """Lemma testing for GiellaLT spell-checkers and lexicons."""
 
+import re
 import subprocess
 import sys
 import tempfile
-import re
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
 from subprocess import Popen
+from threading import Lock, Thread, Timer
+from typing import Iterable, Iterator, NamedTuple, Optional
 
 from termcolor import colored, cprint
 
 from . import __version__
-from .lexc import scrapelemmas
-
+from .lexc import readmanylemmas
+from .teststate import RunState, lemmadigests
 
 DEFAULT_EXCLUSIONS = [
     r"\+Use/-Spell",
@@ -37,6 +41,178 @@ def parse_input_lemma(line: str) -> str:
     return ""
 
 
+class SpellerRun:
+    """Speller process checking lemmas, read while it is running.
+
+    The lemmas are written to the speller from a feeder thread, and
+    iterating gives its output lines as they come, so they can be handled
+    before the speller has finished. The speller is killed after time_out
+    seconds, setting timedout, or when the run is closed before the output
+    ends; the lines read by then stay usable. Use as a context manager.
+    """
+
+    def __init__(self, spellargs: list[str], lemmas: list[str],
+                 time_out: float):
+        self.spellargs = spellargs
+        self.timedout = False
+        self.stopped = False
+        self.errors: list[str] = []
+        self.process = Popen(spellargs, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             encoding="utf-8")
+        self.threads = [Thread(target=self._feed, args=(lemmas,),
+                               daemon=True),
+                        Thread(target=self._drain, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        self.timer = Timer(time_out, self._expire)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _feed(self, lemmas: list[str]):
+        try:
+            for lemma in lemmas:
+                self.process.stdin.write(lemma + "\n")
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError, ValueError):
+            pass  # speller stopped early
+
+    def _drain(self):
+        self.errors.extend(self.process.stderr)
+
+    def _expire(self):
+        self.timedout = True
+        self.process.kill()
+
+    def __iter__(self) -> Iterator[str]:
+        """Give output lines until the speller ends or is killed.
+
+        Raises CalledProcessError if the speller fails by itself.
+        """
+        for line in self.process.stdout:
+            yield line.rstrip("\n")
+        self.process.wait()
+        if self.process.returncode and not self.timedout and \
+                not self.stopped:
+            for thread in self.threads:
+                thread.join()
+            raise subprocess.CalledProcessError(self.process.returncode,
+                                                self.spellargs,
+                                                stderr="".join(self.errors))
+
+    def close(self):
+        """Stop the speller if it is still running."""
+        self.timer.cancel()
+        if self.process.poll() is None:
+            self.stopped = True
+            self.process.kill()
+        self.process.wait()
+        for thread in self.threads:
+            thread.join()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SpellRecord(NamedTuple):
+    """Speller output for one lemma, with the suggestions and such after it."""
+
+    lemma: str
+    correct: bool
+    lines: list[str]
+
+
+def readrecords(lines: Iterable[str],
+                skipforms: Optional[set[str]] = None) -> Iterator[SpellRecord]:
+    """Group speller output lines into a record for each lemma.
+
+    Records of empty lemmas, comments and acceptable forms in skipforms are
+    left out. A record is given when the next one begins or the output ends.
+    """
+    record = None
+    for line in lines:
+        if "Input:" in line:
+            if record:
+                yield record
+            lemma = parse_input_lemma(line)
+            if lemma in {"", "#", "#;"} or (skipforms and lemma in skipforms):
+                record = None
+            else:
+                record = SpellRecord(lemma, "[INCORRECT]" not in line, [])
+        elif record:
+            record.lines.append(line)
+    if record:
+        yield record
+
+
+def writerecords(records: Iterable[SpellRecord], logfile):
+    """Write the failures and the lines after each lemma to log.
+
+    Blank lines are only written when more follows, so the log does not end
+    in them.
+    """
+    blanks = []
+    for record in records:
+        texts = [] if record.correct else [record.lemma,
+                                           "\tfollowing suggestions:"]
+        texts += [f"\t{line}" for line in record.lines]
+        for text in texts:
+            if not text.strip():
+                blanks.append(text)
+                continue
+            for blank in blanks:
+                print(blank, file=logfile)
+            blanks = []
+            print(text, file=logfile)
+
+
+class FailureCounter:
+    """Failures found by all shards of a test, up to a limit."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.count = 0
+        self.lock = Lock()
+
+    def add(self) -> bool:
+        """Count a failure, or tell that the limit has been reached."""
+        with self.lock:
+            if self.count >= self.limit:
+                return False
+            self.count += 1
+            return True
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.limit
+
+
+def checkshard(spellargs: list[str], lemmas: list[str], time_out: float,
+               skipforms: Optional[set[str]], failures: FailureCounter,
+               verbose: bool = False) -> tuple[list[SpellRecord], bool]:
+    """Check lemmas in one speller process.
+
+    Gives the records read and whether the speller timed out. Stops when
+    failures of all the shards reach their limit.
+    """
+    records = []
+    with SpellerRun(spellargs, lemmas, time_out) as run:
+        for record in readrecords(run, skipforms):
+            if not record.correct:
+                if not failures.add():
+                    break
+                if verbose:
+                    print(f"{record.lemma} is not accepted")
+            records.append(record)
+            if failures.full:
+                break
+    return records, run.timedout
+
+
 def main():
     """CLI for speller lemma testing."""
     argp = ArgumentParser()
@@ -68,6 +244,20 @@ def main():
                       help="max time used to test lemmas")
     argp.add_argument("-E", "--editor", type=str,
                       help="open failures in EDITOR afterwards")
+    argp.add_argument("--no-lexc-cache", action="store_false",
+                      dest="lexc_cache", default=True,
+                      help="parse lexc files again instead of using parsed "
+                      "results from earlier runs")
+    argp.add_argument("--lexc-jobs", type=int, default=0, metavar="N",
+                      help="read lexc files in N processes (default: one "
+                      "per CPU)")
+    argp.add_argument("--state", type=str, metavar="STATEFILE",
+                      help="keep results in STATEFILE and only test new, "
+                      "changed and failed lemmas while the speller stays "
+                      "the same")
+    argp.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                      help="check lemmas in N speller processes at once "
+                      "(default 1, 0 for one per CPU)")
     options = argp.parse_args()
     logfile = tempfile.NamedTemporaryFile(prefix="gtlemmaspell", suffix=".txt",
                                           delete=False, encoding="UTF-8",
@@ -83,57 +273,68 @@ def main():
         sys.exit(1)
     skipforms = None
     if options.acceptable_forms:
-        skipforms = [l.strip() for l in options.acceptable_forms.readlines()]
-    lemmas = set()
+        skipforms = {l.strip() for l in options.acceptable_forms.readlines()}
     if options.exclude:
         options.exclude.extend(DEFAULT_EXCLUSIONS)
     else:
         options.exclude = DEFAULT_EXCLUSIONS.copy()
-    for lexcfilename in options.lexcfilenames:
-        with open(lexcfilename, encoding="utf-8") as lexcfile:
-            more = scrapelemmas(lexcfile, options.exclude, options.debug)
-            for lemma in more:
-                lemmas.add(lemma)
-    lines = 0
-    oovs = 0
+    lemmas = readmanylemmas(options.lexcfilenames, options.exclude,
+                            options.debug, options.lexc_cache,
+                            options.lexc_jobs)
+    state = None
+    planned = lemmas
+    if options.state:
+        stateinputs = [options.zhfstfilename]
+        if options.acceptable_forms:
+            stateinputs.append(options.acceptable_forms.name)
+        state = RunState(options.state, "gtspelltest", stateinputs,
+                         lemmadigests(options.lexcfilenames,
+                                      options.lexc_cache))
+        planned = list(state.untested(lemmas))
     if options.verbose:
         print(f"collected {len(lemmas)} lemmas, sending...")
-    lemmabytes = "\n".join(lemmas).encode("utf-8")
-    try:
-        results = subprocess.run(spellargs, input=lemmabytes,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 check=True, timeout=options.time_out)
-    except subprocess.TimeoutExpired:
-        print(colored("Warning:", "yellow"), "lemma checking timed out")
-        sys.exit(77)
-    skipping = True
+        if state:
+            print(f"{state.unchanged} unchanged lemmas passed before, "
+                  "not sending again")
+    # the lemmas are dealt out to the speller processes in turn, and the
+    # output is handled as it comes, so the spellers can be stopped as soon
+    # as there are too many failures or the time is up
+    jobs = options.jobs or cpu_count() or 1
+    ordered = sorted(planned)
+    shards = [shard for shard in (ordered[i::jobs] for i in range(jobs))
+              if shard]
+    failures = FailureCounter(options.oov_limit)
+    with ThreadPoolExecutor(max_workers=max(1, len(shards))) as executor:
+        futures = [executor.submit(checkshard, spellargs, shard,
+                                   options.time_out, skipforms, failures,
+                                   options.verbose)
+                   for shard in shards]
+        results = [future.result() for future in futures]
+    # merged in lemma order, so the log is the same however many shards
+    records = sorted((record for shardrecords, _ in results
+                      for record in shardrecords),
+                     key=lambda record: record.lemma)
+    timedout = any(shardtimedout for _, shardtimedout in results)
+    writerecords(records, logfile)
+    lines = len(records)
+    oovs = failures.count
+    if failures.full:
+        print("too many fails, bailing to save time...")
+    if state:
+        for record in records:
+            state.record(record.lemma, record.correct)
     if options.verbose:
         print("processing done.")
-    for line in results.stdout.decode("utf-8").strip().split("\n"):
-        if "Input:" in line:
-            lemma = parse_input_lemma(line)
-            if lemma in {"", "#", "#;"}:
-                skipping = True
-            elif skipforms and lemma in skipforms:
-                skipping = True
-            else:
-                skipping = False
-                lines += 1
-        if skipping:
-            continue
-        if "[INCORRECT]" in line:
-            oovs += 1
-            if options.verbose:
-                print(f"{lemma} is not accepted")
-            print(f"{lemma}", file=logfile)
-            print("\tfollowing suggestions:", file=logfile)
-        else:
-            if "Input:" not in line:
-                print(f"\t{line}", file=logfile)
-        if oovs >= options.oov_limit:
-            print("too many fails, bailing to save time...")
-            break
+    if timedout:
+        print(colored("Warning:", "yellow"), "lemma checking timed out "
+              f"after {lines} of {len(planned)} lemmas")
+    if state:
+        state.save()
+        # unchanged lemmas that passed before pass now too
+        lines += state.unchanged
+    if lines == 0 and timedout:
+        print(colored("SKIP:", "cyan"), "timed out before checking lemmas")
+        sys.exit(77)
     if lines == 0:
         print(colored("SKIP:", "cyan"),
               f"could not find lemmas in {options.lexcfilenames}")
@@ -153,6 +354,15 @@ def main():
             print(f"Running {options.editor} {logfile.name}...")
             Popen([options.editor, logfile.name])
         sys.exit(1)
+    elif timedout and oovs:
+        print(colored("FAIL:", "red"), f"timed out and {oovs} lemmas failed!")
+        print("see", colored(logfile.name, "magenta"), "for details")
+        if options.editor:
+            Popen([options.editor, logfile.name])
+        sys.exit(1)
+    elif timedout:
+        print(colored("SKIP:", "cyan"), "timed out but found no errors")
+        sys.exit(77)
     else:
         print(colored("PASS:", "green"),
               f"{len(lemmas)} lemmas {coverage} % accepted")
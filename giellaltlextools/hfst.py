@@ -1,13 +1,621 @@
 #!/usr/bin/env python3
 """Functions for handling HFST stuff."""
 
+import gc
+import hashlib
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
+import struct
+from array import array
+from importlib import metadata
+from itertools import islice
+from os import cpu_count
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
 import pyhfst
+from pyhfst.common import (
+    TRANSITION_TARGET_TABLE_START,
+    IndexTable,
+    TransitionTable,
+)
+
+from .lookupcache import cache_home, fingerprint
+
+# how many lookups are sent to a forked worker at a time
+BATCH_SIZE = 256
+# how many lookups share one traversal of the automaton at most
+SHARED_LOOKUPS = 2048
+# how often forked workers are checked to be alive while waiting, seconds
+WORKER_CHECK = 1.0
+# beginning of the memory-mappable automaton cache files
+MAPCACHE_MAGIC = b"GTOLMAP1"
+# pyhfst versions whose private table layout the cache files are made for
+MAPCACHE_PYHFST_VERSIONS = ("1.4.",)
+# whether load_hfst_pyhfst uses the cache, set by the tools' --map-cache
+MAPCACHE = False
+# (table, attribute, array typecode) of the arrays in the cache files
+MAPCACHE_ARRAYS = [("index_table", "ti_input_symbols", "H"),
+                   ("index_table", "ti_targets", "I"),
+                   ("transition_table", "ti_input_symbols", "H"),
+                   ("transition_table", "ti_output_symbols", "H"),
+                   ("transition_table", "ti_targets", "I"),
+                   ("transition_table", "ti_weights", "f")]
+
+
+def mapcache_usable() -> bool:
+    """Check if pyhfst keeps its tables where they can be memory-mapped.
+
+    Only the pure Python pyhfst does; the Cython one has them in typed
+    private arrays. The cache relies on pyhfst internals, so it is only
+    used with the versions in MAPCACHE_PYHFST_VERSIONS.
+    """
+    try:
+        version = metadata.version("pyhfst")
+    except metadata.PackageNotFoundError:
+        return False
+    return version.startswith(MAPCACHE_PYHFST_VERSIONS) and \
+        pyhfst.Transducer.__module__ == "pyhfst.transducer" and \
+        array("I").itemsize == struct.calcsize("<I")
+
+
+def mapcache_filename(filename: str) -> Path:
+    """Get the name of the memory-mappable cache for an automaton file."""
+    digest = hashlib.sha1(os.path.abspath(filename).encode("UTF-8"))
+    return cache_home() / "fsts" / f"{digest.hexdigest()}.olmap"
+
+
+def write_mapcache(transducer, filename: str, mapfilename: Path):
+    """Save the tables of a pyhfst transducer in a memory-mappable file.
+
+    The file has a magic, the length of a pickled header, the header with
+    the source file's metadata, the automaton without its tables and the
+    table offsets, and then the tables as 8 byte aligned arrays.
+    """
+    stat = os.stat(filename)
+    arrays = []
+    offsets = []
+    for table, attribute, typecode in MAPCACHE_ARRAYS:
+        if attribute == "ti_weights" and not transducer.is_weighted:
+            arrays.append(b"")
+            continue
+        arrays.append(array(typecode,
+                            getattr(getattr(transducer, table),
+                                    attribute)).tobytes())
+    position = 0
+    for data in arrays:
+        offsets.append((position, len(data)))
+        position += len(data) + (-len(data) % 8)
+    bare = (transducer.header, transducer.alphabet, transducer.symbol_map,
+            transducer.is_weighted)
+    header = pickle.dumps({"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                           "sha256": fingerprint(filename), "bare": bare,
+                           "offsets": offsets})
+    start = len(MAPCACHE_MAGIC) + 8 + len(header)
+    start += -start % 8
+    mapfilename.parent.mkdir(parents=True, exist_ok=True)
+    temporary = mapfilename.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary, "wb") as f:
+        f.write(MAPCACHE_MAGIC + struct.pack("<Q", len(header)) + header)
+        f.write(b"\0" * (start - f.tell()))
+        for data in arrays:
+            f.write(data + b"\0" * (-len(data) % 8))
+    os.replace(temporary, mapfilename)
+
+
+def read_mapcache(filename: str, mapfilename: Path):
+    """Get pyhfst transducer from a memory-mappable cache.
+
+    The tables are memory views into the mapped file, so nothing is parsed
+    and processes using the same automaton share the pages. Returns None if
+    the cache does not match the automaton file.
+    """
+    with open(mapfilename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAPCACHE_MAGIC)] != MAPCACHE_MAGIC:
+        return None
+    length = struct.unpack_from("<Q", mapped, len(MAPCACHE_MAGIC))[0]
+    headerstart = len(MAPCACHE_MAGIC) + 8
+    header = pickle.loads(mapped[headerstart:headerstart + length])
+    stat = os.stat(filename)
+    if (header["size"], header["mtime"]) != (stat.st_size, stat.st_mtime_ns) \
+            and header["sha256"] != fingerprint(filename):
+        return None
+    start = headerstart + length
+    start += -start % 8
+    view = memoryview(mapped)
+    transducer = pyhfst.Transducer.__new__(pyhfst.Transducer)
+    transducer.header, transducer.alphabet, transducer.symbol_map, \
+        transducer.is_weighted = header["bare"]
+    transducer.operations = transducer.alphabet.operations
+    transducer.index_table = IndexTable.__new__(IndexTable)
+    transducer.transition_table = TransitionTable.__new__(TransitionTable)
+    transducer.transition_table.is_weighted = transducer.is_weighted
+    for (table, attribute, typecode), (offset, size) in \
+            zip(MAPCACHE_ARRAYS, header["offsets"]):
+        data = view[start + offset:start + offset + size].cast(typecode)
+        setattr(getattr(transducer, table), attribute, data)
+    return transducer
+
+
+def load_hfst(filename: str, mapcache: bool = False) -> pyhfst.Transducer:
+    """Load HFST automaton from a named file.
+
+    If mapcache is on and pyhfst is the pure Python one, the parsed tables
+    are kept in a memory-mappable cache under the user's cache directory and
+    later loads just map them in. The cache is used as long as the
+    automaton file has the same size and mtime, or the same content hash.
+    """
+    if not mapcache or not mapcache_usable():
+        his = pyhfst.HfstInputStream(filename)
+        return his.read()
+    mapfilename = mapcache_filename(filename)
+    transducer = None
+    if mapfilename.exists():
+        try:
+            transducer = read_mapcache(filename, mapfilename)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            transducer = None
+    if transducer is None:
+        transducer = pyhfst.get_transducer(filename)
+        try:
+            write_mapcache(transducer, filename, mapfilename)
+        except OSError:
+            pass  # can do without cache
+    return pyhfst.Hfst(transducer)
+
+
+class BoundedAnalyzer(pyhfst.Analyzer):
+    """pyhfst analyzer that can stop searching early.
+
+    Stops after max_results results, or as soon as wanted has been found.
+    The bounds are set as attributes after construction, since the Cython
+    analyzer does not take extra arguments.
+    """
+
+    max_results = 0
+    wanted = None
+    found = 0
+    hit = False
+
+    def note_analysis(self):
+        super().note_analysis()
+        self.found += 1
+        if self.wanted is not None and \
+                "".join(self.get_symbols()) == self.wanted:
+            self.hit = True
+
+    def is_time_exceeded(self) -> bool:
+        if self.hit or (self.max_results and self.found >= self.max_results):
+            return True
+        return super().is_time_exceeded()
+
+
+def prefix_sharing_usable() -> bool:
+    """Check if lookups can share traversals, i.e. pyhfst is pure Python."""
+    return pyhfst.Analyzer.__module__ == "pyhfst.analyzer" and \
+        pyhfst.Transducer.__module__ == "pyhfst.transducer"
+
+
+def tokenize(transducer, s: str) -> list[int]:
+    """Split s into input symbol numbers of a pyhfst transducer.
+
+    Like pyhfst, takes the longest run of characters found in the symbol
+    map and stops at the first one that is not a symbol.
+    """
+    symbols = []
+    i = 0
+    while i < len(s):
+        node = transducer.symbol_map
+        end = i
+        while end < len(s) and s[end] in node:
+            node = node[s[end]]
+            end += 1
+        if end == i or None not in node:
+            break
+        symbols.append(node[None])
+        i = end
+    return symbols
+
+
+class PrefixNode:
+    """Node of a trie of input symbols, with the results ending there."""
+
+    __slots__ = ("children", "ends", "results")
+
+    def __init__(self):
+        self.children: dict[int, PrefixNode] = {}
+        self.ends = False
+        self.results: list = []
+
+
+class PrefixAnalyzer(pyhfst.Analyzer):
+    """pyhfst analyzer that looks up all inputs of a trie in one traversal.
+
+    The automaton is walked as for a single input, but at each trie node the
+    search branches to all symbols that continue some input, so e.g. a lemma
+    and the tags shared by many paradigm slots are only walked through once.
+    The results of each input are the same and in the same order as from
+    its own lookup.
+    """
+
+    def __init__(self, transducer, root: PrefixNode):
+        super().__init__(transducer, "")
+        self.root = root
+        self.node = root
+
+    def get_analyses(self, idx: int):
+        if self.is_time_exceeded():
+            return
+        index = self.pivot(idx)
+        is_transition = idx >= TRANSITION_TARGET_TABLE_START
+        if is_transition:
+            self.try_epsilon_transitions(index + 1)
+        else:
+            self.try_epsilon_indices(index + 1)
+        node = self.node
+        if node.ends:
+            self.handle_end_of_input_string(index, is_transition)
+        for symbol, child in node.children.items():
+            self.node = child
+            if is_transition:
+                self.find_symbol_transitions(index + 1, symbol)
+            else:
+                self.find_symbol_index(index + 1, symbol)
+        self.node = node
+        if node.children:
+            self.reset_output_pointer()
+
+    def find_symbol_index(self, index: int, symbol: int):
+        table = self.transducer.index_table
+        if table.get_input(index + symbol) == symbol:
+            self.find_symbol_transitions(
+                self.pivot(table.get_target(index + symbol)), symbol)
+
+    def find_symbol_transitions(self, index: int, symbol: int):
+        table = self.transducer.transition_table
+        weighted = self.transducer.is_weighted
+        for idx in range(index, table.size()):
+            if table.get_input(idx) != symbol:
+                break
+            self.update_output_string(table.get_output(idx))
+            self.state.output_pointer += 1
+            if weighted:
+                self.state.current_weight += table.get_weight(idx)
+            self.get_analyses(table.get_target(idx))
+            if weighted:
+                self.state.current_weight -= table.get_weight(idx)
+            self.state.output_pointer -= 1
+
+    def note_analysis(self):
+        self.node.results.append(
+            ["".join(self.get_symbols()),
+             self.state.current_weight if self.transducer.is_weighted
+             else 0.0])
+
+
+class TagAnalyzer(PrefixAnalyzer):
+    """pyhfst analyzer that finds the tag sequences accepted after a lemma.
+
+    Walks the lemma like a lookup and then tries each of tags, symbol
+    numbers of the tags, at every state, up to max_tags tags deep. Every
+    tag sequence ending in a final state is a slot, and its outputs are
+    noted in slots. Stops when max_slots slots have been found, setting
+    cut.
+    """
+
+    def __init__(self, transducer, lemma: str, tags: list[int],
+                 max_tags: int, max_slots: int = 0,
+                 time_cutoff: float = 0.0):
+        root = PrefixNode()
+        node = root
+        symbols = tokenize(transducer, lemma)
+        for symbol in symbols:
+            node = node.children.setdefault(symbol, PrefixNode())
+        # a lemma with characters outside the alphabet has no slots
+        if "".join(transducer.alphabet.keyTable[symbol]
+                   for symbol in symbols) == lemma:
+            node.ends = True
+        super().__init__(transducer, root)
+        self.time_cutoff = time_cutoff
+        self.lemmanode = node
+        self.tags = tags
+        self.max_tags = max_tags
+        self.max_slots = max_slots
+        self.path: list[int] = []
+        self.slots: dict[str, list] = {}
+        self.cut = False
+
+    def is_time_exceeded(self) -> bool:
+        if (self.max_slots and len(self.slots) >= self.max_slots) or \
+                super().is_time_exceeded():
+            self.cut = True
+        return self.cut
+
+    def get_analyses(self, idx: int):
+        if self.node is not self.lemmanode:
+            super().get_analyses(idx)
+            return
+        if self.is_time_exceeded():
+            return
+        index = self.pivot(idx)
+        is_transition = idx >= TRANSITION_TARGET_TABLE_START
+        if is_transition:
+            self.try_epsilon_transitions(index + 1)
+        else:
+            self.try_epsilon_indices(index + 1)
+        if self.path:
+            self.handle_end_of_input_string(index, is_transition)
+        if len(self.path) < self.max_tags:
+            for symbol in self.tags:
+                self.path.append(symbol)
+                if is_transition:
+                    self.find_symbol_transitions(index + 1, symbol)
+                else:
+                    self.find_symbol_index(index + 1, symbol)
+                self.path.pop()
+            self.reset_output_pointer()
+
+    def note_analysis(self):
+        if self.node is not self.lemmanode:
+            return
+        keys = self.transducer.alphabet.keyTable
+        slot = "".join(keys[symbol] for symbol in self.path)
+        self.slots.setdefault(slot, []).append(
+            ["".join(self.get_symbols()),
+             self.state.current_weight if self.transducer.is_weighted
+             else 0.0])
+
+    def discover(self) -> dict[str, list]:
+        """Find the slots of the lemma and their outputs."""
+        if self.lemmanode.ends:
+            self.get_analyses(0)
+        return self.slots
+
+
+def tag_symbols(transducer, prefix: str = "+") -> list[int]:
+    """Get input symbols of a pyhfst transducer that are tags.
+
+    Tags are the multicharacter symbols starting with prefix.
+    """
+    keys = transducer.alphabet.keyTable
+    return [symbol for symbol in
+            range(transducer.header.get_input_symbol_count())
+            if len(keys[symbol]) > 1 and keys[symbol].startswith(prefix)]
+
+
+def lookup_shared(transducer, strings: list[str]) -> dict[str, list]:
+    """Look up strings in a pyhfst transducer sharing common prefixes."""
+    root = PrefixNode()
+    ends = {}
+    for s in strings:
+        node = root
+        for symbol in tokenize(transducer, s):
+            node = node.children.setdefault(symbol, PrefixNode())
+        if node is not root:
+            node.ends = True
+            ends[s] = node
+    if root.children:
+        PrefixAnalyzer(transducer, root).get_analyses(0)
+    return {s: [list(result) for result in ends[s].results]
+            if s in ends else [] for s in strings}
+
+
+class PyhfstTransducer:
+    """pyhfst automaton with the same interface as the other drivers."""
+
+    def __init__(self, transducer):
+        self.transducer = transducer
+        self._tags = None
+
+    def _search(self, s: str, max_results: int = 0, time_cutoff: float = 0.0,
+                wanted: Optional[str] = None) -> list:
+        analyzer = BoundedAnalyzer(self.transducer.tr, s, time_cutoff)
+        analyzer.max_results = max_results
+        analyzer.wanted = wanted
+        results = analyzer.analyze()
+        if max_results:
+            results = results[:max_results]
+        return [["".join(r.get_symbols()), r.get_weight()] for r in results]
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0):
+        """Look up s, giving at most max_results first results found.
+
+        With time_cutoff the search stops after so many seconds and gives
+        what was found by then.
+        """
+        if max_results or time_cutoff:
+            return self._search(s, max_results, time_cutoff)
+        return self.transducer.lookup(s)
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        """Look up many strings, yielding (input, analyses) pairs.
+
+        When possible, up to SHARED_LOOKUPS strings at a time are looked up
+        in one traversal, so that e.g. all slots of a lemma's paradigm are
+        generated walking through the lemma only once.
+        """
+        if not prefix_sharing_usable():
+            for s in strings:
+                yield s, self.transducer.lookup(s)
+            return
+        strings = iter(strings)
+        while chunk := list(islice(strings, SHARED_LOOKUPS)):
+            shared = lookup_shared(self.transducer.tr, chunk)
+            for s in chunk:
+                yield s, shared[s]
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        """Check if s has any results, stopping at the first one."""
+        return len(self._search(s, 1, time_cutoff)) > 0
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        """Check if output is among results of s, stopping when found."""
+        return any(result[0] == output for result in
+                   self._search(s, 0, time_cutoff, output))
+
+    def discover(self, lemma: str, max_tags: int, max_slots: int = 0,
+                 time_cutoff: float = 0.0,
+                 prefix: str = "+") -> tuple[dict[str, list], bool]:
+        """Find the tag sequences that generate after lemma.
+
+        Gives the outputs of each sequence of at most max_tags tags, i.e.
+        symbols starting with prefix, and whether the search was cut short
+        by max_slots or time_cutoff. Needs the pure Python pyhfst.
+        """
+        tr = self.transducer.tr
+        if self._tags is None or self._tags[0] != prefix:
+            self._tags = (prefix, tag_symbols(tr, prefix))
+        analyzer = TagAnalyzer(tr, lemma, self._tags[1], max_tags,
+                               max_slots, time_cutoff)
+        return analyzer.discover(), analyzer.cut
+
+    def close(self):
+        pass
+
+
+def load_hfst_pyhfst(filename: str) -> PyhfstTransducer:
+    """Load HFST automaton from a named file with pyhfst.
+
+    With MAPCACHE on, the tables are kept in a memory-mappable cache, see
+    load_hfst.
+    """
+    return PyhfstTransducer(load_hfst(filename, MAPCACHE))
+
+
+def _lookup_worker(transducer, tasks, results):
+    """Look up batches from tasks until a None comes.
+
+    A batch that fails is answered with the exception instead.
+    """
+    for batch_id, batch in iter(tasks.get, None):
+        try:
+            results.put((batch_id, list(transducer.lookup_many(batch))))
+        except Exception as e:  # sent to the parent to raise
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(repr(e))
+            results.put((batch_id, e))
+
+
+class ForkedTransducer:
+    """pyhfst automaton shared by forked lookup worker processes.
+
+    The automaton is read only once, in the parent process, and the workers
+    forked after that see it through copy-on-write memory. Bulk lookups are
+    sent to the workers in batches over a queue.
+    """
+
+    def __init__(self, transducer, workers: Optional[int] = None,
+                 batch_size: int = BATCH_SIZE):
+        if not workers:
+            workers = cpu_count() or 1
+        context = multiprocessing.get_context("fork")
+        self.transducer = transducer
+        self.batch_size = batch_size
+        self.tasks = context.SimpleQueue()
+        self.results = context.Queue()
+        # keep the garbage collector from writing to, and thus copying, all
+        # the pages of the automaton in each worker
+        gc.freeze()
+        self.workers = [context.Process(target=_lookup_worker,
+                                        args=(transducer, self.tasks,
+                                              self.results),
+                                        daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        gc.unfreeze()
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0):
+        return self.transducer.lookup(s, max_results, time_cutoff)
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        return self.transducer.exists(s, time_cutoff)
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        return self.transducer.contains(s, output, time_cutoff)
+
+    def _result(self) -> tuple:
+        """Get the next finished batch, checking that workers are alive.
+
+        Raises RuntimeError if a worker has died, e.g. killed for using too
+        much memory, since its batch would never come.
+        """
+        while True:
+            try:
+                return self.results.get(timeout=WORKER_CHECK)
+            except queue.Empty:
+                dead = [worker for worker in self.workers
+                        if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError("lookup worker died with exit code "
+                                       f"{dead[0].exitcode}") from None
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        """Look up many strings in the worker processes.
+
+        Yields (input, analyses) pairs in input order. An exception from a
+        worker is raised here.
+        """
+        strings = iter(strings)
+        inflight = 0
+        finished = {}
+        sent = 0
+        wanted = 0
+        try:
+            while True:
+                while inflight < 2 * len(self.workers):
+                    batch = list(islice(strings, self.batch_size))
+                    if not batch:
+                        break
+                    self.tasks.put((sent, batch))
+                    sent += 1
+                    inflight += 1
+                if inflight == 0:
+                    break
+                batch_id, results = self._result()
+                inflight -= 1
+                if isinstance(results, Exception):
+                    raise results
+                finished[batch_id] = results
+                while wanted in finished:
+                    yield from finished.pop(wanted)
+                    wanted += 1
+        finally:
+            # throw away what is left if the caller stopped iterating early
+            # or a batch failed
+            try:
+                while inflight > 0:
+                    self._result()
+                    inflight -= 1
+            except RuntimeError:
+                pass  # dead worker, raised already or at next use
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(WORKER_CHECK)
+            if worker.is_alive():
+                # stuck with unread results after a worker died
+                worker.terminate()
+                worker.join()
+
 
+def load_hfst_forked(filename: str,
+                     workers: Optional[int] = None) -> ForkedTransducer:
+    """Load HFST automaton from a named file and fork workers for lookups.
 
-def load_hfst(filename: str) -> pyhfst.Transducer:
-    """Load HFST automaton from a named file."""
-    his = pyhfst.HfstInputStream(filename)
-    return his.read()
+    By default there is one worker per CPU.
+    """
+    return ForkedTransducer(load_hfst_pyhfst(filename), workers)
 
 
 if __name__ == "__main__":
@@ -1,52 +1,454 @@
 #!/usr/bin/env python3
 """Functions for handling HFST stuff as subprocess just."""
 
-from subprocess import Popen, PIPE
+import asyncio
+from contextlib import suppress
+from itertools import cycle
+from os import cpu_count
+from queue import SimpleQueue
+from select import select
+from subprocess import PIPE, Popen
+from threading import Thread
+from time import time
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Optional,
+    Union,
+)
+
+# how many bytes to pull from hfst-lookup's stdout at a time in bulk lookups
+READ_CHUNK_SIZE = 1 << 16
+
+# marks the end of the inputs in lookup_many's writer queue
+_END = object()
+
+
+def parse_lookup_line(line: str) -> Optional[list]:
+    """Parse one line of `hfst-lookup -q` output into [output, weight].
+
+    Returns None for lines that do not carry a result, i.e. unknown words
+    (`+?` or infinite weight) and the blank line terminating a record.
+    """
+    fields = line.rstrip("\r\n").split("\t")
+    if len(fields) == 3:
+        if fields[1].endswith("+?") or fields[2] == "inf":
+            return None
+        return [fields[1], float(fields[2].replace(",", "."))]
+    if len(fields) == 2:
+        if fields[1].endswith("+?"):
+            return None
+        return [fields[1], 0.0]
+    if line.strip() != "":
+        print(f"weird output from hfst-lookup -q: {line}")
+    return None
+
 
 class Transducer:
     def __init__(self):
         self.pipes = None
+        self.filename = None
 
     def load(self, filename: str):
+        self.filename = filename
         self.pipes = Popen(["hfst-lookup", "-q", filename], stdout=PIPE,
                            stdin=PIPE)
 
-    def lookup(self, s: str):
+    def _restart(self):
+        """Replace a hfst-lookup that is stuck in a search."""
+        self.pipes.kill()
+        self.pipes.wait()
+        self.load(self.filename)
+
+    def _read_record_until(self, deadline: float) -> list:
+        """Read one record, giving up and restarting at deadline."""
+        analyses = []
+        rest = b""
+        stdout = self.pipes.stdout
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0 or not select([stdout], [], [], remaining)[0]:
+                self._restart()
+                return analyses
+            chunk = stdout.read1(READ_CHUNK_SIZE)
+            if not chunk:
+                raise RuntimeError("hfst-lookup died mid-lookup")
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                if line.strip() == b"":
+                    return analyses
+                analysis = parse_lookup_line(line.decode("UTF-8"))
+                if analysis:
+                    analyses.append(analysis)
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0):
+        """Look up s, giving at most max_results results.
+
+        hfst-lookup cannot stop a search early, so max_results only cuts
+        the output. With time_cutoff a search that takes longer than so many
+        seconds is killed, with hfst-lookup restarted, and the results
+        read by then are given.
+        """
         if not self.pipes:
             raise RuntimeError  # or something idk
         s = s + "\n"
         self.pipes.stdin.write(s.encode("UTF-8"))
         self.pipes.stdin.flush()
-        reading = True
+        if time_cutoff:
+            analyses = self._read_record_until(time() + time_cutoff)
+        else:
+            analyses = []
+            while True:
+                line = self.pipes.stdout.readline().decode("UTF-8")
+                if line.strip() == "":
+                    break
+                analysis = parse_lookup_line(line)
+                if analysis:
+                    analyses.append(analysis)
+        if max_results:
+            return analyses[:max_results]
+        return analyses
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        """Check if s has any results."""
+        return len(self.lookup(s, 1, time_cutoff)) > 0
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        """Check if output is among results of s."""
+        return any(result[0] == output
+                   for result in self.lookup(s, 0, time_cutoff))
+
+    def _feed(self, strings: Iterable[str], pending: SimpleQueue, stdin):
+        """Write all strings to hfst-lookup, noting each one in pending.
+
+        An exception from strings is put in pending for the reader to raise.
+        """
+        try:
+            for s in strings:
+                line = s.encode("UTF-8") + b"\n"
+                pending.put(s)
+                try:
+                    stdin.write(line)
+                except (OSError, ValueError):
+                    return  # hfst-lookup went away or was stopped
+        except Exception as e:  # raised again by the reader
+            pending.put(e)
+        finally:
+            try:
+                stdin.flush()
+            except (OSError, ValueError):
+                pass  # reader notices that hfst-lookup went away
+            pending.put(_END)
+
+    def _records(self) -> Iterator[list]:
+        """Read hfst-lookup output in big chunks, yielding analyses lists."""
+        lines = []
+        rest = b""
         analyses = []
-        while reading:
-            line = self.pipes.stdout.readline().decode("UTF-8")
-            if line=="":
-                reading = False
-                break
-            fields = line.split("\t")
-            if len(fields) == 3:
-                if fields[1].endswith("+?") or fields[2] == "inf":
-                    continue
-                else:
-                    fields[2] = fields[2].replace(",", ".")
-                    analyses.append([fields[1], float(fields[2])])
-            elif len(fields) == 2:
-                if fields[1].endswith("+?"):
+        while True:
+            chunk = self.pipes.stdout.read1(READ_CHUNK_SIZE)
+            if not chunk:
+                raise RuntimeError("hfst-lookup died mid-lookup")
+            buffered = rest + chunk
+            cut = buffered.rfind(b"\n") + 1
+            rest = buffered[cut:]
+            lines = buffered[:cut].decode("UTF-8").split("\n")
+            lines.pop()
+            for line in lines:
+                if line.strip() == "":
+                    yield analyses
+                    analyses = []
                     continue
-                else:
-                    analyses.append([fields[1], 0.0])
-            elif line.strip() == "":
-                reading = False
+                analysis = parse_lookup_line(line)
+                if analysis:
+                    analyses.append(analysis)
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        """Look up many strings with the inputs pipelined to hfst-lookup.
+
+        Inputs are written from a separate thread while outputs are read in
+        big chunks, so the lookups do not wait for a pipe round-trip each.
+        Yields (input, analyses) pairs in input order, analyses being in the
+        same format that lookup returns. If the caller stops iterating early,
+        hfst-lookup is restarted instead of finishing the remaining inputs.
+        An exception raised by strings is raised here once the inputs before
+        it have been yielded.
+        """
+        if not self.pipes:
+            raise RuntimeError  # or something idk
+        records = self._records()
+        pending = SimpleQueue()
+        writer = Thread(target=self._feed,
+                        args=(strings, pending, self.pipes.stdin),
+                        daemon=True)
+        writer.start()
+        try:
+            while (s := pending.get()) is not _END:
+                if isinstance(s, Exception):
+                    raise s
+                yield s, next(records)
+        except GeneratorExit:
+            if self.pipes and (writer.is_alive() or
+                               pending.get() is not _END):
+                # the writer fails at its next write and stops
+                self._restart()
+            raise
+        finally:
+            writer.join()
+
+    def close(self):
+        if self.pipes:
+            self.pipes.stdin.close()
+            self.pipes.wait()
+            self.pipes = None
+
+
+class TransducerPool:
+    """Several hfst-lookup processes sharing lookups on one automaton.
+
+    Works like Transducer, but bulk lookups are dealt out to the worker
+    processes round-robin so that they run in parallel.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        if not workers:
+            workers = cpu_count() or 1
+        self.workers = [Transducer() for _ in range(workers)]
+        self.turn = 0
+
+    def load(self, filename: str):
+        for worker in self.workers:
+            worker.load(filename)
+
+    def _next_worker(self) -> Transducer:
+        worker = self.workers[self.turn]
+        self.turn = (self.turn + 1) % len(self.workers)
+        return worker
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0):
+        return self._next_worker().lookup(s, max_results, time_cutoff)
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        return self._next_worker().exists(s, time_cutoff)
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        return self._next_worker().contains(s, output, time_cutoff)
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        """Look up many strings spread over all workers.
+
+        Yields (input, analyses) pairs in input order just like
+        Transducer.lookup_many.
+        """
+        queues = [SimpleQueue() for _ in self.workers]
+        failures = []
+
+        def deal():
+            try:
+                for i, s in enumerate(strings):
+                    queues[i % len(queues)].put(s)
+            except Exception as e:  # raised again after the inputs before
+                failures.append(e)
+            finally:
+                for queue in queues:
+                    queue.put(_END)
+
+        dealer = Thread(target=deal, daemon=True)
+        dealer.start()
+        streams = [worker.lookup_many(iter(queue.get, _END))
+                   for worker, queue in zip(self.workers, queues)]
+        try:
+            # the i-th input went to worker i % n, so when the next worker
+            # in turn runs dry all the inputs have been looked up
+            for stream in cycle(streams):
+                result = next(stream, None)
+                if result is None:
+                    break
+                yield result
+            # let the other workers see their ends too
+            for stream in streams:
+                for _ in stream:
+                    pass
+        finally:
+            for stream in streams:
+                stream.close()
+            dealer.join()
+        if failures:
+            raise failures[0]
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+async def _iterate(strings: Union[Iterable[str], AsyncIterable[str]]
+                   ) -> AsyncIterator[str]:
+    """Go through a plain or an async iterable asynchronously."""
+    if isinstance(strings, AsyncIterable):
+        async for s in strings:
+            yield s
+    else:
+        for s in strings:
+            yield s
+
+
+class AsyncTransducer:
+    """Transducer for asyncio programs.
+
+    Each automaton runs in its own hfst-lookup process, so lookups on several
+    automata in one event loop run at the same time. Lookups on the same
+    automaton take turns.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.lock = None
+        self.filename = None
+
+    async def load(self, filename: str):
+        self.filename = filename
+        self.process = await asyncio.create_subprocess_exec(
+            "hfst-lookup", "-q", filename, stdin=PIPE, stdout=PIPE)
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+    async def _restart(self):
+        """Replace a hfst-lookup that is stuck in a search."""
+        self.process.kill()
+        await self.process.wait()
+        await self.load(self.filename)
+
+    async def _read_record(self, analyses: Optional[list] = None) -> list:
+        """Read one record, adding its results to analyses."""
+        if analyses is None:
+            analyses = []
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise RuntimeError("hfst-lookup died mid-lookup")
+            if line.strip() == b"":
+                return analyses
+            analysis = parse_lookup_line(line.decode("UTF-8"))
+            if analysis:
+                analyses.append(analysis)
+
+    async def lookup(self, s: str, max_results: int = 0,
+                     time_cutoff: float = 0.0):
+        """Look up s, with bounds working like in Transducer.lookup."""
+        if not self.process:
+            raise RuntimeError  # or something idk
+        async with self.lock:
+            self.process.stdin.write(s.encode("UTF-8") + b"\n")
+            await self.process.stdin.drain()
+            analyses = []
+            if time_cutoff:
+                try:
+                    await asyncio.wait_for(self._read_record(analyses),
+                                           time_cutoff)
+                except asyncio.TimeoutError:
+                    await self._restart()
             else:
-                print(f"weird output from hfst-lookup -q: {line}")
+                await self._read_record(analyses)
+        if max_results:
+            return analyses[:max_results]
         return analyses
 
+    async def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        """Check if s has any results."""
+        return len(await self.lookup(s, 1, time_cutoff)) > 0
+
+    async def contains(self, s: str, output: str,
+                       time_cutoff: float = 0.0) -> bool:
+        """Check if output is among results of s."""
+        return any(result[0] == output
+                   for result in await self.lookup(s, 0, time_cutoff))
+
+    async def _feed(self, strings, pending: asyncio.Queue):
+        """Write all strings to hfst-lookup, noting each one in pending.
+
+        An exception from strings is put in pending for the reader to raise.
+        """
+        stdin = self.process.stdin
+        try:
+            async for s in _iterate(strings):
+                line = s.encode("UTF-8") + b"\n"
+                pending.put_nowait(s)
+                stdin.write(line)
+                await stdin.drain()
+        except ConnectionError:
+            pass  # hfst-lookup went away, the reader notices
+        except Exception as e:  # raised again by the reader
+            pending.put_nowait(e)
+        finally:
+            pending.put_nowait(_END)
+
+    async def lookup_stream(self, strings) -> AsyncIterator[tuple]:
+        """Look up a stream of strings with the inputs pipelined.
+
+        strings can be a plain or an async iterable. Yields (input, analyses)
+        pairs in input order. If the caller stops iterating early, hfst-lookup
+        is restarted instead of finishing the remaining inputs; close the
+        stream, e.g. with contextlib.aclosing, to let other lookups on the
+        transducer go on at once. An exception raised by strings is raised
+        here once the inputs before it have been yielded.
+        """
+        if not self.process:
+            raise RuntimeError  # or something idk
+        async with self.lock:
+            pending = asyncio.Queue()
+            feeder = asyncio.create_task(self._feed(strings, pending))
+            try:
+                while (s := await pending.get()) is not _END:
+                    if isinstance(s, Exception):
+                        raise s
+                    yield s, await self._read_record()
+            except GeneratorExit:
+                if not feeder.done() or pending.empty() or \
+                        pending.get_nowait() is not _END:
+                    feeder.cancel()
+                    await self._restart()
+                raise
+            finally:
+                feeder.cancel()
+                with suppress(asyncio.CancelledError):
+                    await feeder
+
+    async def close(self):
+        if self.process:
+            self.process.stdin.close()
+            await self.process.wait()
+            self.process = None
+
+
 def load_hfst_pope(filename: str) -> Transducer:
     """Load HFST automaton from a named file."""
     t = Transducer()
     t.load(filename)
     return t
 
+
+def load_hfst_pope_pool(filename: str,
+                        workers: Optional[int] = None) -> TransducerPool:
+    """Load HFST automaton from a named file into a pool of workers.
+
+    By default there is one hfst-lookup process per CPU.
+    """
+    t = TransducerPool(workers)
+    t.load(filename)
+    return t
+
+
+async def load_hfst_async(filename: str) -> AsyncTransducer:
+    """Load HFST automaton from a named file for use with asyncio."""
+    t = AsyncTransducer()
+    await t.load(filename)
+    return t
+
+
 if __name__ == "__main__":
     pass
@@ -1,14 +1,120 @@
 #!/usr/bin/env python3
 """Functions for handling lexc data."""
 
+import gc
+import hashlib
+import multiprocessing
+import os
+import pickle
 import re
-from typing import IO
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import IO, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from .lookupcache import cache_home, fingerprint
 
 GLOBAL_EXCLUSIONS = ["CmpN/Only", "ShCmp", "Cmp/SplitR",
                      " Rreal ", " R ", " RNoun ", " Rnoun ",
                      " Rhyph ", "NOT-TO-LEMMATEST",
                      "Use/Spell-", "SpellNoSugg", "\\+Pref"]
 
+# kinds of lines tokenizelexc gives
+MULTICHARS = "multichars"
+SYMBOLS = "symbols"
+LEXICON = "lexicon"
+ENTRY = "entry"
+
+# one token of a lexc line that has escapes, glosses or regexes in it; a
+# quote with no other quote after it is part of a word
+LEXC_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+    |(?P<comment>!.*)
+    |(?P<semicolon>;)
+    |(?P<gloss>"(?:%.|[^"%])*")
+    |(?P<word>(?:<(?:%.|[^>%])*>)|(?:%.|[^\s!;"%]|"(?=[^"]*$))+|["%])
+""", re.VERBOSE)
+
+# bump when parsing changes so that old cached results are not used
+LEXCCACHE_VERSION = 2
+
+# characters that make an exclusion pattern more than a plain string
+REGEX_SPECIALS = set(".^$*+?{}[]|()")
+
+
+def regexliteral(pattern: str) -> Optional[str]:
+    """Get the plain string that a regex pattern matches.
+
+    Returns None if the pattern uses any regex syntax other than escaping
+    special characters with backslash."""
+    literal = []
+    escaped = False
+    for c in pattern:
+        if escaped:
+            if c.isalnum():
+                return None  # \d, \b and the like
+            literal.append(c)
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c in REGEX_SPECIALS:
+            return None
+        else:
+            literal.append(c)
+    if escaped:
+        return None
+    return "".join(literal)
+
+
+class ExclusionMatcher:
+    """Many exclusion regexes compiled into as few searches as possible.
+
+    Plain string patterns are joined into one alternation that is searched
+    first, the real regexes into another one. Regexes with groups are kept
+    separate so that their back-references still work. Searching stops at
+    the first pattern that matches."""
+
+    def __init__(self, patterns: Iterable[str]):
+        literals = []
+        combinable = []
+        self.regexes = []
+        for pattern in dict.fromkeys(patterns):
+            literal = regexliteral(pattern)
+            if literal is not None:
+                literals.append(literal)
+            elif re.compile(pattern).groups == 0:
+                combinable.append(pattern)
+            else:
+                self.regexes.append(re.compile(pattern))
+        self.literals = None
+        if literals:
+            self.literals = re.compile("|".join(map(re.escape, literals)))
+        if combinable:
+            try:
+                self.regexes.insert(0, re.compile("|".join(
+                    f"(?:{pattern})" for pattern in combinable)))
+            except re.error:
+                # e.g. inline flags only work at the start of a pattern
+                self.regexes[0:0] = [re.compile(pattern)
+                                     for pattern in combinable]
+
+    def search(self, line: str) -> bool:
+        """Check if any of the patterns is found in line."""
+        if self.literals and self.literals.search(line):
+            return True
+        for regex in self.regexes:
+            if regex.search(line):
+                return True
+        return False
+
+
+@lru_cache(maxsize=16)
+def compile_exclusions(patterns: tuple[str, ...]) -> ExclusionMatcher:
+    """Get an ExclusionMatcher for patterns, reusing ones made before."""
+    return ExclusionMatcher(patterns)
+
 
 def hidelexcescapes(s: str) -> str:
     """Encode lexc special characters differently.
@@ -70,62 +176,342 @@ def killflagdiacritics(s: str) -> str:
         s = re.sub("@[CRDPNU].[^@]*@", "", s)
     return s
 
-def scrapelemmas(f: IO[str], exclusions: list[str], debug=False) -> set[str]:
-    """Gets all lemmas from a lexc file."""
-    lemmas = set()
-    for lexcline in f:
-        if not lexcline or lexcline.strip() == "":
+
+class LexcLine(NamedTuple):
+    """One meaningful line of lexc, split into its parts.
+
+    kind is one of MULTICHARS for the Multichar_Symbols or Alphabets line,
+    SYMBOLS for lines in that section, LEXICON and ENTRY. fields has the
+    words before the first semicolon, still escaped, upper and lower the
+    sides of an entry's first word with lower None if there was no colon.
+    """
+
+    kind: str
+    lexicon: Optional[str]
+    upper: str
+    lower: Optional[str]
+    contlex: str
+    comment: str
+    lineno: int
+    filename: str
+    fields: tuple[str, ...]
+    gloss: str
+    semicolons: int
+    text: str
+
+
+def scanlexcline(text: str) -> tuple[list[str], int, str, str]:
+    """Split a line of lexc in one pass.
+
+    Returns the words before the first semicolon, the number of semicolons,
+    the "gloss" and the comment. Escapes are kept in the words and a
+    <regex> is one word."""
+    if "%" not in text and "<" not in text and text.count("\"") in (0, 2):
+        gloss = ""
+        if "\"" in text:
+            start = text.index("\"")
+            end = text.index("\"", start + 1)
+            if "!" not in text[:start]:
+                gloss = text[start + 1:end]
+                text = text[:start] + " " + text[end + 1:]
+        content, _, comment = text.partition("!")
+        semicolons = content.count(";")
+        if semicolons:
+            content = content[:content.index(";")]
+        return content.split(), semicolons, gloss, comment.strip()
+    return scanescapedline(text)
+
+
+def scanescapedline(text: str) -> tuple[list[str], int, str, str]:
+    """Split a line of lexc with escapes or regexes like scanlexcline."""
+    fields = []
+    semicolons = 0
+    gloss = ""
+    comment = ""
+    for token in LEXC_TOKEN_RE.finditer(text):
+        kind = token.lastgroup
+        if kind == "word":
+            if not semicolons:
+                fields.append(token.group())
+        elif kind == "semicolon":
+            semicolons += 1
+        elif kind == "gloss":
+            gloss = token.group()[1:-1]
+        elif kind == "comment":
+            comment = token.group()[1:].strip()
+            break
+    return fields, semicolons, gloss, comment
+
+
+def splitlexc(s: str, separator: str, maxsplit: int = -1) -> list[str]:
+    """Split lexc string at separators that are not escaped."""
+    if "%" not in s:
+        return s.split(separator, maxsplit)
+    parts = []
+    start = 0
+    i = 0
+    while i < len(s):
+        if s[i] == "%":
+            i += 2
             continue
-        excluded = False
-        if exclusions:
-            for exclusion in exclusions:
-                if re.search(exclusion, lexcline):
-                    excluded = True
-            if excluded:
-                continue
-        for exclusion in GLOBAL_EXCLUSIONS:
-            if re.search(exclusion, lexcline):
-                excluded = True
-        if excluded:
+        if s[i] == separator and maxsplit != len(parts):
+            parts.append(s[start:i])
+            start = i + 1
+        i += 1
+    parts.append(s[start:])
+    return parts
+
+
+def unescapelexc(s: str) -> str:
+    """Resolve the % escapes of a lexc string."""
+    if "%" not in s:
+        return s
+    return re.sub("%(.)", r"\1", s)
+
+
+def splitpair(pair: str) -> tuple[str, Optional[str]]:
+    """Split upper:lower pair, giving None for lower if there is no colon."""
+    if "%" in pair:
+        upper, *rest = splitlexc(pair, ":", 1)
+        return upper, rest[0] if rest else None
+    if ":" in pair:
+        upper, _, lower = pair.partition(":")
+        return upper, lower
+    return pair, None
+
+
+def lexclemma(upper: str) -> str:
+    """Get the lemma from the upper side of an entry.
+
+    That is the part before the first tag, without flag diacritics and
+    zeros and with escapes resolved."""
+    upper = killflagdiacritics(upper)
+    if "%" not in upper:
+        return upper.split("+", 1)[0].replace("0", "")
+    lemma = splitlexc(upper, "+", 1)[0]
+    return "".join(part if i % 2 else part.replace("0", "")
+                   for i, part in enumerate(re.split("%(.)", lemma)))
+
+
+def tokenizelexc(f: Iterable[str],
+                 filename: Optional[str] = None) -> Iterator[LexcLine]:
+    """Read lexc line by line, yielding the meaningful lines as LexcLines.
+
+    Blank and comment lines and lines outside the multichar section that
+    have no semicolon are skipped."""
+    if filename is None:
+        filename = getattr(f, "name", "")
+    lexicon = None
+    inmultichars = False
+    for lineno, text in enumerate(f, start=1):
+        fields, semicolons, gloss, comment = scanlexcline(text)
+        if not fields:
+            if semicolons and not inmultichars:
+                yield LexcLine(ENTRY, lexicon, "", None, "", comment, lineno,
+                               filename, (), gloss, semicolons, text)
             continue
-        # preproc
-        lexcline = hidelexcescapes(lexcline)
-        if "!" in lexcline:
-            lexcline = lexcline.split("!")[0]
-        lexcline = lexcline.strip()
-        lexcline = killflagdiacritics(lexcline)
-        lexcline = lexcline.replace("0", "")
-        # see stuff
-        if lexcline.startswith("LEXICON "):
+        upper = ""
+        lower = None
+        contlex = ""
+        if fields[0] in ("Multichar_Symbols", "Alphabets"):
+            inmultichars = True
+            kind = MULTICHARS
+        elif fields[0] == "LEXICON":
+            inmultichars = False
+            lexicon = fields[1] if len(fields) > 1 else ""
+            kind = LEXICON
+        elif inmultichars:
+            kind = SYMBOLS
+        elif semicolons:
+            kind = ENTRY
+            contlex = fields[-1]
+            if len(fields) > 1:
+                upper, lower = splitpair(fields[0])
+        else:
             continue
-        if not lexcline or lexcline == "":
+        yield LexcLine(kind, lexicon, upper, lower, contlex, comment, lineno,
+                       filename, tuple(fields), gloss, semicolons, text)
+
+
+def countlexcwords(text: str) -> int:
+    """Count the words of a lexc line split at whitespace only.
+
+    A semicolon without space before it is a part of the word before it."""
+    text = hidelexcescapes(text).split("!")[0]
+    return len(killflagdiacritics(text).replace("0", "").split())
+
+
+def scrapelemmas(f: IO[str], exclusions: list[str], debug=False) -> set[str]:
+    """Gets all lemmas from a lexc file.
+
+    Entries like `talo N;` without space before the semicolon and entries
+    with +Err tags other than +Err/Orth on either side are left out."""
+    lemmas = set()
+    matcher = compile_exclusions(tuple(exclusions or []) +
+                                 tuple(GLOBAL_EXCLUSIONS))
+    for entry in tokenizelexc(f):
+        if entry.kind != ENTRY or not entry.upper:
             continue
-        if ";" not in lexcline:
+        if matcher.search(entry.text):
             continue
-        if "+Err" in lexcline and "+Err/Orth" not in lexcline:
+        pair = f"{entry.upper}:{entry.lower or ''}"
+        if "+Err" in pair and "+Err/Orth" not in pair:
             continue
-        if len(lexcline.split()) <= 2:
+        if len(entry.fields) == 2 and entry.contlex + ";" in entry.text \
+                and countlexcwords(entry.text) <= 2:
             continue
-        if "§REGEX" in lexcline:
+        if "<" in entry.text and \
+                any(field.startswith("<") for field in entry.fields):
             continue
-        if ":" in lexcline:
-            analysis = unhidelexcescapes(lexcline.split(":")[0])
-            lemma = analysis.split("+")[0]
-            lemma = strippercents(lemma)
-            if not lemma or lemma.strip() == "":
-                continue
-            if debug:
-                print(lemma)
-            lemmas.add(lemma)
-        else:
-            idstringy = unhidelexcescapes(lexcline.split()[0])
-            lemma = idstringy.split("+")[0]
-            lemma = strippercents(lemma)
-            if not lemma or lemma.strip() == "":
-                continue
+        lemma = lexclemma(entry.upper)
+        if not lemma or lemma.strip() == "":
+            continue
+        if debug:
+            print(lemma)
+        lemmas.add(lemma)
+    return lemmas
+
+
+@contextmanager
+def pausedgc():
+    """Keep the garbage collector off while making lots of lasting objects.
+
+    Otherwise it would go through all of them again and again for nothing.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def lexccache_filename(filename: str, what: str) -> Path:
+    """Get the name of the cache file for what was parsed from filename."""
+    key = f"{os.path.abspath(filename)}\0{what}".encode("UTF-8")
+    return cache_home() / "lexc" / f"{hashlib.sha1(key).hexdigest()}.pickle"
+
+
+def write_lexccache(filename: str, cachefilename: Path, parsed, stat=None):
+    """Save parsed data of a lexc file as zlib-compressed pickle.
+
+    The file's size, mtime and content hash are saved along with it."""
+    if stat is None:
+        stat = os.stat(filename)
+    header = (LEXCCACHE_VERSION, stat.st_size, stat.st_mtime_ns,
+              fingerprint(filename))
+    data = zlib.compress(pickle.dumps((header, parsed),
+                                      pickle.HIGHEST_PROTOCOL), 1)
+    cachefilename.parent.mkdir(parents=True, exist_ok=True)
+    temporary = cachefilename.with_suffix(f".{os.getpid()}.tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, cachefilename)
+
+
+def read_lexccache(filename: str, cachefilename: Path):
+    """Get parsed data of a lexc file from cache.
+
+    Returns None if there is no cache or the file has changed since. A file
+    that was only touched is recognised from its hash and its cache is
+    refreshed with the new mtime."""
+    try:
+        data = cachefilename.read_bytes()
+        header, parsed = pickle.loads(zlib.decompress(data))
+    except (OSError, zlib.error, EOFError, ValueError,
+            pickle.UnpicklingError):
+        return None
+    version, size, mtime, sha256 = header
+    stat = os.stat(filename)
+    if version != LEXCCACHE_VERSION:
+        return None
+    if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+        return parsed
+    if fingerprint(filename) != sha256:
+        return None
+    try:
+        write_lexccache(filename, cachefilename, parsed, stat)
+    except OSError:
+        pass  # will hash again next time
+    return parsed
+
+
+def readlexclines(filename: str, cache: bool = True) -> list[LexcLine]:
+    """Get the tokenized lines of a lexc file, from cache if possible."""
+    cachefilename = lexccache_filename(filename, "lines")
+    if cache:
+        with pausedgc():
+            rows = read_lexccache(filename, cachefilename)
+            if rows is not None:
+                return [LexcLine._make(row) for row in rows]
+    with open(filename, encoding="UTF-8") as f:
+        lines = list(tokenizelexc(f))
+    if cache:
+        try:
+            write_lexccache(filename, cachefilename,
+                            [tuple(line) for line in lines])
+        except OSError:
+            pass  # can do without cache
+    return lines
+
+
+def readlemmas(filename: str, exclusions: Optional[list[str]],
+               debug: bool = False, cache: bool = True) -> set[str]:
+    """Get all lemmas from a lexc file like scrapelemmas, cached if possible.
+
+    Cached lemmas are kept separately for each list of exclusions."""
+    what = "lemmas\0" + "\0".join(exclusions or [])
+    cachefilename = lexccache_filename(filename, what)
+    if cache:
+        lemmas = read_lexccache(filename, cachefilename)
+        if lemmas is not None:
             if debug:
-                print(lemma)
-            lemmas.add(lemma)
+                for lemma in sorted(lemmas):
+                    print(lemma)
+            return lemmas
+    with open(filename, encoding="UTF-8") as f:
+        lemmas = scrapelemmas(f, exclusions, debug)
+    if cache:
+        try:
+            write_lexccache(filename, cachefilename, lemmas)
+        except OSError:
+            pass  # can do without cache
+    return lemmas
+
+
+def parallelmap(function: Callable, items: Iterable,
+                workers: Optional[int] = None) -> list:
+    """Run function on each item in a pool of processes.
+
+    The results are in the order of items, so merging them gives the same
+    as running sequentially. By default there is a worker per CPU; with
+    one worker, or one item, everything runs in this process.
+
+    The workers are not forked from this process, which may already hold
+    large automata and running threads, but started from a fresh one."""
+    items = list(items)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [function(item) for item in items]
+    method = "forkserver" \
+        if "forkserver" in multiprocessing.get_all_start_methods() \
+        else "spawn"
+    context = multiprocessing.get_context(method)
+    with ProcessPoolExecutor(workers, context) as executor, pausedgc():
+        return list(executor.map(function, items))
+
+
+def readmanylemmas(filenames: Iterable[str], exclusions: Optional[list[str]],
+                   debug: bool = False, cache: bool = True,
+                   workers: Optional[int] = None) -> set[str]:
+    """Get all lemmas from many lexc files, reading them in parallel."""
+    lemmas = set()
+    reader = partial(readlemmas, exclusions=exclusions, debug=debug,
+                     cache=cache)
+    for more in parallelmap(reader, filenames, workers):
+        lemmas.update(more)
     return lemmas
 
 
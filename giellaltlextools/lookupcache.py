@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Caching of lookup results for HFST automata of any driver."""
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from time import time
+from typing import Iterable, Iterator, Optional
+
+# default bounds of the in-memory cache
+MAX_ENTRIES = 100_000
+MAX_BYTES = 64 * 1024 * 1024
+# how many new results the persistent cache gathers before writing them
+FLUSH_SIZE = 10_000
+# how many inputs are fetched from the persistent cache in one query
+FETCH_SIZE = 500
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "disk_hits", "misses",
+                                     "evictions", "entries", "bytes"])
+
+
+def cache_home() -> Path:
+    """Get the directory for persistent caches of giellaltlextools."""
+    xdg = os.getenv("XDG_CACHE_HOME")
+    if xdg:
+        return Path(xdg) / "giellaltlextools"
+    return Path.home() / ".cache" / "giellaltlextools"
+
+
+def fingerprint(filename: str) -> str:
+    """Hash the contents of a file."""
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def resultsize(s: str, analyses: list) -> int:
+    """Estimate how many bytes a cached lookup result takes."""
+    size = sys.getsizeof(s) + sys.getsizeof(analyses)
+    for analysis in analyses:
+        size += sys.getsizeof(analysis) + sys.getsizeof(analysis[0]) + \
+            sys.getsizeof(analysis[1])
+    return size
+
+
+class LookupStore:
+    """Lookup results of one automaton stored in an SQLite database.
+
+    The results are keyed by a hash of the automaton file, so when the file
+    changes the old results are dropped and the cache starts over. The hash
+    is only recomputed when the size or the mtime of the file has changed.
+    """
+
+    def __init__(self, fstfilename: str, cachedir: Optional[Path] = None):
+        if cachedir is None:
+            cachedir = cache_home()
+        cachedir.mkdir(parents=True, exist_ok=True)
+        # threads may use the store in turns, see drivers.SharedTransducer
+        self.db = sqlite3.connect(cachedir / "lookups.sqlite", timeout=60,
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fsts (path TEXT PRIMARY "
+                        "KEY, size INTEGER, mtime INTEGER, fingerprint TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS lookups (fingerprint "
+                        "TEXT, input TEXT, analyses TEXT, "
+                        "PRIMARY KEY (fingerprint, input))")
+        path = os.path.abspath(fstfilename)
+        stat = os.stat(path)
+        known = self.db.execute("SELECT size, mtime, fingerprint FROM fsts "
+                                "WHERE path = ?", (path,)).fetchone()
+        if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            self.fingerprint = known[2]
+        else:
+            self.fingerprint = fingerprint(path)
+            with self.db:
+                if known and known[2] != self.fingerprint:
+                    self.db.execute("DELETE FROM lookups WHERE fingerprint "
+                                    "= ? AND fingerprint NOT IN (SELECT "
+                                    "fingerprint FROM fsts WHERE path != ?)",
+                                    (known[2], path))
+                self.db.execute("INSERT OR REPLACE INTO fsts VALUES "
+                                "(?, ?, ?, ?)", (path, stat.st_size,
+                                                 stat.st_mtime_ns,
+                                                 self.fingerprint))
+        self.pending = []
+        atexit.register(self.close)
+
+    def get_many(self, strings: Iterable[str]) -> dict:
+        """Get stored analyses of those strings that have been looked up."""
+        strings = list(strings)
+        found = {}
+        for i in range(0, len(strings), FETCH_SIZE):
+            chunk = strings[i:i + FETCH_SIZE]
+            marks = ", ".join("?" * len(chunk))
+            rows = self.db.execute("SELECT input, analyses FROM lookups "
+                                   "WHERE fingerprint = ? AND input IN "
+                                   f"({marks})", [self.fingerprint, *chunk])
+            for s, analyses in rows:
+                found[s] = json.loads(analyses)
+        return found
+
+    def put(self, s: str, analyses: list):
+        self.pending.append((self.fingerprint, s, json.dumps(analyses)))
+        if len(self.pending) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO lookups VALUES "
+                                    "(?, ?, ?)", self.pending)
+            self.pending = []
+
+    def close(self):
+        if self.db:
+            self.flush()
+            self.db.close()
+            self.db = None
+            atexit.unregister(self.close)
+
+
+class CachingTransducer:
+    """Least-recently-used cache in front of a transducer.
+
+    Works with anything that has a lookup method returning the analyses,
+    i.e. both pyhfst and hfst-lookup based transducers. The cache is bounded
+    both by number of entries and by estimated size in bytes; zero means no
+    bound. Results missing from memory are also searched from store, a
+    persistent LookupStore, if one is given.
+    """
+
+    def __init__(self, transducer, max_entries: int = MAX_ENTRIES,
+                 max_bytes: int = MAX_BYTES,
+                 store: Optional[LookupStore] = None):
+        self.transducer = transducer
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.cache = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, s: str):
+        analyses = self.cache.get(s)
+        if analyses is not None:
+            self.cache.move_to_end(s)
+            self.hits += 1
+        return analyses
+
+    def _put(self, s: str, analyses: list):
+        self.cache[s] = analyses
+        self.bytes += resultsize(s, analyses)
+        while self.cache and \
+                ((self.max_entries and len(self.cache) > self.max_entries) or
+                 (self.max_bytes and self.bytes > self.max_bytes)):
+            old, oldanalyses = self.cache.popitem(last=False)
+            self.bytes -= resultsize(old, oldanalyses)
+            self.evictions += 1
+
+    def _fetch(self, strings: list) -> dict:
+        """Get analyses for strings not in memory from store or lookups."""
+        found = {}
+        if self.store:
+            found = self.store.get_many(strings)
+            self.disk_hits += len(found)
+            strings = [s for s in strings if s not in found]
+        self.misses += len(strings)
+        if hasattr(self.transducer, "lookup_many"):
+            fresh = dict(self.transducer.lookup_many(strings))
+        else:
+            fresh = {s: self.transducer.lookup(s) for s in strings}
+        if self.store:
+            for s, analyses in fresh.items():
+                self.store.put(s, analyses)
+        found.update(fresh)
+        return found
+
+    def _cached(self, s: str) -> Optional[list]:
+        """Get the analyses of s from memory or the store if they are there."""
+        analyses = self._get(s)
+        if analyses is None and self.store:
+            analyses = self.store.get_many([s]).get(s)
+            if analyses is not None:
+                self.disk_hits += 1
+                self._put(s, analyses)
+        return analyses
+
+    def lookup(self, s: str, max_results: int = 0,
+               time_cutoff: float = 0.0):
+        """Look up s from cache, store or the transducer.
+
+        Results cut by max_results are not cached. A lookup with time_cutoff
+        is cached when it finished within the cutoff, since then it was not
+        stopped before finding all results.
+        """
+        analyses = self._cached(s)
+        if analyses is None:
+            self.misses += 1
+            if max_results:
+                return self.transducer.lookup(s, max_results, time_cutoff)
+            if time_cutoff:
+                started = time()
+                analyses = self.transducer.lookup(s, 0, time_cutoff)
+                if time() - started >= time_cutoff:
+                    return analyses
+            else:
+                analyses = self.transducer.lookup(s)
+            self._put(s, analyses)
+            if self.store:
+                self.store.put(s, analyses)
+        return analyses[:max_results] if max_results else analyses
+
+    def exists(self, s: str, time_cutoff: float = 0.0) -> bool:
+        """Check if s has results, from cache or with a bounded search."""
+        analyses = self._cached(s)
+        if analyses is None:
+            return self.transducer.exists(s, time_cutoff)
+        return len(analyses) > 0
+
+    def contains(self, s: str, output: str, time_cutoff: float = 0.0) -> bool:
+        """Check if output is among results of s, searching if not cached."""
+        analyses = self._cached(s)
+        if analyses is None:
+            return self.transducer.contains(s, output, time_cutoff)
+        return any(result[0] == output for result in analyses)
+
+    def lookup_many(self, strings: Iterable[str]) -> Iterator[tuple]:
+        """Look up many strings, sending only uncached ones onwards.
+
+        The inputs are collected first so that the misses can be looked up
+        in bulk when the transducer supports it. Yields (input, analyses)
+        pairs in input order.
+        """
+        strings = list(strings)
+        fresh = self._fetch(list(dict.fromkeys(s for s in strings
+                                               if s not in self.cache)))
+        for s in strings:
+            analyses = fresh.pop(s, None)
+            if analyses is not None:
+                self._put(s, analyses)
+            else:
+                analyses = self.lookup(s)
+            yield s, analyses
+
+    def close(self):
+        if self.store:
+            self.store.close()
+        self.transducer.close()
+
+    def cache_info(self) -> CacheInfo:
+        """Get statistics of the cache use so far."""
+        return CacheInfo(self.hits, self.disk_hits, self.misses,
+                         self.evictions, len(self.cache), self.bytes)
+
+
+if __name__ == "__main__":
+    pass
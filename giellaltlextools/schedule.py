@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Ordering lemmas so that tests cut short by a time-out find the most.
+
+Lemmas that failed in the previous run come first, then lemmas whose lexc
+lines are new or changed since then, and last the rest. Within each group
+the lemmas are spread over the lexicons they come from in proportion to
+the lexicon sizes, so any beginning of the order is a stratified sample.
+"""
+
+from random import Random
+from typing import Iterable, Optional
+
+from .lexc import ENTRY, lexclemma, readlexclines
+from .teststate import RunState
+
+
+def lemmalexicons(filenames: Iterable[str],
+                  cache: bool = True) -> dict[str, str]:
+    """Get the lexicon each lemma is first found in."""
+    lexicons: dict[str, str] = {}
+    for filename in filenames:
+        for line in readlexclines(filename, cache):
+            if line.kind != ENTRY or not line.upper:
+                continue
+            lemma = lexclemma(line.upper)
+            if lemma and lemma not in lexicons:
+                lexicons[lemma] = line.lexicon or ""
+    return lexicons
+
+
+def stratified(lemmas: Iterable[str], lexicons: dict[str, str],
+               seed: int = 0) -> list[str]:
+    """Order lemmas evenly across their lexicons.
+
+    Each lexicon is shuffled and its lemmas are placed at even intervals,
+    so that e.g. the first tenth of the result has about a tenth of each
+    lexicon. The order only depends on lemmas, lexicons and seed.
+    """
+    strata: dict[str, list[str]] = {}
+    for lemma in sorted(lemmas):
+        strata.setdefault(lexicons.get(lemma, ""), []).append(lemma)
+    random = Random(seed)
+    keyed = []
+    for lexicon, stratum in sorted(strata.items()):
+        random.shuffle(stratum)
+        for i, lemma in enumerate(stratum):
+            keyed.append(((i + 0.5) / len(stratum), lexicon, lemma))
+    keyed.sort()
+    return [lemma for _, _, lemma in keyed]
+
+
+def prioritise(lemmas: Iterable[str], lexicons: dict[str, str],
+               state: Optional[RunState] = None,
+               seed: int = 0) -> list[str]:
+    """Order lemmas by how likely testing them finds a regression.
+
+    Without state from a previous run the lemmas are only stratified.
+    """
+    failed = []
+    changed = []
+    rest = []
+    for lemma in lemmas:
+        if state and state.failed_before(lemma):
+            failed.append(lemma)
+        elif state and state.changed(lemma):
+            changed.append(lemma)
+        else:
+            rest.append(lemma)
+    return stratified(failed, lexicons, seed) + \
+        stratified(changed, lexicons, seed) + \
+        stratified(rest, lexicons, seed)
+
+
+def plan(lemmas: Iterable[str], lexcfilenames: Iterable[str],
+         state: Optional[RunState] = None, sample: bool = False,
+         cache: bool = True) -> list[str]:
+    """Get lemmas to test in order of testing.
+
+    Lemmas that the state says need no testing are left out. For sampling
+    the lemmas are in random order, otherwise prioritised.
+    """
+    if sample:
+        planned = list(lemmas)
+        Random().shuffle(planned)
+    else:
+        planned = prioritise(lemmas, lemmalexicons(lexcfilenames, cache),
+                             state)
+    if state:
+        planned = list(state.untested(planned))
+    return planned
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""State of earlier test runs for testing only what has changed.
+
+A state file has a section for each test, e.g. one POS of gtlemmatest. The
+section keeps a fingerprint of what the results depend on, that is the
+automata, other input files and test settings, and for each lemma a digest
+of the lexc lines it comes from and whether it passed. As long as the
+fingerprint stays the same, lemmas whose lines have not changed and that
+passed last time need not be tested again.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Iterator, Optional
+
+from .lexc import ENTRY, lexclemma, readlexclines
+from .lookupcache import fingerprint
+
+STATE_VERSION = 1
+# sections of a state file may be saved by several threads
+_saving = Lock()
+
+
+def lemmadigests(filenames: Iterable[str],
+                 cache: bool = True) -> dict[str, str]:
+    """Get a digest of the lexc lines each lemma comes from in the files."""
+    sources: dict[str, list[str]] = {}
+    for filename in filenames:
+        for line in readlexclines(filename, cache):
+            if line.kind != ENTRY or not line.upper:
+                continue
+            lemma = lexclemma(line.upper)
+            if lemma:
+                sources.setdefault(lemma, []).append(line.text.strip())
+    return {lemma: hashlib.blake2b("\n".join(sorted(texts)).encode("UTF-8"),
+                                   digest_size=8).hexdigest()
+            for lemma, texts in sources.items()}
+
+
+def read_state(filename: Path) -> dict:
+    """Read all sections of a state file, none if it is unusable."""
+    try:
+        with open(filename, encoding="UTF-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+        return {}
+    return state.get("sections", {})
+
+
+class RunState:
+    """Results of one section of tests from the previous and this run.
+
+    files are the automata and other files the results depend on, and
+    settings anything else that does. digests map the lemmas to digests of
+    their lexc lines, see lemmadigests. The file hashes are only computed
+    again when the size or mtime of a file has changed.
+    """
+
+    def __init__(self, filename: str, section: str, files: Iterable[str],
+                 digests: dict[str, str], settings: Optional[dict] = None):
+        self.filename = Path(filename)
+        self.section = section
+        self.digests = digests
+        old = read_state(self.filename).get(section, {})
+        oldfiles = old.get("files", {})
+        self.files = {}
+        for name in files:
+            path = os.path.abspath(name)
+            stat = os.stat(path)
+            known = oldfiles.get(path)
+            if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+                self.files[path] = known
+            else:
+                self.files[path] = [stat.st_size, stat.st_mtime_ns,
+                                    fingerprint(path)]
+        self.fingerprint = hashlib.sha256(json.dumps(
+            [sorted((path, known[2]) for path, known in self.files.items()),
+             settings], sort_keys=True).encode("UTF-8")).hexdigest()
+        # results of the previous run, usable for ordering even if the
+        # automaton has changed since
+        self.history = old.get("lemmas", {})
+        self.same = old.get("fingerprint") == self.fingerprint
+        self.previous = self.history if self.same else {}
+        self.results: dict[str, list] = {}
+        self.unchanged = 0
+
+    @property
+    def fresh(self) -> bool:
+        """Whether there is nothing usable from the previous run."""
+        return not self.previous
+
+    def needs_test(self, lemma: str) -> bool:
+        """Check if lemma is new, changed or failed in the previous run."""
+        digest = self.digests.get(lemma)
+        return digest is None or self.previous.get(lemma) != [digest, True]
+
+    def failed_before(self, lemma: str) -> bool:
+        """Check if lemma failed in the previous run."""
+        return lemma in self.history and self.history[lemma][1] is False
+
+    def changed(self, lemma: str) -> bool:
+        """Check if lemma is new or its lines changed after previous run."""
+        return lemma not in self.history or \
+            self.history[lemma][0] != self.digests.get(lemma)
+
+    def untested(self, lemmas: Iterable[str]) -> Iterator[str]:
+        """Leave out lemmas that need no testing, counting them."""
+        for lemma in lemmas:
+            if self.needs_test(lemma):
+                yield lemma
+            else:
+                self.unchanged += 1
+
+    def record(self, lemma: str, passed: bool):
+        """Note the result of testing lemma."""
+        self.results[lemma] = [self.digests.get(lemma), passed]
+
+    def save(self):
+        """Write the results to the state file.
+
+        Results from the previous run are kept for lemmas that were not
+        tested now, so e.g. the failures not reached before a time-out are
+        tested again next time. If the fingerprint has changed, their passes
+        are forgotten, as a result of None, but failures kept for ordering.
+        """
+        lemmas = {}
+        for lemma, (digest, passed) in self.history.items():
+            if lemma in self.digests:
+                lemmas[lemma] = [digest,
+                                 passed if self.same or not passed else None]
+        lemmas.update(self.results)
+        section = {"fingerprint": self.fingerprint, "files": self.files,
+                   "lemmas": lemmas}
+        with _saving:
+            sections = read_state(self.filename)
+            sections[self.section] = section
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            temporary = self.filename.with_name(
+                f"{self.filename.name}.{os.getpid()}.tmp")
+            with open(temporary, "w", encoding="UTF-8") as f:
+                json.dump({"version": STATE_VERSION, "sections": sections},
+                          f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(temporary, self.filename)
+
+
+if __name__ == "__main__":
+    pass
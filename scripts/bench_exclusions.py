@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark exclusion matching of lexc.scrapelemmas.
+
+Compares searching every exclusion regex on every line, as scrapelemmas
+used to do, against the compiled ExclusionMatcher, and reports lines per
+second for both. Give a large stems file as argument, or a synthetic one is
+generated.
+"""
+
+import re
+import sys
+from argparse import ArgumentParser
+from io import StringIO
+from time import perf_counter
+
+from giellaltlextools.gtspelltest import DEFAULT_EXCLUSIONS
+from giellaltlextools.lexc import (
+    GLOBAL_EXCLUSIONS,
+    ExclusionMatcher,
+    scrapelemmas,
+)
+
+
+def synthetic_lines(count: int) -> list[str]:
+    """Make stems-like lexc lines with some excluded ones among them."""
+    tags = ["+Use/MT", "+Err/Orth", " R ", "+Use/-Spell", "+CmpNP/Pref"]
+    lines = []
+    for i in range(count):
+        tag = tags[i // 20 % len(tags)] if i % 20 == 0 else ""
+        lines.append(f"guolli{i}{tag}:guolli{i} GUOLLI \"fish\" ; ! {i}\n")
+    return lines
+
+
+def naive_excluded(lines: list[str], patterns: list[str]) -> int:
+    """Count excluded lines searching each pattern separately."""
+    count = 0
+    for line in lines:
+        excluded = False
+        for pattern in patterns:
+            if re.search(pattern, line):
+                excluded = True
+        count += excluded
+    return count
+
+
+def compiled_excluded(lines: list[str], patterns: list[str]) -> int:
+    """Count excluded lines with an ExclusionMatcher."""
+    matcher = ExclusionMatcher(patterns)
+    return sum(1 for line in lines if matcher.search(line))
+
+
+def bench(name: str, function, *args) -> int:
+    """Run function and print its speed in lines per second."""
+    start = perf_counter()
+    result = function(*args)
+    used = perf_counter() - start
+    print(f"{name}: {len(args[0]) / used:,.0f} lines/s ({used:.2f} s)")
+    return result
+
+
+def main() -> None:
+    """Command-line interface for the benchmark."""
+    argp = ArgumentParser(description=__doc__)
+    argp.add_argument("lexcfile", nargs="?",
+                      help="stems file to benchmark with")
+    argp.add_argument("-n", "--lines", type=int, default=200_000,
+                      help="number of synthetic lines without lexcfile")
+    options = argp.parse_args()
+    if options.lexcfile:
+        with open(options.lexcfile, encoding="UTF-8") as lexcfile:
+            lines = lexcfile.readlines()
+    else:
+        lines = synthetic_lines(options.lines)
+    patterns = DEFAULT_EXCLUSIONS + GLOBAL_EXCLUSIONS
+    print(f"{len(lines)} lines, {len(patterns)} exclusion patterns")
+    before = bench("per-pattern re.search", naive_excluded, lines, patterns)
+    after = bench("ExclusionMatcher", compiled_excluded, lines, patterns)
+    if before != after:
+        print(f"MISMATCH: {before} != {after} lines excluded")
+        sys.exit(1)
+    print(f"{after} lines excluded by both")
+    bench("scrapelemmas in total",
+          lambda lines: scrapelemmas(StringIO("".join(lines)),
+                                     DEFAULT_EXCLUSIONS),
+          lines)
+
+
+if __name__ == "__main__":
+    main()
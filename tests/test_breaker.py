@@ -0,0 +1,48 @@
+import unittest
+
+from giellaltlextools.breaker import SlotBreaker
+
+
+def run(breaker: SlotBreaker, lemmas: list, broken: set) -> int:
+    """Test lemmas given as (slot, contlex), count the tests made."""
+    tested = 0
+    for slot, contlex in lemmas:
+        if breaker.should_test(slot, contlex):
+            tested += 1
+            breaker.record(slot, contlex, (slot, contlex) in broken)
+    return tested
+
+
+class TestSlotBreaker(unittest.TestCase):
+    def test_samples_broken_slot(self):
+        breaker = SlotBreaker(5, 10)
+        tested = run(breaker, [("+Foo", "N")] * 105, {("+Foo", "N")})
+        self.assertEqual(tested, 15)
+        self.assertEqual(breaker.report(),
+                         ["+Foo: failed 5 times in a row, then 10 of 10 "
+                          "sampled, 90 not tested"])
+
+    def test_pass_mends_slot(self):
+        breaker = SlotBreaker(5, 10)
+        run(breaker, [("+Sg", "N")] * 20, {("+Sg", "N")})
+        tested = run(breaker, [("+Sg", "N")] * 20, set())
+        self.assertEqual(tested, 20 - 4)
+        self.assertTrue(breaker.report()[0].endswith(", works again"))
+
+    def test_broken_for_continuation_class(self):
+        breaker = SlotBreaker(5, 10)
+        lemmas = [("+Ess", "N"), ("+Ess", "V")] * 50
+        tested = run(breaker, lemmas, {("+Ess", "V")})
+        self.assertEqual(tested, 50 + 5 + 4)
+        self.assertEqual(len(breaker.report()), 1)
+        self.assertIn("in continuation class V", breaker.report()[0])
+
+    def test_never_breaks_without_limit(self):
+        breaker = SlotBreaker(0)
+        self.assertEqual(run(breaker, [("+Foo", "N")] * 100,
+                             {("+Foo", "N")}), 100)
+        self.assertEqual(breaker.report(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
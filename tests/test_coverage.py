@@ -0,0 +1,40 @@
+import unittest
+from random import Random
+
+from giellaltlextools.coverage import CoverageMonitor, wilson_interval
+
+
+class TestCoverageMonitor(unittest.TestCase):
+    def test_wilson_interval(self):
+        low, high = wilson_interval(0, 100, 1.96)
+        self.assertEqual(low, 0.0)
+        self.assertAlmostEqual(high, 0.037, places=3)
+
+    def test_exact_fail(self):
+        monitor = CoverageMonitor(1000, 100)
+        monitor.add(0)
+        self.assertIsNone(monitor.decided())
+        monitor.add(1)
+        self.assertFalse(monitor.decided())
+        self.assertIn("99.90 %", monitor.report())
+
+    def test_exact_pass(self):
+        monitor = CoverageMonitor(100, 90, max_failures=2, known=100)
+        for _ in range(89):
+            monitor.add(0)
+            self.assertIsNone(monitor.decided())
+        monitor.add(0)
+        self.assertTrue(monitor.decided())
+
+    def test_sample_decides_early(self):
+        random = Random(1)
+        monitor = CoverageMonitor(100_000, 95)
+        while monitor.decided(sampling=True) is None:
+            monitor.add(random.random() < 0.01)
+        self.assertTrue(monitor.decided(sampling=True))
+        self.assertLess(monitor.tested, 1000)
+        self.assertIn("95 % confidence", monitor.report(sampling=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
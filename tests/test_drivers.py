@@ -0,0 +1,119 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from giellaltlextools.drivers import (
+    DRIVERS,
+    SHARED_CHUNK,
+    LazyTransducer,
+    SharedTransducer,
+    close_transducers,
+    exists_batch,
+    load_transducer,
+    parse_driver,
+)
+from giellaltlextools.lookupcache import CachingTransducer
+
+GENERATOR = Path(__file__).parent / "data" / "generator.hfstol"
+
+
+class TestDrivers(unittest.TestCase):
+    def tearDown(self):
+        close_transducers()
+
+    def test_parse_driver(self):
+        self.assertEqual(parse_driver("subprocess-pool:8"),
+                         ("subprocess-pool", 8))
+        self.assertEqual(parse_driver("pyhfst"), ("pyhfst", 0))
+        self.assertEqual(parse_driver("auto"), ("auto", 0))
+        with self.assertRaises(ValueError):
+            parse_driver("subprocess-pool:many")
+        with self.assertRaises(ValueError):
+            parse_driver("pyhfst:4")
+        with self.assertRaises(ValueError):
+            parse_driver("xfst")
+
+    def test_same_file_gives_same_transducer(self):
+        first = load_transducer(str(GENERATOR), "pyhfst")
+        second = load_transducer(str(GENERATOR.parent / ".." / "data" /
+                                     "generator.hfstol"), "pyhfst")
+        self.assertIs(first, second)
+
+    def test_lookup_many_in_order(self):
+        generator = load_transducer(str(GENERATOR), "pyhfst")
+        results = list(generator.lookup_many(["talo+N+Sg+Gen", "xyz",
+                                              "sano+V+Inf"]))
+        self.assertEqual(results, [("talo+N+Sg+Gen", [["talon", 0.0]]),
+                                   ("xyz", []),
+                                   ("sano+V+Inf", [["sanoa", 0.0]])])
+
+    def test_exists_batch(self):
+        generator = load_transducer(str(GENERATOR), "pyhfst")
+        self.assertEqual(exists_batch(generator, ["talo+N+Sg+Gen", "xyz"]),
+                         {"talo+N+Sg+Gen": True, "xyz": False})
+        expired = iter([False, True]).__next__
+        self.assertEqual(exists_batch(generator, ["xyz", "talo+N+Sg+Gen"],
+                                      expired=expired), {"xyz": False})
+
+    def test_lazy_transducer_loads_on_first_lookup(self):
+        generator = LazyTransducer(str(GENERATOR), "pyhfst")
+        self.assertEqual(list(generator.lookup_many([])), [])
+        self.assertFalse(generator.loaded)
+        self.assertEqual(generator.lookup("talo+N+Sg+Gen"), [["talon", 0.0]])
+        self.assertTrue(generator.loaded)
+
+    def test_forking_driver_loads_at_once(self):
+        generator = LazyTransducer(str(GENERATOR), "pyhfst-fork:1")
+        self.assertTrue(generator.loaded)
+        self.assertEqual(generator.lookup("talo+N+Sg+Gen"), [["talon", 0.0]])
+
+    def test_shared_transducer_in_threads(self):
+        generator = SharedTransducer(CachingTransducer(
+            LazyTransducer(str(GENERATOR), "pyhfst")))
+        inputs = [f"{lemma}+N+Sg+Gen" for lemma in ["talo", "kissa"] * 50]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                lambda s: dict(generator.lookup_many([s, "xyz"])), inputs))
+        self.assertEqual(results[0], {"talo+N+Sg+Gen": [["talon", 0.0]],
+                                      "xyz": []})
+        self.assertEqual(results[1]["kissa+N+Sg+Gen"], [["kissan", 0.0]])
+        self.assertEqual(generator.cache_info().misses, 3)
+
+    def test_shared_transducer_takes_turns(self):
+        generator = load_transducer(str(GENERATOR), "pyhfst")
+        chunks = []
+
+        def lookup_many(chunk):
+            chunks.append(len(chunk))
+            return [(s, []) for s in chunk]
+
+        shared = SharedTransducer(generator)
+        with mock.patch.object(generator, "lookup_many",
+                               side_effect=lookup_many):
+            results = list(shared.lookup_many(["xyz"] *
+                                              (2 * SHARED_CHUNK + 1)))
+        self.assertEqual(len(results), 2 * SHARED_CHUNK + 1)
+        self.assertEqual(chunks, [SHARED_CHUNK, SHARED_CHUNK, 1])
+
+    def test_auto_skips_pools(self):
+        loaded = []
+        load_pyhfst = DRIVERS["pyhfst"][0]
+
+        def loader(name):
+            def load(filename, workers=None):
+                loaded.append(name)
+                return load_pyhfst(filename)
+            return load
+
+        with mock.patch.dict(DRIVERS, {
+                "pyhfst": (loader("pyhfst"), False),
+                "pyhfst-fork": (loader("pyhfst-fork"), True)}, clear=True):
+            generator = load_transducer(str(GENERATOR), "auto")
+        self.assertEqual(loaded, ["pyhfst"])
+        self.assertEqual(generator.lookup("talo+N+Sg+Gen"),
+                         [["talon", 0.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
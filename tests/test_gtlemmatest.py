@@ -0,0 +1,72 @@
+import unittest
+from pathlib import Path
+
+from giellaltlextools.gtlemmatest import (
+    generate_batch,
+    prettyprint_json,
+    section_logname,
+    select_sections,
+)
+from giellaltlextools.hfst import load_hfst_pyhfst
+
+GENERATOR = Path(__file__).parent / "data" / "generator.hfstol"
+TAGSTRINGS = ["+N+Pl+Nom", "+N+Sg+Nom", "+N+Sg+Gen"]
+CONFIG = {"generator": "/x/generator.hfstol", "analyser": "/x/analyser.hfstol",
+          "nouns": {"lexcfile": "/x/nouns.lexc", "lemmatags": ["+N"]},
+          "verbs": {"lexcfile": "/x/verbs.lexc", "lemmatags": ["+V"]}}
+
+
+class TestGenerateBatch(unittest.TestCase):
+    def setUp(self):
+        self.generator = load_hfst_pyhfst(str(GENERATOR))
+
+    def test_generates_only_failing_lemmas(self):
+        generated = generate_batch(self.generator, ["talo", "sano"],
+                                   TAGSTRINGS, time_cutoff=10.0)
+        self.assertIsNone(generated["talo"])
+        self.assertEqual([tags for tags, _ in generated["sano"]], TAGSTRINGS)
+        self.assertEqual(generated["sano"][2][1], [])
+
+    def test_exhaustive(self):
+        generated = generate_batch(self.generator, ["talo"], TAGSTRINGS,
+                                   exhaustive=True, time_cutoff=10.0)
+        self.assertEqual([tags for tags, _ in generated["talo"]], TAGSTRINGS)
+        self.assertEqual(generated["talo"][0][1][0][0], "talot")
+
+    def test_bulk_without_time_cutoff(self):
+        generated = generate_batch(self.generator, ["talo"], TAGSTRINGS)
+        self.assertEqual([tags for tags, _ in generated["talo"]], TAGSTRINGS)
+
+    def test_stops_when_expired(self):
+        expired = iter([False, False, True]).__next__
+        generated = generate_batch(self.generator, ["talo", "sano"],
+                                   ["+N+Sg+Nom", "+N+Sg+Gen"],
+                                   time_cutoff=10.0, expired=expired)
+        # sano was not generated in full before the time ran out
+        self.assertEqual(generated, {"talo": None})
+        self.assertEqual(generate_batch(self.generator, ["talo"], TAGSTRINGS,
+                                        expired=lambda: True), {})
+
+
+class TestSections(unittest.TestCase):
+    def test_select_sections(self):
+        self.assertEqual(select_sections(["verbs"], CONFIG), ["verbs"])
+        self.assertEqual(select_sections(["verbs,nouns", "verbs"], CONFIG),
+                         ["verbs", "nouns"])
+        self.assertEqual(select_sections(["all"], CONFIG), ["nouns", "verbs"])
+        with self.assertRaises(ValueError):
+            select_sections(["adjectives"], CONFIG)
+
+    def test_section_logname(self):
+        self.assertEqual(section_logname("logs/lemmas.md", "nouns"),
+                         "logs/lemmas-nouns.md")
+        self.assertEqual(section_logname("{pos}/lemmas.md", "nouns"),
+                         "nouns/lemmas.md")
+
+    def test_prettyprint_keeps_config(self):
+        self.assertIn(".../nouns.lexc", prettyprint_json(CONFIG))
+        self.assertEqual(CONFIG["nouns"]["lexcfile"], "/x/nouns.lexc")
+
+
+if __name__ == "__main__":
+    unittest.main()
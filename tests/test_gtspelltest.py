@@ -1,9 +1,31 @@
 import io
+import subprocess
+import sys
 import unittest
 
-from giellaltlextools.gtspelltest import DEFAULT_EXCLUSIONS, parse_input_lemma
+from giellaltlextools.gtspelltest import (
+    DEFAULT_EXCLUSIONS,
+    FailureCounter,
+    SpellerRun,
+    checkshard,
+    parse_input_lemma,
+    readrecords,
+    writerecords,
+)
 from giellaltlextools.lexc import scrapelemmas
 
+# a speller that marks everything incorrect, slowly after two lemmas
+SPELLER = """
+import sys, time
+for i, line in enumerate(sys.stdin):
+    if i == 2:
+        time.sleep(30)
+    print(f"Input: {line.strip()}\t\t[INCORRECT]", flush=True)
+"""
+OUTPUT = ["", "Input: talo\t\t[CORRECT]", "", "Input: #\t\t[INCORRECT]",
+          "#x\t\t1.5", "", "Input: kisa\t\t[INCORRECT]", "kissa\t\t1.5",
+          ""]
+
 
 class TestGtSpellTestRegression(unittest.TestCase):
     def test_parse_input_lemma_preserves_multiword(self):
@@ -32,5 +54,58 @@ class TestGtSpellTestRegression(unittest.TestCase):
         self.assertNotIn("nospell", lemmas)
 
 
+class TestSpellerRun(unittest.TestCase):
+    def test_reads_all_output(self):
+        with SpellerRun([sys.executable, "-c", SPELLER], ["a", "b"],
+                        30) as run:
+            lines = list(run)
+        self.assertEqual(lines, ["Input: a\t\t[INCORRECT]",
+                                 "Input: b\t\t[INCORRECT]"])
+        self.assertFalse(run.timedout)
+
+    def test_time_out_keeps_output(self):
+        with SpellerRun([sys.executable, "-c", SPELLER],
+                        ["a", "b", "c", "d"], 1) as run:
+            lines = list(run)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(run.timedout)
+
+    def test_stops_speller_when_closed(self):
+        with SpellerRun([sys.executable, "-c", SPELLER],
+                        ["a", "b", "c"], 30) as run:
+            next(iter(run))
+        self.assertIsNotNone(run.process.returncode)
+        self.assertFalse(run.timedout)
+
+    def test_failing_speller(self):
+        with self.assertRaises(subprocess.CalledProcessError), \
+                SpellerRun([sys.executable, "-c", "import sys; sys.exit(3)"],
+                           ["a"], 30) as run:
+            list(run)
+
+
+class TestRecords(unittest.TestCase):
+    def test_readrecords(self):
+        records = list(readrecords(OUTPUT))
+        self.assertEqual([(r.lemma, r.correct) for r in records],
+                         [("talo", True), ("kisa", False)])
+        self.assertEqual(records[1].lines, ["kissa\t\t1.5", ""])
+        self.assertEqual(len(list(readrecords(OUTPUT, {"kisa"}))), 1)
+
+    def test_writerecords(self):
+        log = io.StringIO()
+        writerecords(readrecords(OUTPUT), log)
+        self.assertEqual(log.getvalue(), "\t\nkisa\n\tfollowing suggestions:"
+                         "\n\tkissa\t\t1.5\n")
+
+    def test_failure_limit_over_shards(self):
+        failures = FailureCounter(3)
+        speller = [sys.executable, "-c", SPELLER.replace("i == 2", "i < 0")]
+        results = [checkshard(speller, shard, 30, None, failures)
+                   for shard in (["a", "b"], ["c", "d"])]
+        self.assertEqual(sum(len(records) for records, _ in results), 3)
+        self.assertTrue(failures.full)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,137 @@
+import os
+import signal
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from giellaltlextools.hfst import (
+    ForkedTransducer,
+    load_hfst,
+    load_hfst_pyhfst,
+    lookup_shared,
+    mapcache_usable,
+    prefix_sharing_usable,
+)
+
+GENERATOR = Path(__file__).parent / "data" / "generator.hfstol"
+ANALYSER = Path(__file__).parent / "data" / "analyser.hfstol"
+
+
+class TestMapCache(unittest.TestCase):
+    @unittest.skipUnless(mapcache_usable(), "pyhfst tables not mappable")
+    def test_cached_load_gives_same_lookups(self):
+        with tempfile.TemporaryDirectory() as cachedir, \
+                mock.patch.dict(os.environ, {"XDG_CACHE_HOME": cachedir}):
+            parsed = load_hfst(str(GENERATOR), mapcache=True)
+            mapped = load_hfst(str(GENERATOR), mapcache=True)
+            self.assertIsInstance(mapped.tr.index_table.ti_targets,
+                                  memoryview)
+            for s in ["talo+N+Sg+Gen", "sano+V+Prs+Sg3", "xyz"]:
+                self.assertEqual(mapped.lookup(s), parsed.lookup(s))
+
+    def test_off_by_default(self):
+        with tempfile.TemporaryDirectory() as cachedir, \
+                mock.patch.dict(os.environ, {"XDG_CACHE_HOME": cachedir}):
+            load_hfst_pyhfst(str(GENERATOR))
+            self.assertEqual(os.listdir(cachedir), [])
+
+    def test_unknown_pyhfst_version(self):
+        with mock.patch("giellaltlextools.hfst.metadata.version",
+                        return_value="2.0.0"):
+            self.assertFalse(mapcache_usable())
+
+
+class TestBoundedLookups(unittest.TestCase):
+    def setUp(self):
+        self.generator = load_hfst_pyhfst(str(GENERATOR))
+
+    def test_max_results(self):
+        self.assertEqual(len(self.generator.lookup("talo+N+Sg+Gen", 1)), 1)
+        self.assertEqual(self.generator.lookup("talo+N+Sg+Gen", 5),
+                         self.generator.lookup("talo+N+Sg+Gen"))
+
+    def test_exists(self):
+        self.assertTrue(self.generator.exists("sano+V+Inf"))
+        self.assertFalse(self.generator.exists("sano+N+Sg+Nom"))
+
+    def test_contains(self):
+        self.assertTrue(self.generator.contains("koira+N+Pl+Nom", "koirat"))
+        self.assertFalse(self.generator.contains("koira+N+Pl+Nom", "koira"))
+
+
+@unittest.skipUnless(prefix_sharing_usable(), "pyhfst is not pure Python")
+class TestSharedLookups(unittest.TestCase):
+    def test_same_as_single_lookups(self):
+        queries = [lemma + tags for lemma in ["talo", "koira", "sano", "x"]
+                   for tags in ["", "+N", "+N+Sg+Nom", "+N+Sg+Gen",
+                                "+N+Pl+Nom", "+V+Inf", "+V+Prs+Sg3",
+                                "+N+Sg+Ill", "€+N"]]
+        for filename, strings in [(GENERATOR, queries),
+                                  (ANALYSER, ["talo", "talon", "koirat",
+                                              "sanoo", "sanoa", "", "€"])]:
+            transducer = load_hfst(str(filename), mapcache=False)
+            shared = lookup_shared(transducer.tr, strings)
+            for s in strings:
+                self.assertEqual(shared[s], transducer.lookup(s), s)
+
+    def test_lookup_many_keeps_duplicates(self):
+        generator = load_hfst_pyhfst(str(GENERATOR))
+        strings = ["talo+N+Sg+Gen", "xyz", "talo+N+Sg+Gen"]
+        self.assertEqual([s for s, _ in generator.lookup_many(strings)],
+                         strings)
+
+    def test_discover(self):
+        generator = load_hfst_pyhfst(str(GENERATOR))
+        slots, cut = generator.discover("talo", 4)
+        self.assertFalse(cut)
+        self.assertEqual(sorted(slots),
+                         ["+N+Pl+Nom", "+N+Sg+Gen", "+N+Sg+Nom"])
+        for slot, generations in slots.items():
+            self.assertEqual(generations, generator.lookup("talo" + slot))
+        self.assertEqual(generator.discover("talo", 2), ({}, False))
+        self.assertEqual(generator.discover("talo€", 4), ({}, False))
+        slots, cut = generator.discover("sano", 4, max_slots=1)
+        self.assertTrue(cut)
+        self.assertEqual(len(slots), 1)
+
+
+class TestForkedTransducer(unittest.TestCase):
+    STRINGS = ["talo+N+Sg+Gen", "xyz", "sano+V+Inf", "kissa+N+Pl+Nom"] * 5
+
+    def setUp(self):
+        self.generator = load_hfst_pyhfst(str(GENERATOR))
+        self.forked = ForkedTransducer(self.generator, 2, batch_size=3)
+
+    def tearDown(self):
+        self.forked.close()
+
+    def test_lookup_many_in_order(self):
+        self.assertEqual(list(self.forked.lookup_many(self.STRINGS)),
+                         list(self.generator.lookup_many(self.STRINGS)))
+
+    def test_stop_early(self):
+        results = self.forked.lookup_many(self.STRINGS)
+        self.assertEqual(next(results)[0], "talo+N+Sg+Gen")
+        results.close()
+        # nothing of the first lookups is left to mix with the next ones
+        self.assertEqual(list(self.forked.lookup_many(self.STRINGS)),
+                         list(self.generator.lookup_many(self.STRINGS)))
+
+    def test_worker_failure(self):
+        with self.assertRaises(TypeError):
+            list(self.forked.lookup_many(["talo+N+Sg+Gen", None]))
+        self.assertEqual(list(self.forked.lookup_many(["sano+V+Inf"])),
+                         [("sano+V+Inf", [["sanoa", 0.0]])])
+
+    @mock.patch("giellaltlextools.hfst.WORKER_CHECK", 0.1)
+    def test_worker_killed(self):
+        for worker in self.forked.workers:
+            os.kill(worker.pid, signal.SIGKILL)
+            worker.join()
+        with self.assertRaises(RuntimeError):
+            list(self.forked.lookup_many(self.STRINGS))
+
+
+if __name__ == "__main__":
+    unittest.main()
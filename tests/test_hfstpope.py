@@ -0,0 +1,205 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from giellaltlextools.hfstpope import (
+    load_hfst_async,
+    load_hfst_pope,
+    load_hfst_pope_pool,
+    parse_lookup_line,
+)
+
+GENERATOR = Path(__file__).parent / "data" / "generator.hfstol"
+
+# stands in for hfst-lookup -q, taking a second for inputs starting with slow
+FAKE_HFST_LOOKUP = f"""#!{sys.executable}
+import sys
+import time
+
+import pyhfst
+
+transducer = pyhfst.HfstInputStream(sys.argv[-1]).read()
+for line in sys.stdin:
+    s = line.rstrip("\\n")
+    if s.startswith("slow"):
+        time.sleep(1)
+    results = transducer.lookup(s)
+    if not results:
+        print(f"{{s}}\\t{{s}}+?\\tinf")
+    for result, weight in results:
+        print(f"{{s}}\\t{{result}}\\t{{weight:.6f}}")
+    print(flush=True)
+"""
+
+
+def broken_strings():
+    yield "talo+N+Sg+Gen"
+    yield "xyz"
+    raise KeyError("broken input")
+
+
+async def async_strings(strings):
+    for s in strings:
+        await asyncio.sleep(0)
+        yield s
+
+
+def use_fake_hfst_lookup(testcase: unittest.TestCase):
+    """Put FAKE_HFST_LOOKUP first in PATH for the duration of testcase."""
+    tmp = tempfile.TemporaryDirectory()
+    testcase.addCleanup(tmp.cleanup)
+    fake = Path(tmp.name) / "hfst-lookup"
+    fake.write_text(FAKE_HFST_LOOKUP, encoding="UTF-8")
+    fake.chmod(0o755)
+    path = tmp.name + os.pathsep + os.environ.get("PATH", "")
+    patch = mock.patch.dict(os.environ, {"PATH": path})
+    patch.start()
+    testcase.addCleanup(patch.stop)
+
+
+class TestHfstPopeParsing(unittest.TestCase):
+    def test_parse_lookup_line_weighted(self):
+        line = "talo+N+Sg+Gen\ttalon\t0,500000\n"
+        self.assertEqual(parse_lookup_line(line), ["talon", 0.5])
+
+    def test_parse_lookup_line_drops_unknowns(self):
+        self.assertIsNone(parse_lookup_line("foo\tfoo+?\tinf\n"))
+        self.assertIsNone(parse_lookup_line("foo\tfoo+?\n"))
+        self.assertIsNone(parse_lookup_line("\n"))
+
+
+class TestHfstPopeLookups(unittest.TestCase):
+    def setUp(self):
+        use_fake_hfst_lookup(self)
+        self.generator = load_hfst_pope(str(GENERATOR))
+        self.addCleanup(self.generator.close)
+
+    def test_lookup(self):
+        self.assertEqual(self.generator.lookup("talo+N+Sg+Gen"),
+                         [["talon", 0.0]])
+        self.assertEqual(self.generator.lookup("xyz"), [])
+        self.assertTrue(self.generator.exists("sano+V+Inf"))
+        self.assertFalse(self.generator.contains("koira+N+Pl+Nom", "koira"))
+
+    def test_time_cutoff_restarts(self):
+        start = time.time()
+        self.assertEqual(self.generator.lookup("slow", time_cutoff=0.2), [])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.generator.lookup("talo+N+Sg+Gen",
+                                               time_cutoff=5),
+                         [["talon", 0.0]])
+
+    def test_lookup_many(self):
+        strings = ["talo+N+Sg+Gen", "xyz", "sano+V+Inf"] * 3
+        self.assertEqual(list(self.generator.lookup_many(strings)),
+                         [(s, self.generator.lookup(s)) for s in strings])
+
+    def test_lookup_many_stopped_early(self):
+        start = time.time()
+        results = self.generator.lookup_many(["talo+N+Sg+Gen", "slow1",
+                                              "slow2", "slow3"])
+        self.assertEqual(next(results), ("talo+N+Sg+Gen", [["talon", 0.0]]))
+        results.close()
+        # the slow inputs left were not waited for
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(self.generator.lookup("sano+V+Inf"),
+                         [["sanoa", 0.0]])
+
+    def test_lookup_many_raises_input_errors(self):
+        results = self.generator.lookup_many(broken_strings())
+        self.assertEqual([next(results), next(results)],
+                         [("talo+N+Sg+Gen", [["talon", 0.0]]), ("xyz", [])])
+        with self.assertRaises(KeyError):
+            next(results)
+        self.assertEqual(self.generator.lookup("sano+V+Inf"),
+                         [["sanoa", 0.0]])
+
+    def test_pool_keeps_input_order(self):
+        pool = load_hfst_pope_pool(str(GENERATOR), 2)
+        strings = ["talo+N+Sg+Gen", "xyz", "sano+V+Inf"] * 3
+        try:
+            self.assertEqual(list(pool.lookup_many(strings)),
+                             [(s, self.generator.lookup(s))
+                              for s in strings])
+            with self.assertRaises(KeyError):
+                list(pool.lookup_many(broken_strings()))
+        finally:
+            pool.close()
+
+
+class TestAsyncTransducer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        use_fake_hfst_lookup(self)
+        self.generator = await load_hfst_async(str(GENERATOR))
+
+    async def asyncTearDown(self):
+        await self.generator.close()
+
+    async def test_lookup(self):
+        self.assertEqual(await self.generator.lookup("talo+N+Sg+Gen"),
+                         [["talon", 0.0]])
+        self.assertEqual(await self.generator.lookup("xyz"), [])
+        self.assertTrue(await self.generator.exists("sano+V+Inf"))
+        self.assertFalse(await self.generator.contains("koira+N+Pl+Nom",
+                                                       "koira"))
+
+    async def test_transducers_run_at_the_same_time(self):
+        other = await load_hfst_async(str(GENERATOR))
+        try:
+            start = time.time()
+            results = await asyncio.gather(self.generator.lookup("slow1"),
+                                           other.lookup("slow2"))
+            self.assertEqual(results, [[], []])
+            # both waited for a second, but not in turns
+            self.assertLess(time.time() - start, 1.8)
+        finally:
+            await other.close()
+
+    async def test_time_cutoff_restarts(self):
+        start = time.time()
+        self.assertEqual(await self.generator.lookup("slow",
+                                                     time_cutoff=0.2), [])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(await self.generator.lookup("talo+N+Sg+Gen",
+                                                     time_cutoff=5),
+                         [["talon", 0.0]])
+
+    async def test_lookup_stream_keeps_order(self):
+        strings = ["talo+N+Sg+Gen", "xyz", "sano+V+Inf"] * 3
+        expected = [(s, await self.generator.lookup(s)) for s in strings]
+        self.assertEqual([result async for result in
+                          self.generator.lookup_stream(strings)], expected)
+        self.assertEqual([result async for result in
+                          self.generator.lookup_stream(
+                              async_strings(strings))], expected)
+
+    async def test_lookup_stream_stopped_early(self):
+        start = time.time()
+        results = self.generator.lookup_stream(["talo+N+Sg+Gen", "slow1",
+                                                "slow2", "slow3"])
+        self.assertEqual(await results.__anext__(),
+                         ("talo+N+Sg+Gen", [["talon", 0.0]]))
+        await results.aclose()
+        # the slow inputs left were not waited for
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(await self.generator.lookup("sano+V+Inf"),
+                         [["sanoa", 0.0]])
+
+    async def test_lookup_stream_raises_input_errors(self):
+        results = self.generator.lookup_stream(broken_strings())
+        self.assertEqual([await results.__anext__(),
+                          await results.__anext__()],
+                         [("talo+N+Sg+Gen", [["talon", 0.0]]), ("xyz", [])])
+        with self.assertRaises(KeyError):
+            await results.__anext__()
+        self.assertEqual(await self.generator.lookup("sano+V+Inf"),
+                         [["sanoa", 0.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
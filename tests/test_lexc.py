@@ -0,0 +1,152 @@
+import os
+import tempfile
+import unittest
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from giellaltlextools.lexc import (
+    ENTRY,
+    LEXICON,
+    MULTICHARS,
+    SYMBOLS,
+    ExclusionMatcher,
+    lexclemma,
+    parallelmap,
+    readlemmas,
+    readlexclines,
+    readmanylemmas,
+    regexliteral,
+    scrapelemmas,
+    tokenizelexc,
+)
+
+
+class TestExclusionMatcher(unittest.TestCase):
+    def test_regexliteral(self):
+        self.assertEqual(regexliteral(r"\+Use/MT"), "+Use/MT")
+        self.assertEqual(regexliteral(" R "), " R ")
+        self.assertIsNone(regexliteral(r"\d+"))
+        self.assertIsNone(regexliteral("a.b"))
+
+    def test_literals_and_regexes(self):
+        matcher = ExclusionMatcher([r"\+Use/MT", r"^foo\d", r"(a)\1"])
+        self.assertTrue(matcher.search("talo+N+Use/MT:talo K ;"))
+        self.assertTrue(matcher.search("foo1 K ;"))
+        self.assertTrue(matcher.search("baa K ;"))
+        self.assertFalse(matcher.search("talo+N:talo K ; ! foo1"))
+
+    def test_scrapelemmas_excludes(self):
+        lexc = StringIO("talo+N:talo TALO ;\n"
+                        "koira+N+Use/MT:koira KOIRA ;\n"
+                        "kissa+N:kissa TALO ; ! NOT-TO-LEMMATEST\n")
+        self.assertEqual(scrapelemmas(lexc, [r"\+Use/MT"]), {"talo"})
+
+    def test_scrapelemmas_skips_like_before(self):
+        lexc = StringIO("talo N;\n"
+                        "koira+N:koira N; ! attached semicolon\n"
+                        "tal\"o N ;\n"
+                        "foo+N:foo+Err K ;\n"
+                        "bar+N+Err/Orth:bar K ;\n"
+                        "kissa N ;\n")
+        self.assertEqual(scrapelemmas(lexc, []), {"tal\"o", "bar", "kissa"})
+
+
+class TestTokenizeLexc(unittest.TestCase):
+    def test_kinds_and_fields(self):
+        lexc = StringIO("! header\n"
+                        "Multichar_Symbols\n"
+                        "+N +Sg\n"
+                        "LEXICON Root\n"
+                        "talo+N:talo0 K \"house\" ; ! taken\n"
+                        "K ;\n")
+        lines = list(tokenizelexc(lexc, "test.lexc"))
+        self.assertEqual([line.kind for line in lines],
+                         [MULTICHARS, SYMBOLS, LEXICON, ENTRY, ENTRY])
+        self.assertEqual(lines[1].fields, ("+N", "+Sg"))
+        entry = lines[3]
+        self.assertEqual((entry.lexicon, entry.upper, entry.lower,
+                          entry.contlex, entry.gloss, entry.comment,
+                          entry.lineno, entry.filename),
+                         ("Root", "talo+N", "talo0", "K", "house", "taken",
+                          5, "test.lexc"))
+        self.assertEqual(lines[4].contlex, "K")
+        self.assertIsNone(lines[4].lower)
+
+    def test_escapes(self):
+        entry, = tokenizelexc(["a%:b% c%!+N:a%;b K ; ! x\n"])
+        self.assertEqual((entry.upper, entry.lower, entry.comment),
+                         ("a%:b% c%!+N", "a%;b", "x"))
+        self.assertEqual(entry.semicolons, 1)
+        self.assertEqual(lexclemma(entry.upper), "a:b c!")
+        self.assertEqual(lexclemma("C%+%+0+N"), "C++")
+
+
+class TestLexcCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        patcher = mock.patch.dict(os.environ,
+                                  {"XDG_CACHE_HOME": self.tempdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lexcfile = Path(self.tempdir.name) / "stems.lexc"
+        self.lexcfile.write_text("LEXICON Root\ntalo+N:talo K ;\n",
+                                 encoding="UTF-8")
+
+    def test_cached_until_changed(self):
+        self.assertEqual(readlemmas(str(self.lexcfile), None), {"talo"})
+        with mock.patch("giellaltlextools.lexc.scrapelemmas") as scrape:
+            self.assertEqual(readlemmas(str(self.lexcfile), None), {"talo"})
+            scrape.assert_not_called()
+        with open(self.lexcfile, "a", encoding="UTF-8") as lexc:
+            lexc.write("koira+N:koira K ;\n")
+        self.assertEqual(readlemmas(str(self.lexcfile), None),
+                         {"talo", "koira"})
+
+    def test_cached_lines(self):
+        parsed = readlexclines(str(self.lexcfile))
+        self.assertEqual(readlexclines(str(self.lexcfile)), parsed)
+        self.assertEqual(parsed[1].upper, "talo+N")
+
+
+# set in the test process to see what the workers inherit from it
+INHERITED = []
+
+
+def inherited(_) -> bool:
+    return bool(INHERITED)
+
+
+class TestParallelIngestion(unittest.TestCase):
+    def test_parallelmap_keeps_order(self):
+        self.assertEqual(parallelmap(abs, range(-20, 0), 4),
+                         list(range(20, 0, -1)))
+
+    def test_workers_do_not_inherit_state(self):
+        INHERITED.append(True)
+        try:
+            self.assertEqual(parallelmap(inherited, range(4), 2),
+                             [False] * 4)
+        finally:
+            INHERITED.clear()
+
+    def test_same_as_sequential(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            filenames = []
+            for i in range(4):
+                lexcfile = Path(tempdir) / f"stems{i}.lexc"
+                lexcfile.write_text("LEXICON Root\n" + "".join(
+                    f"w{i}x{j}+N:w{i}x{j} K ;\n" for j in range(50)),
+                    encoding="UTF-8")
+                filenames.append(str(lexcfile))
+            sequential = readmanylemmas(filenames, None, cache=False,
+                                        workers=1)
+            parallel = readmanylemmas(filenames, None, cache=False,
+                                      workers=3)
+        self.assertGreater(len(sequential), 100)
+        self.assertEqual(parallel, sequential)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from giellaltlextools.lookupcache import CachingTransducer, LookupStore
+
+
+class CountingTransducer:
+    def __init__(self):
+        self.lookups = []
+        self.delay = 0.0
+        self.closed = False
+
+    def lookup(self, s, max_results=0, time_cutoff=0.0):
+        self.lookups.append(s)
+        if time_cutoff and self.delay:
+            time.sleep(min(self.delay, time_cutoff))
+        return [[s.upper(), 0.0]]
+
+    def exists(self, s, time_cutoff=0.0):
+        self.lookups.append(f"exists {s}")
+        return True
+
+    def contains(self, s, output, time_cutoff=0.0):
+        self.lookups.append(f"contains {s}")
+        return s.upper() == output
+
+    def close(self):
+        self.closed = True
+
+
+class TestCachingTransducer(unittest.TestCase):
+    def test_repeated_lookups_hit_cache(self):
+        inner = CountingTransducer()
+        cached = CachingTransducer(inner)
+        self.assertEqual(cached.lookup("talo"), [["TALO", 0.0]])
+        self.assertEqual(cached.lookup("talo"), [["TALO", 0.0]])
+        self.assertEqual(inner.lookups, ["talo"])
+        info = cached.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        inner = CountingTransducer()
+        cached = CachingTransducer(inner, max_entries=2)
+        cached.lookup("a")
+        cached.lookup("b")
+        cached.lookup("a")
+        cached.lookup("c")
+        cached.lookup("a")
+        cached.lookup("b")
+        self.assertEqual(inner.lookups, ["a", "b", "c", "b"])
+        self.assertEqual(cached.cache_info().evictions, 2)
+
+    def test_lookup_many_keeps_order_and_deduplicates(self):
+        inner = CountingTransducer()
+        cached = CachingTransducer(inner)
+        results = list(cached.lookup_many(["b", "a", "b"]))
+        self.assertEqual([s for s, _ in results], ["b", "a", "b"])
+        self.assertEqual(inner.lookups, ["b", "a"])
+
+    def test_lookups_finished_within_cutoff_are_cached(self):
+        inner = CountingTransducer()
+        cached = CachingTransducer(inner)
+        cached.lookup("a", time_cutoff=1.0)
+        cached.lookup("a", time_cutoff=1.0)
+        self.assertEqual(inner.lookups, ["a"])
+        inner.delay = 0.05
+        cached.lookup("b", time_cutoff=0.01)
+        cached.lookup("b", time_cutoff=0.01)
+        self.assertEqual(inner.lookups, ["a", "b", "b"])
+        self.assertEqual(cached.cache_info().entries, 1)
+
+    def test_exists_and_contains_use_cache(self):
+        inner = CountingTransducer()
+        cached = CachingTransducer(inner)
+        self.assertTrue(cached.contains("a", "A"))
+        self.assertTrue(cached.exists("a"))
+        cached.lookup("b")
+        self.assertTrue(cached.contains("b", "B"))
+        self.assertFalse(cached.contains("b", "b"))
+        self.assertTrue(cached.exists("b"))
+        self.assertEqual(inner.lookups, ["contains a", "exists a", "b"])
+
+    def test_close_closes_transducer(self):
+        inner = CountingTransducer()
+        CachingTransducer(inner).close()
+        self.assertTrue(inner.closed)
+
+
+class TestLookupStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cachedir = Path(self.tmp.name) / "cache"
+        self.fst = Path(self.tmp.name) / "generator.hfstol"
+        self.fst.write_bytes(b"automaton")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def lookups(self, strings: list) -> tuple:
+        """Look up strings through a new store, give inner lookups and info."""
+        inner = CountingTransducer()
+        cached = CachingTransducer(inner,
+                                   store=LookupStore(str(self.fst),
+                                                     self.cachedir))
+        results = [cached.lookup(s) for s in strings]
+        cached.close()
+        return results, inner.lookups, cached.cache_info()
+
+    def test_results_kept_between_runs(self):
+        self.lookups(["a", "b"])
+        results, looked_up, info = self.lookups(["a", "b", "c"])
+        self.assertEqual(results, [[["A", 0.0]], [["B", 0.0]],
+                                   [["C", 0.0]]])
+        self.assertEqual(looked_up, ["c"])
+        self.assertEqual((info.disk_hits, info.misses), (2, 1))
+
+    def test_changed_automaton_drops_results(self):
+        self.lookups(["a"])
+        self.fst.write_bytes(b"another automaton")
+        _, looked_up, _ = self.lookups(["a"])
+        self.assertEqual(looked_up, ["a"])
+
+    def test_touched_automaton_keeps_results(self):
+        self.lookups(["a"])
+        stat = self.fst.stat()
+        os.utime(self.fst, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        _, looked_up, _ = self.lookups(["a"])
+        self.assertEqual(looked_up, [])
+
+    def test_close_writes_pending_results(self):
+        with mock.patch("giellaltlextools.lookupcache.atexit") as at_exit:
+            store = LookupStore(str(self.fst), self.cachedir)
+            at_exit.register.assert_called_once_with(store.close)
+            store.put("a", [["A", 0.0]])
+            other = LookupStore(str(self.fst), self.cachedir)
+            self.assertEqual(other.get_many(["a"]), {})
+            store.close()
+            at_exit.unregister.assert_called_once_with(store.close)
+            self.assertEqual(other.get_many(["a"]), {"a": [["A", 0.0]]})
+            store.close()
+            other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from unittest import mock
+
+from giellaltlextools.schedule import prioritise, stratified
+
+
+class TestSchedule(unittest.TestCase):
+    def test_stratified_is_proportional(self):
+        lexicons = {f"n{i}": "N" for i in range(30)}
+        lexicons.update({f"v{i}": "V" for i in range(10)})
+        order = stratified(lexicons, lexicons)
+        self.assertEqual(sorted(order), sorted(lexicons))
+        self.assertEqual(sum(lemma[0] == "v" for lemma in order[:8]), 2)
+        self.assertEqual(order, stratified(reversed(order), lexicons))
+
+    def test_failures_and_changes_first(self):
+        state = mock.Mock()
+        state.failed_before = lambda lemma: lemma == "c"
+        state.changed = lambda lemma: lemma in {"a", "d"}
+        order = prioritise("abcde", {}, state)
+        self.assertEqual(order[0], "c")
+        self.assertEqual(sorted(order[1:3]), ["a", "d"])
+        self.assertEqual(sorted(order[3:]), ["b", "e"])
+
+
+if __name__ == "__main__":
+    unittest.main()
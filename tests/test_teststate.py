@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from giellaltlextools.teststate import RunState, lemmadigests
+
+
+class TestRunState(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        patcher = mock.patch.dict(os.environ,
+                                  {"XDG_CACHE_HOME": self.tempdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dir = Path(self.tempdir.name)
+        self.lexcfile = self.dir / "stems.lexc"
+        self.lexcfile.write_text("LEXICON Root\ntalo+N:talo K ;\n"
+                                 "koira+N:koira K ;\nkissa+N:kissa K ;\n",
+                                 encoding="UTF-8")
+        self.fstfile = self.dir / "generator.hfstol"
+        self.fstfile.write_bytes(b"fst")
+        self.statefile = str(self.dir / "state.json")
+
+    def run_state(self, failing: set) -> RunState:
+        digests = lemmadigests([str(self.lexcfile)])
+        state = RunState(self.statefile, "nouns", [str(self.fstfile)],
+                         digests, {"tags": ["+N"]})
+        for lemma in state.untested(sorted(digests)):
+            state.record(lemma, lemma not in failing)
+        state.save()
+        return state
+
+    def test_only_changed_and_failed_again(self):
+        self.assertTrue(self.run_state({"koira"}).fresh)
+        state = self.run_state(set())
+        self.assertEqual(sorted(state.results), ["koira"])
+        self.assertEqual(state.unchanged, 2)
+        with open(self.lexcfile, "a", encoding="UTF-8") as lexc:
+            lexc.write("talo+N+Use/NG:talo K ;\nhiiri+N:hiiri K ;\n")
+        state = self.run_state(set())
+        self.assertEqual(sorted(state.results), ["hiiri", "talo"])
+
+    def test_new_automaton_tests_all(self):
+        self.run_state(set())
+        self.fstfile.write_bytes(b"new fst")
+        state = self.run_state(set())
+        self.assertEqual(state.unchanged, 0)
+        self.assertEqual(len(state.results), 3)
+
+    def test_old_failures_kept_for_ordering(self):
+        self.run_state({"koira"})
+        self.fstfile.write_bytes(b"new fst")
+        digests = lemmadigests([str(self.lexcfile)])
+        state = RunState(self.statefile, "nouns", [str(self.fstfile)],
+                         digests, {"tags": ["+N"]})
+        self.assertTrue(state.failed_before("koira"))
+        state.save()
+        state = RunState(self.statefile, "nouns", [str(self.fstfile)],
+                         digests, {"tags": ["+N"]})
+        self.assertTrue(state.failed_before("koira"))
+        self.assertTrue(state.needs_test("talo"))
+
+
+if __name__ == "__main__":
+    unittest.main()